@@ -0,0 +1,254 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+
+#**********************************************************************
+# Per-call AWS API metrics
+#**********************************************************************
+# Opt-in instrumentation hooked into botocore's event system. For every service and operation it
+# counts calls, errors, retries (RetryAttempts of each response), throttled attempts and bytes
+# sent and received, and keeps a latency histogram of whole calls, retries and backoff included.
+# Handlers only touch a dict under a lock, so the cost per call is a few microseconds.
+#
+# It is switched on for every script through the shared client factory by setting
+#   PHOTOPROJECT_API_METRICS=1               print a summary at exit
+#   PHOTOPROJECT_API_METRICS_JSON=<path>     also write the metrics as JSON at exit
+#   PHOTOPROJECT_API_METRICS_PROM=<path>     also write a Prometheus textfile at exit
+# or with the --metrics options of python -m photoproject.
+
+METRICS_ENV = 'PHOTOPROJECT_API_METRICS'
+METRICS_JSON_ENV = 'PHOTOPROJECT_API_METRICS_JSON'
+METRICS_PROM_ENV = 'PHOTOPROJECT_API_METRICS_PROM'
+
+# Upper bounds of the latency buckets in seconds; the last bucket is +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+THROTTLE_CODES = ('Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+                  'TooManyRequestsException', 'ProvisionedThroughputExceededException', 'RequestLimitExceeded',
+                  'SlowDown', 'RequestThrottled', 'PriorRequestNotComplete', 'BandwidthLimitExceeded')
+STARTED_CONTEXT_KEY = 'api_metrics_started'
+
+enabled = False
+json_path = None
+prometheus_path = None
+operations = {}
+metrics_lock = threading.Lock()
+
+
+def new_operation_metrics():
+    return {'calls': 0, 'errors': 0, 'retries': 0, 'throttles': 0, 'bytes_sent': 0, 'bytes_received': 0,
+            'latency_sum': 0.0, 'latency_max': 0.0, 'latency_buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+
+
+def operation_key(event_name):
+    # Event names look like 'after-call.secrets-manager.GetSecretValue'
+    _, service, operation = event_name.split('.', 2)
+    return service, operation
+
+
+def update(event_name, **changes):
+    key = operation_key(event_name)
+    with metrics_lock:
+        metrics = operations.get(key)
+        if metrics is None:
+            metrics = operations[key] = new_operation_metrics()
+        for name, value in changes.items():
+            metrics[name] += value
+
+
+#**********************************************************************
+# botocore event handlers
+#**********************************************************************
+def record_start(context, **kwargs):
+    context[STARTED_CONTEXT_KEY] = time.perf_counter()
+
+
+def record_latency(event_name, context, error):
+    started = context.get(STARTED_CONTEXT_KEY)
+    if started is None:
+        return
+    latency = time.perf_counter() - started
+    bucket = bisect.bisect_left(LATENCY_BUCKETS, latency)
+    key = operation_key(event_name)
+    with metrics_lock:
+        metrics = operations.get(key)
+        if metrics is None:
+            metrics = operations[key] = new_operation_metrics()
+        metrics['calls'] += 1
+        metrics['errors'] += error
+        metrics['latency_sum'] += latency
+        metrics['latency_max'] = max(metrics['latency_max'], latency)
+        metrics['latency_buckets'][bucket] += 1
+
+
+def response_size(http_response, parsed, model):
+    length = http_response.headers.get('content-length')
+    if length and length.isdigit():
+        return int(length)
+    if model.has_streaming_output:
+        # Streaming bodies haven't been read yet and must not be read here
+        return parsed.get('ContentLength', 0)
+    # Other bodies were already read to parse them
+    return len(http_response.content or b'')
+
+
+def record_response(event_name, http_response, parsed, model, context, **kwargs):
+    record_latency(event_name, context, http_response.status_code >= 300)
+    update(event_name, retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+           bytes_received=response_size(http_response, parsed, model))
+
+
+def record_failure(event_name, context, **kwargs):
+    # Raised before a response arrived, e.g. a connection error after the last retry
+    record_latency(event_name, context, True)
+
+
+def record_attempt(event_name, response=None, **kwargs):
+    if response is not None and response[1].get('Error', {}).get('Code') in THROTTLE_CODES:
+        update(event_name, throttles=1)
+
+
+def body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    if hasattr(body, 'seek') and hasattr(body, 'tell'):
+        try:
+            position = body.tell()
+            size = body.seek(0, os.SEEK_END) - position
+            body.seek(position)
+            return size
+        except (OSError, ValueError):
+            return 0
+    return 0
+
+
+def record_request(event_name, request, **kwargs):
+    # Fires for every attempt, so resent bodies are counted again. aws-chunked uploads (S3 with
+    # checksums) carry the payload size in their own header
+    length = request.headers.get('X-Amz-Decoded-Content-Length') or request.headers.get('Content-Length')
+    update(event_name, bytes_sent=int(length) if length else body_size(request.body))
+
+
+def attach(client):
+    """Register the metric handlers on one client."""
+    events = client.meta.events
+    events.register('before-call', record_start)
+    events.register('after-call', record_response)
+    events.register('after-call-error', record_failure)
+    events.register('needs-retry', record_attempt)
+    events.register('request-created', record_request)
+
+
+#**********************************************************************
+# Switching it on
+#**********************************************************************
+def enable(json_output=None, prometheus_output=None, summary=True):
+    """Instrument every client the shared factory builds from now on (and those it already built)."""
+    global enabled, json_path, prometheus_path
+    from Utilities import aws_clients
+
+    json_path = json_output or json_path
+    prometheus_path = prometheus_output or prometheus_path
+    if enabled:
+        return
+    enabled = True
+    aws_clients.add_client_hook(attach)
+    atexit.register(report, summary)
+
+
+def enable_from_environment():
+    if os.environ.get(METRICS_ENV) or os.environ.get(METRICS_JSON_ENV) or os.environ.get(METRICS_PROM_ENV):
+        enable(os.environ.get(METRICS_JSON_ENV), os.environ.get(METRICS_PROM_ENV),
+               summary=os.environ.get(METRICS_ENV, '1') != '0')
+
+
+def reset():
+    with metrics_lock:
+        operations.clear()
+
+
+#**********************************************************************
+# Reports
+#**********************************************************************
+def snapshot():
+    """Return a copy of the metrics as {'service.Operation': {...}}."""
+    with metrics_lock:
+        return {f"{service}.{operation}": dict(metrics, latency_buckets=list(metrics['latency_buckets']))
+                for (service, operation), metrics in operations.items()}
+
+
+def latency_quantile(buckets, quantile):
+    """Upper bound of the histogram bucket holding the quantile, None if it is in the +Inf bucket."""
+    target = quantile * sum(buckets)
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS, buckets):
+        seen += count
+        if seen >= target:
+            return bound
+    return None
+
+
+def print_summary(metrics):
+    if not metrics:
+        print("AWS API metrics: no calls made.")
+        return
+    print("AWS API metrics (latency p50/p95 are histogram bucket bounds):")
+    print(f"  {'operation':<45} {'calls':>6} {'errors':>6} {'retries':>7} {'throttled':>9} "
+          f"{'total s':>8} {'mean ms':>8} {'p95 ms':>7} {'sent':>10} {'received':>10}")
+    for name, values in sorted(metrics.items(), key=lambda item: item[1]['latency_sum'], reverse=True):
+        calls = values['calls'] or 1
+        p95 = latency_quantile(values['latency_buckets'], 0.95)
+        p95_text = f"{p95 * 1000:.0f}" if p95 is not None else f">{LATENCY_BUCKETS[-1] * 1000:.0f}"
+        print(f"  {name:<45} {values['calls']:>6} {values['errors']:>6} {values['retries']:>7} "
+              f"{values['throttles']:>9} {values['latency_sum']:>8.2f} {values['latency_sum'] / calls * 1000:>8.1f} "
+              f"{p95_text:>7} {values['bytes_sent']:>10} {values['bytes_received']:>10}")
+
+
+def write_atomically(path, text):
+    # Textfile collectors may read at any moment, so never expose a half-written file
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w') as output:
+        output.write(text)
+    os.replace(temporary_path, path)
+
+
+def prometheus_text(metrics):
+    counters = (('calls', 'photoproject_aws_api_calls_total', 'AWS API calls'),
+                ('errors', 'photoproject_aws_api_errors_total', 'AWS API calls that failed'),
+                ('retries', 'photoproject_aws_api_retries_total', 'Retries made by botocore'),
+                ('throttles', 'photoproject_aws_api_throttles_total', 'Attempts rejected by throttling'),
+                ('bytes_sent', 'photoproject_aws_api_sent_bytes_total', 'Request body bytes sent'),
+                ('bytes_received', 'photoproject_aws_api_received_bytes_total', 'Response body bytes received'))
+    lines = []
+    labelled = [(f'service="{name.split(".", 1)[0]}",operation="{name.split(".", 1)[1]}"', values)
+                for name, values in sorted(metrics.items())]
+    for field, metric, help_text in counters:
+        lines += [f"# HELP {metric} {help_text}.", f"# TYPE {metric} counter"]
+        lines += [f"{metric}{{{labels}}} {values[field]}" for labels, values in labelled]
+
+    metric = 'photoproject_aws_api_latency_seconds'
+    lines += [f"# HELP {metric} Latency of whole AWS API calls, retries included.", f"# TYPE {metric} histogram"]
+    for labels, values in labelled:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values['latency_buckets']):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{metric}_sum{{{labels}}} {values['latency_sum']}")
+        lines.append(f"{metric}_count{{{labels}}} {values['calls']}")
+    return '\n'.join(lines) + '\n'
+
+
+def report(summary=True):
+    """Print the summary and write the JSON and Prometheus files that were asked for."""
+    metrics = snapshot()
+    if summary:
+        print_summary(metrics)
+    if json_path:
+        write_atomically(json_path, json.dumps({'latency_buckets': list(LATENCY_BUCKETS), 'operations': metrics},
+                                               indent=4))
+    if prometheus_path:
+        write_atomically(prometheus_path, prometheus_text(metrics))
@@ -0,0 +1,109 @@
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+#**********************************************************************
+# Shared AWS clients
+#**********************************************************************
+# Building a client costs tens of milliseconds and each one brings its own connection pool, so
+# every script asks this module instead of calling boto3.client() itself. A client is created on
+# first use, once per service and region, and then shared: botocore clients are thread safe, only
+# creating them isn't, so creation happens under a lock on a session owned by this module.
+# Callers running many workers ask for a pool at least that large; the shared client is rebuilt
+# with the bigger pool once and keeps it from then on. Functions added with add_client_hook() are
+# called with every new client, which is how Utilities.api_metrics instruments them.
+
+max_pool_connections = 32
+retry_mode = 'standard'  # 'legacy', 'standard' or 'adaptive' (client-side rate limiting)
+max_attempts = 5  # Including the first try
+connect_timeout = 5
+read_timeout = 60
+
+session = None
+clients = {}
+client_hooks = []
+clients_lock = threading.Lock()
+
+
+def configure(pool_connections=None, retries=None, attempts=None, connect=None, read=None):
+    """Change the client settings. Clients already built are dropped and rebuilt on next use."""
+    global max_pool_connections, retry_mode, max_attempts, connect_timeout, read_timeout
+    with clients_lock:
+        if pool_connections is not None:
+            max_pool_connections = pool_connections
+        if retries is not None:
+            retry_mode = retries
+        if attempts is not None:
+            max_attempts = attempts
+        if connect is not None:
+            connect_timeout = connect
+        if read is not None:
+            read_timeout = read
+        clients.clear()
+
+
+def client_config(pool_connections):
+    return Config(max_pool_connections=pool_connections, connect_timeout=connect_timeout, read_timeout=read_timeout,
+                  retries={'mode': retry_mode, 'total_max_attempts': max_attempts})
+
+
+def get_session():
+    global session
+    if session is None:
+        # Metrics are switched on by environment variables, checked once before the first client
+        from Utilities.api_metrics import enable_from_environment
+        enable_from_environment()
+    with clients_lock:
+        if session is None:
+            session = boto3.session.Session()
+        return session
+
+
+def add_client_hook(hook):
+    """Call hook(client) for every client created from now on and for those already created."""
+    with clients_lock:
+        client_hooks.append(hook)
+        for client, _ in clients.values():
+            hook(client)
+
+
+def get_client(service, region_name=None, min_pool_connections=None):
+    """Return the shared client for a service, creating it on first use."""
+    key = (service, region_name)
+    pool_connections = max(max_pool_connections, min_pool_connections or 0)
+    shared = clients.get(key)
+    if shared and shared[1] >= pool_connections:
+        return shared[0]
+
+    aws_session = get_session()
+    with clients_lock:
+        shared = clients.get(key)
+        if shared is None or shared[1] < pool_connections:
+            client = aws_session.client(service, region_name=region_name, config=client_config(pool_connections))
+            for hook in client_hooks:
+                hook(client)
+            shared = clients[key] = (client, pool_connections)
+        return shared[0]
+
+
+def reset_clients():
+    """Forget every client and the session, e.g. after switching credentials or starting a mock."""
+    global session
+    with clients_lock:
+        clients.clear()
+        session = None
+
+
+def start_local_mock():
+    """Send every AWS call to an in-process moto mock instead of AWS. Returns the started mock."""
+    # moto is a test dependency and slow to import, so it is only loaded when asked for
+    from moto import mock_aws
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    mock = mock_aws()
+    mock.start()
+    # Clients built before the mock started would still point at AWS
+    reset_clients()
+    return mock
@@ -1,7 +1,7 @@
-import boto3
+from Utilities.aws_clients import get_client
 
 def delete_lambda_role(role_name):
-    iam_client = boto3.client('iam')
+    iam_client = get_client('iam')
 
     try:
         # Delete the role
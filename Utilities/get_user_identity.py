@@ -1,7 +1,7 @@
-import boto3
+from Utilities.aws_clients import get_client
 
 # Initialize boto3 STS client
-sts_client = boto3.client('sts')
+sts_client = get_client('sts')
 
 # Call the STS get-caller-identity API
 response = sts_client.get_caller_identity()
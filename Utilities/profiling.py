@@ -0,0 +1,220 @@
+import argparse
+import collections
+import contextlib
+import os
+import runpy
+import sys
+import threading
+import time
+
+#**********************************************************************
+# CPU and memory profiling
+#**********************************************************************
+# profiling() runs the code inside it under cProfile, or with a sample interval under a stack
+# sampler cheap enough for long runs, and under tracemalloc. For an output prefix it writes
+#   <prefix>.prof     the cProfile dump (python -m pstats <prefix>.prof, snakeviz, ...)
+#   <prefix>.folded   the sampled stacks in collapsed format (flamegraph.pl, speedscope)
+#   <prefix>.txt      the top functions, and the top allocation sites near the memory peak and at exit
+# Both cover every thread, so the upload and discovery pools show up. A watcher thread snapshots
+# the allocations whenever traced memory grows past the last snapshot, which catches large
+# short-lived buffers such as whole files read into memory even after they were freed.
+#
+# The CLIs take --profile, --profile-output, --profile-top and --profile-sample (see
+# add_profile_arguments). Scripts without options run under it with
+#   python -m Utilities.profiling [--sample SECONDS] <module> [args]
+
+DEFAULT_TOP = 25
+TRACE_FRAMES = 10
+MEMORY_CHECK_INTERVAL = 0.05
+# Snapshot the allocations again once traced memory is this much above the last snapshot
+PEAK_GROWTH = 1.1
+
+
+def default_prefix(name):
+    return f"profile-{name.rsplit('.', 1)[-1]}-{time.strftime('%Y%m%d-%H%M%S')}"
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Monitor:
+    """Background thread following the memory peak and, given an interval, sampling every thread's stack."""
+
+    def __init__(self, sample_interval=None):
+        self.sample_interval = sample_interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.peak_snapshot = None
+        self.peak_size = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.sample_interval or MEMORY_CHECK_INTERVAL):
+            if self.sample_interval:
+                self.sample()
+            self.check_memory()
+
+    def sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == self.thread.ident:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def check_memory(self):
+        import tracemalloc
+
+        current, _ = tracemalloc.get_traced_memory()
+        if current > self.peak_size * PEAK_GROWTH:
+            self.peak_snapshot = tracemalloc.take_snapshot()
+            self.peak_size = current
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.check_memory()
+
+
+def profile_new_threads(profilers):
+    """Before Python 3.12 cProfile only sees the thread that enabled it, so give each new thread its own."""
+    import cProfile
+
+    def start(frame, event, arg):
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        profilers.append(profiler)
+        profiler.enable()
+
+    threading.setprofile(start)
+
+
+#**********************************************************************
+# Reports
+#**********************************************************************
+def write_sampled_functions(report, stacks, samples, top):
+    inclusive, own = collections.Counter(), collections.Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')[1:]
+        if frames:
+            own[frames[-1]] += count
+        for frame in set(frames):
+            inclusive[frame] += count
+    report.write(f"Top {top} functions by own samples ({samples} samples of all threads, idle waits included)\n")
+    report.write(f"{'own':>10} {'inclusive':>10}  function\n")
+    for frame, count in own.most_common(top):
+        report.write(f"{count:>10} {inclusive[frame]:>10}  {frame}\n")
+
+
+def write_allocations(report, title, snapshot, top):
+    import tracemalloc
+
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                       tracemalloc.Filter(False, __file__)))
+    statistics = snapshot.statistics('lineno')
+    report.write(f"\n{title}: {sum(stat.size for stat in statistics) / 1e6:.1f} MB traced\n")
+    for stat in statistics[:top]:
+        frame = stat.traceback[0]
+        report.write(f"{stat.size / 1e6:>10.2f} MB {stat.count:>9} blocks  {frame.filename}:{frame.lineno}\n")
+
+
+def write_reports(prefix, top, seconds, monitor, profilers):
+    import pstats
+    import tracemalloc
+
+    exit_snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    if os.path.dirname(prefix):
+        os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    written = [f"{prefix}.txt"]
+    with open(f"{prefix}.txt", 'w') as report:
+        report.write(f"Profile of {' '.join(sys.argv)}: {seconds:.2f}s, peak traced memory {peak / 1e6:.1f} MB\n\n")
+        if profilers:
+            stats = pstats.Stats(*profilers, stream=report)
+            stats.dump_stats(f"{prefix}.prof")
+            written.append(f"{prefix}.prof")
+            report.write(f"Top {top} functions by cumulative time, summed over all threads\n")
+            stats.sort_stats('cumulative').print_stats(top)
+        else:
+            with open(f"{prefix}.folded", 'w') as folded:
+                folded.writelines(f"{stack} {count}\n" for stack, count in monitor.stacks.items())
+            written.append(f"{prefix}.folded")
+            write_sampled_functions(report, monitor.stacks, monitor.samples, top)
+        if monitor.peak_snapshot is not None:
+            write_allocations(report, "Top allocation sites near the memory peak", monitor.peak_snapshot, top)
+        write_allocations(report, "Top allocation sites at exit", exit_snapshot, top)
+    print(f"Profile ({seconds:.2f}s, peak {peak / 1e6:.1f} MB traced) written to {', '.join(written)}")
+
+
+@contextlib.contextmanager
+def profiling(prefix, top=DEFAULT_TOP, sample_interval=None):
+    """Profile CPU and memory of the code run inside and write the reports named after prefix.
+
+    Without sample_interval every call is traced by cProfile; with it the stacks are sampled every
+    sample_interval seconds and tracemalloc keeps a single frame per allocation, which keeps the
+    overhead low enough for long runs.
+    """
+    import cProfile
+    import tracemalloc
+
+    tracemalloc.start(1 if sample_interval else TRACE_FRAMES)
+    monitor = Monitor(sample_interval)
+    monitor.thread.start()
+    profilers = []
+    if not sample_interval:
+        profilers.append(cProfile.Profile())
+        if sys.version_info < (3, 12):
+            profile_new_threads(profilers)
+        profilers[0].enable()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        if profilers:
+            profilers[0].disable()
+            threading.setprofile(None)
+        monitor.stop()
+        write_reports(prefix, top, seconds, monitor, profilers)
+        tracemalloc.stop()
+
+
+#**********************************************************************
+# Command line options
+#**********************************************************************
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', action='store_true', help='Profile CPU and memory and write the reports')
+    parser.add_argument('--profile-output', metavar='PREFIX',
+                        help='Path prefix of the profile reports (default: profile-<script>-<time>)')
+    parser.add_argument('--profile-top', type=int, default=DEFAULT_TOP, metavar='N',
+                        help=f'Functions and allocation sites listed in the report (default: {DEFAULT_TOP})')
+    parser.add_argument('--profile-sample', type=float, metavar='SECONDS',
+                        help='Sample stacks at this interval instead of tracing every call, for long runs')
+
+
+def profile_from_args(args, name):
+    """The profiling context asked for by the add_profile_arguments options, or one that does nothing."""
+    if not (args.profile or args.profile_output or args.profile_sample):
+        return contextlib.nullcontext()
+    return profiling(args.profile_output or default_prefix(name), args.profile_top, args.profile_sample)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a module under the CPU and memory profiler.')
+    parser.add_argument('--output', metavar='PREFIX', help='Path prefix of the reports (default: profile-<module>-<time>)')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP, help='Functions and allocation sites to list')
+    parser.add_argument('--sample', type=float, metavar='SECONDS', help='Sample stacks instead of tracing every call')
+    parser.add_argument('module', help='Module to run, as for python -m')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments of the module')
+    args = parser.parse_args()
+
+    sys.argv = [args.module, *args.args]
+    with profiling(args.output or default_prefix(args.module), args.top, args.sample):
+        runpy.run_module(args.module, run_name='__main__', alter_sys=True)
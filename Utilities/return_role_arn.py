@@ -1,8 +1,8 @@
-import boto3
+from Utilities.aws_clients import get_client
 from aws_setup.create_lambda_role import create_lambda_role  # Import the function
 
 # Initialize boto3 IAM client
-iam_client = boto3.client('iam')
+iam_client = get_client('iam')
 
 role_name = input('Enter the role name you need an ARN for: ')
 
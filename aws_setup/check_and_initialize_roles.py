@@ -1,11 +1,12 @@
-import boto3
+import json
 from botocore.exceptions import ClientError
+from Utilities.aws_clients import get_client
 
 # This will ensure you are using admin credentials to run the script
 def is_admin_user():
     """Check if the current user has the IAM permissions to create roles."""
+    iam_client = get_client('iam')
     try:
-        iam_client = boto3.client('iam')
         # Attempt to list roles (this requires admin-level permissions)
         iam_client.list_roles()
         print("Admin privileges confirmed.")
@@ -16,6 +17,7 @@ def is_admin_user():
 
 def check_if_role_exists(role_name):
     """Check if the IAM role already exists."""
+    iam_client = get_client('iam')
     try:
         iam_client.get_role(RoleName=role_name)
         print(f"Role '{role_name}' already exists.")
@@ -26,38 +28,55 @@ def check_if_role_exists(role_name):
         print(f"Error checking for role: {e}")
         return False
 
+def ec2_service_role_policy_name(role_name):
+    return f"{role_name}_S3SQSAccessPolicy"
+
+def ec2_service_role_policy(bucket_name, queue_arn=None):
+    """Inline policy of the EC2 service role: the project bucket and, when given, the SQS queue."""
+    statements = [
+        {
+            "Effect": "Allow",
+            "Action": [
+                "s3:GetObject",
+                "s3:PutObject",
+                "s3:ListBucket"
+            ],
+            "Resource": [
+                f"arn:aws:s3:::{bucket_name}",
+                f"arn:aws:s3:::{bucket_name}/*"
+            ]
+        }
+    ]
+    if queue_arn:
+        statements.append({
+            "Effect": "Allow",
+            "Action": [
+                "sqs:ReceiveMessage",
+                "sqs:DeleteMessage"
+            ],
+            "Resource": queue_arn
+        })
+    return {"Version": "2012-10-17", "Statement": statements}
+
+def put_ec2_service_role_policy(role_name, bucket_name, queue_arn=None, iam_client=None):
+    """Attach or replace the S3 and SQS inline policy of the EC2 service role."""
+    iam_client = iam_client or get_client('iam')
+    iam_client.put_role_policy(
+        RoleName=role_name,
+        PolicyName=ec2_service_role_policy_name(role_name),
+        PolicyDocument=json.dumps(ec2_service_role_policy(bucket_name, queue_arn))
+    )
+
 def create_or_update_ec2_service_role(role_name, bucket_name, queue_arn):
     """Create or update IAM role for EC2 with both S3 and SQS access."""
+    iam_client = get_client('iam')
     if check_if_role_exists(role_name):
-        print(f"Role '{role_name}' exists. Skipping creation or updating policy.")
-        # Here you can update the policy if needed
-        return
-
-    policy_document = {
-        "Version": "2012-10-17",
-        "Statement": [
-            {
-                "Effect": "Allow",
-                "Action": [
-                    "s3:GetObject",
-                    "s3:PutObject",
-                    "s3:ListBucket"
-                ],
-                "Resource": [
-                    f"arn:aws:s3:::{bucket_name}",
-                    f"arn:aws:s3:::{bucket_name}/*"
-                ]
-            },
-            {
-                "Effect": "Allow",
-                "Action": [
-                    "sqs:ReceiveMessage",
-                    "sqs:DeleteMessage"
-                ],
-                "Resource": queue_arn
-            }
-        ]
-    }
+        try:
+            put_ec2_service_role_policy(role_name, bucket_name, queue_arn, iam_client)
+            print(f"Role '{role_name}' exists. Updated its S3 and SQS access policy.")
+        except ClientError as e:
+            print(f"Error updating role policy: {e}")
+        return None
 
     trust_policy = {
         "Version": "2012-10-17",
@@ -86,11 +105,7 @@ def create_or_update_ec2_service_role(role_name, bucket_name, queue_arn):
         )
 
         # Attach the combined S3 and SQS access policy
-        iam_client.put_role_policy(
-            RoleName=role_name,
-            PolicyName=f"{role_name}_S3SQSAccessPolicy",
-            PolicyDocument=json.dumps(policy_document)
-        )
+        put_ec2_service_role_policy(role_name, bucket_name, queue_arn, iam_client)
         print(f"Role '{role_name}' created with S3 bucket '{bucket_name}' and SQS queue access.")
         return response['Role']['Arn']
     except ClientError as e:
@@ -1,16 +1,14 @@
-import boto3
 from botocore.exceptions import ClientError
+from aws_setup.resource_registry import read_registry
+from Utilities.aws_clients import get_client
 
 # Define constants for table name and tags
 TABLE_NAME = "PhotoProjectResources"
 TAG_KEY = "Project"
 TAG_VALUE = "PhotoProject"
 
-dynamodb = boto3.client('dynamodb')
-s3 = s3.client('s3')
-iam = iam.client('iam')
-
 def check_for_db():
+    dynamodb = get_client('dynamodb')
     try:
         response=dynamodb.list_tables()
         if TABLE_NAME in response['TableNames']:
@@ -24,6 +22,7 @@ def check_for_db():
             return False
 
 def create_cynamo_db_table():
+    dynamodb = get_client('dynamodb')
     try:
         print(f"Creating DynamoDB table '{TABLE_NAME}'...")
         response = dynamodb.crear_table(
@@ -36,21 +35,14 @@ def create_cynamo_db_table():
             ]
         )
 def read_identifiers_from_db():
+    dynamodb = get_client('dynamodb')
     try:
-        response = dynamodb.scan(TableName = TABLE_NAME)
-        items = response.get('Items', [])
-        resources_dict = {}
-
-        if items:
-            print(f"Found {len(items)} items in '{TABLE_NAME}': ")
-            for item in items:
-                resource_type = item.get('ResourceType', {}).get('S', 'Unknown')
-                identifier = item.get('Identifier', {}).get('S', None)
-                if not identifier or not resource_type:
-                    continue
-                if resource_type not in resources_dict:
-                    resources_dict[resource_type] = []
-                resources_dict[resource_type].append(identifier)
+        # Parallel segmented scan that follows every page and only reads ResourceType and Identifier
+        resources_dict = read_registry(TABLE_NAME, dynamodb_client=dynamodb)
+
+        if resources_dict:
+            item_count = sum(len(identifiers) for identifiers in resources_dict.values())
+            print(f"Found {item_count} items in '{TABLE_NAME}': ")
             return resources_dict
         else:
             print(f"no resources found in DynamoDB table '{TABLE_NAME}'. ")
@@ -73,6 +65,7 @@ found_resources = {
 duplicate_resources = []
 
 # Get the list of all S3 buckets
+s3_client = get_client('s3')
 try:
     response = s3_client.list_buckets()
     s3_buckets = response['Buckets']
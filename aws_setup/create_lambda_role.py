@@ -1,8 +1,8 @@
-import boto3
+from Utilities.aws_clients import get_client
 import json
 
 def create_lambda_role():
-    iam_client = boto3.client('iam')
+    iam_client = get_client('iam')
 
     trust_policy = json.dumps({
         "Version": "2012-10-17",
@@ -0,0 +1,127 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from aws_setup.db_snapshot import iter_decompressed_chunks
+from aws_setup.key_provider import data_key_from_metadata
+from aws_setup.stream_crypto import ChunkStreamReader, iter_decrypted_chunks
+
+#**********************************************************************
+# Restore settings
+#**********************************************************************
+# The encrypted backup is fetched as byte ranges in parallel but consumed strictly in order, with
+# at most max_workers * 2 ranges in memory. Every range is requested with IfMatch on the ETag seen
+# by the first HEAD, so a backup replaced mid-download fails instead of mixing two versions.
+# Decryption authenticates every record and the final one, and the result must start with the
+# SQLite header before it replaces the local database.
+
+DEFAULT_RANGE_SIZE = 8 * 1024 * 1024
+DEFAULT_WORKERS = 4
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+class RestoreError(Exception):
+    """Raised when a downloaded backup doesn't decrypt to a SQLite database."""
+
+
+#**********************************************************************
+# Parallel ranged download
+#**********************************************************************
+def iter_object_ranges(s3_client, bucket_name, object_key, size, etag, range_size=DEFAULT_RANGE_SIZE,
+                       max_workers=DEFAULT_WORKERS):
+    """Yield the bytes of an object in order, fetching up to max_workers ranges at a time."""
+    def fetch(start):
+        end = min(start + range_size, size) - 1
+        response = s3_client.get_object(Bucket=bucket_name, Key=object_key, Range=f"bytes={start}-{end}",
+                                        IfMatch=etag)
+        return response['Body'].read()
+
+    starts = iter(range(0, size, range_size))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        window = deque()
+        for start in starts:
+            window.append(executor.submit(fetch, start))
+            if len(window) >= max_workers * 2:
+                break
+        while window:
+            data = window.popleft().result()
+            start = next(starts, None)
+            if start is not None:
+                window.append(executor.submit(fetch, start))
+            yield data
+
+
+def iter_backup_plaintext(s3_client, bucket_name, object_key, key_provider, range_size=DEFAULT_RANGE_SIZE,
+                          max_workers=DEFAULT_WORKERS, head=None):
+    """Yield the decrypted and decompressed bytes of a backup object as they arrive."""
+    if head is None:
+        head = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+    metadata = head['Metadata']
+    data_key = data_key_from_metadata(key_provider, metadata)
+    ranges = iter_object_ranges(s3_client, bucket_name, object_key, head['ContentLength'], head['ETag'],
+                                range_size, max_workers)
+    if 'compression' not in metadata:
+        raise RestoreError(f"Backup '{object_key}' has no compression codec in its metadata.")
+    plaintext = iter_decrypted_chunks(ChunkStreamReader(ranges), data_key)
+    yield from iter_decompressed_chunks(plaintext, metadata['compression'])
+
+
+#**********************************************************************
+# Restore to a file, atomically
+#**********************************************************************
+def restore_db_to_file(s3_client, bucket_name, object_key, key_provider, destination_path,
+                       range_size=DEFAULT_RANGE_SIZE, max_workers=DEFAULT_WORKERS):
+    """Download, decrypt and verify a backup, then move it into place at destination_path.
+
+    Returns the ETag of the restored object and the SHA-256 of the restored database.
+    """
+    started = time.perf_counter()
+    head = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+    digest = hashlib.sha256()
+    destination_dir = os.path.dirname(os.path.abspath(destination_path))
+    # Written next to the destination so the final rename stays on one filesystem
+    handle, temporary_path = tempfile.mkstemp(prefix='.restore-', dir=destination_dir)
+    try:
+        size = 0
+        with os.fdopen(handle, 'wb') as restored_file:
+            for chunk in iter_backup_plaintext(s3_client, bucket_name, object_key, key_provider, range_size,
+                                               max_workers, head):
+                if size == 0 and not chunk.startswith(SQLITE_HEADER):
+                    raise RestoreError(f"Backup '{object_key}' is not a SQLite database.")
+                restored_file.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+            restored_file.flush()
+            os.fsync(restored_file.fileno())
+        os.replace(temporary_path, destination_path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    print(f"Restored '{object_key}' ({size} bytes) to '{destination_path}' in {time.perf_counter() - started:.2f}s.")
+    return head['ETag'], digest.hexdigest()
+
+
+#**********************************************************************
+# Restore into an in-memory connection
+#**********************************************************************
+def restore_db_to_memory(s3_client, bucket_name, object_key, key_provider, range_size=DEFAULT_RANGE_SIZE,
+                         max_workers=DEFAULT_WORKERS):
+    """Return an in-memory SQLite connection holding the backup, without writing plaintext to disk."""
+    if not hasattr(sqlite3.Connection, 'deserialize'):
+        raise RestoreError("Restoring into memory needs Python 3.11 or newer (sqlite3 deserialize).")
+
+    data = bytearray()
+    for chunk in iter_backup_plaintext(s3_client, bucket_name, object_key, key_provider, range_size, max_workers):
+        data += chunk
+    if not data.startswith(SQLITE_HEADER):
+        raise RestoreError(f"Backup '{object_key}' is not a SQLite database.")
+
+    conn = sqlite3.connect(':memory:')
+    conn.deserialize(bytes(data))
+    return conn
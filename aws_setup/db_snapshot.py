@@ -0,0 +1,137 @@
+import bz2
+import lzma
+import os
+import sqlite3
+import tempfile
+import zlib
+from contextlib import contextmanager
+
+from aws_setup.stream_crypto import ChunkStreamReader, read_exactly
+
+#**********************************************************************
+# Snapshot and compression settings
+#**********************************************************************
+# The backup API copies pages_per_step pages at a time and sleeps in between, so writers only
+# wait for one step instead of the whole copy. If another connection writes mid-backup SQLite
+# restarts the copy; after max_restarts of those the rest is copied in one step under a single
+# read lock, so a busy writer can't starve the backup.
+
+DEFAULT_PAGES_PER_STEP = 1024
+DEFAULT_STEP_SLEEP = 0.005
+DEFAULT_MAX_RESTARTS = 3
+COMPRESSION_CODECS = ('none', 'zlib', 'bz2', 'lzma')
+DEFAULT_COMPRESSION_LEVELS = {'zlib': 6, 'bz2': 9, 'lzma': 6}
+READ_CHUNK_SIZE = 1024 * 1024
+# What the decompressors raise on data that isn't a valid stream of their codec (bz2 raises OSError)
+DECOMPRESSION_ERRORS = (zlib.error, lzma.LZMAError, OSError, EOFError)
+
+
+class BackupRestartLimit(Exception):
+    """Raised from the progress callback to stop a stepped backup that keeps restarting."""
+
+
+#**********************************************************************
+# Take a consistent snapshot of a live database
+#**********************************************************************
+def snapshot_db(source_conn, snapshot_path, pages_per_step=DEFAULT_PAGES_PER_STEP, step_sleep=DEFAULT_STEP_SLEEP,
+                max_restarts=DEFAULT_MAX_RESTARTS, progress=None):
+    """Copy the database behind source_conn to snapshot_path with the online backup API."""
+    restarts = 0
+    last_remaining = None
+
+    def track_restarts(status, remaining, total):
+        nonlocal restarts, last_remaining
+        # Remaining pages only stop falling when a write from another connection restarted the copy
+        if last_remaining is not None and remaining >= last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise BackupRestartLimit()
+        last_remaining = remaining
+        if progress:
+            progress(status, remaining, total)
+
+    target_conn = sqlite3.connect(snapshot_path)
+    try:
+        try:
+            source_conn.backup(target_conn, pages=pages_per_step, progress=track_restarts, sleep=step_sleep)
+        except BackupRestartLimit:
+            source_conn.backup(target_conn, pages=-1)
+    finally:
+        target_conn.close()
+
+
+@contextmanager
+def temporary_snapshot(source_conn, pages_per_step=DEFAULT_PAGES_PER_STEP, step_sleep=DEFAULT_STEP_SLEEP):
+    """Yield the path of a private snapshot of the database that is deleted afterwards."""
+    # mkstemp creates the file readable by the owner only
+    handle, snapshot_path = tempfile.mkstemp(prefix='warinpocket-snapshot-', suffix='.sqlite')
+    os.close(handle)
+    try:
+        snapshot_db(source_conn, snapshot_path, pages_per_step, step_sleep)
+        yield snapshot_path
+    finally:
+        os.remove(snapshot_path)
+
+
+#**********************************************************************
+# Streaming compression
+#**********************************************************************
+def check_codec(codec):
+    if codec not in COMPRESSION_CODECS:
+        raise ValueError(f"Unknown compression codec '{codec}'. Use one of {COMPRESSION_CODECS}.")
+
+
+def make_compressor(codec, level=None):
+    check_codec(codec)
+    if level is None:
+        level = DEFAULT_COMPRESSION_LEVELS.get(codec)
+    if codec == 'zlib':
+        return zlib.compressobj(level)
+    if codec == 'bz2':
+        return bz2.BZ2Compressor(level)
+    if codec == 'lzma':
+        return lzma.LZMACompressor(preset=level)
+    return None
+
+
+def make_decompressor(codec):
+    check_codec(codec)
+    if codec == 'zlib':
+        return zlib.decompressobj()
+    if codec == 'bz2':
+        return bz2.BZ2Decompressor()
+    if codec == 'lzma':
+        return lzma.LZMADecompressor()
+    return None
+
+
+def iter_compressed_chunks(source, codec, level=None, chunk_size=READ_CHUNK_SIZE):
+    """Yield the compressed form of a file object, reading one chunk at a time."""
+    compressor = make_compressor(codec, level)
+    while True:
+        data = read_exactly(source, chunk_size)
+        if not data:
+            break
+        data = compressor.compress(data) if compressor else data
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
+
+
+def iter_decompressed_chunks(chunks, codec):
+    """Yield the decompressed form of an iterator of compressed chunks."""
+    decompressor = make_decompressor(codec)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk) if decompressor else chunk
+        if data:
+            yield data
+    if decompressor and not decompressor.eof:
+        raise ValueError(f"Compressed stream ended before the end of the {codec} data.")
+
+
+class CompressingReader(ChunkStreamReader):
+    """Reads from a file object and returns the compressed stream, one chunk in memory at a time."""
+
+    def __init__(self, source, codec, level=None):
+        super().__init__(iter_compressed_chunks(source, codec, level))
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from botocore.exceptions import ClientError
+
+from aws_setup.stream_crypto import read_exactly
+
+#**********************************************************************
+# Sync state
+#**********************************************************************
+# <db>.sync.json remembers, per bucket, the ETag of the backup object at the last push or pull and
+# the hash of the local database at that moment. A sync compares both sides with that state:
+# the remote with a single HEAD using IfNoneMatch on the stored ETag, the local file by size and
+# mtime first and only hashed when those moved. Pushes are conditional on the stored ETag so a
+# backup written by another machine in the meantime is reported as a conflict, not overwritten.
+
+SYNC_STATE_SUFFIX = '.sync.json'
+SOURCE_HASH_METADATA = 'source-sha256'
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_CONCURRENCY = 4
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class SyncConflictError(Exception):
+    """Raised when a conditional write finds the backup object changed since the last sync."""
+
+
+def sync_state_path(db_path):
+    return f"{db_path}{SYNC_STATE_SUFFIX}"
+
+
+def load_sync_state(db_path, bucket_name):
+    """Return the state of the last sync with bucket_name, or an empty dict."""
+    try:
+        with open(sync_state_path(db_path)) as state_file:
+            state = json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+    return state if state.get('bucket') == bucket_name else {}
+
+
+def save_sync_state(db_path, state):
+    temporary_path = f"{sync_state_path(db_path)}.tmp"
+    with open(temporary_path, 'w') as state_file:
+        json.dump(state, state_file, indent=4)
+    os.replace(temporary_path, sync_state_path(db_path))
+
+
+#**********************************************************************
+# Local change detection
+#**********************************************************************
+def local_db_files(db_path):
+    # Committed changes can still be sitting in the write-ahead log
+    return [path for path in (db_path, f"{db_path}-wal") if os.path.exists(path)]
+
+
+def local_fingerprint(db_path):
+    return [[os.path.basename(path), os.stat(path).st_size, os.stat(path).st_mtime_ns]
+            for path in local_db_files(db_path)]
+
+
+def hash_local_db(db_path, state=None):
+    """Return the SHA-256 of the local database, reusing the stored hash if the files weren't touched."""
+    fingerprint = local_fingerprint(db_path)
+    if state and state.get('fingerprint') == fingerprint:
+        return state['local_sha256']
+    digest = hashlib.sha256()
+    for path in local_db_files(db_path):
+        with open(path, 'rb') as db_file:
+            for chunk in iter(lambda: db_file.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def record_sync(db_path, bucket_name, etag, local_sha256, fingerprint=None):
+    """Remember that the local database with local_sha256 and the backup with etag are in sync.
+
+    fingerprint must be taken before local_sha256 was hashed, otherwise a write in between would be
+    recorded as synced; it defaults to the files as they are now.
+    """
+    if fingerprint is None:
+        fingerprint = local_fingerprint(db_path)
+    save_sync_state(db_path, {'bucket': bucket_name, 'etag': etag, 'local_sha256': local_sha256,
+                              'fingerprint': fingerprint})
+
+
+#**********************************************************************
+# Remote change detection
+#**********************************************************************
+def check_remote(s3_client, bucket_name, object_key, etag=None):
+    """Return ('unchanged', None), ('changed', head) or ('missing', None) for the backup object."""
+    try:
+        if etag:
+            head = s3_client.head_object(Bucket=bucket_name, Key=object_key, IfNoneMatch=etag)
+        else:
+            head = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+        return 'changed', head
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code == '304':
+            return 'unchanged', None
+        if code in ('404', 'NoSuchKey'):
+            return 'missing', None
+        raise
+
+
+def plan_db_sync(local_exists, local_sha256, state, remote_status, head):
+    """Decide between 'none', 'record', 'push', 'pull' and 'conflict'."""
+    local_changed = local_exists and local_sha256 != state.get('local_sha256')
+    if remote_status == 'missing':
+        return 'push' if local_exists else 'none'
+    if not local_exists:
+        return 'pull'
+    if remote_status == 'unchanged':
+        return 'push' if local_changed else 'none'
+    # The remote changed, or there is no state to compare with
+    if head['Metadata'].get(SOURCE_HASH_METADATA) == local_sha256:
+        return 'record'
+    return 'conflict' if local_changed else 'pull'
+
+
+#**********************************************************************
+# Conditional streaming upload
+#**********************************************************************
+def is_precondition_failure(e):
+    return e.response['Error']['Code'] in ('PreconditionFailed', '412', 'ConditionalRequestConflict')
+
+
+def conditional_upload(s3_client, bucket_name, object_key, stream, metadata, if_match=None, if_none_match=None,
+                       part_size=DEFAULT_PART_SIZE, concurrency=DEFAULT_CONCURRENCY):
+    """Upload a stream, only replacing the object if the IfMatch/IfNoneMatch condition holds. Returns the ETag."""
+    conditions = {}
+    if if_match:
+        conditions['IfMatch'] = if_match
+    if if_none_match:
+        conditions['IfNoneMatch'] = if_none_match
+
+    try:
+        first_part = read_exactly(stream, part_size)
+        if len(first_part) < part_size:
+            return s3_client.put_object(Bucket=bucket_name, Key=object_key, Body=first_part, Metadata=metadata,
+                                        **conditions)['ETag']
+
+        upload_id = s3_client.create_multipart_upload(Bucket=bucket_name, Key=object_key,
+                                                      Metadata=metadata)['UploadId']
+        try:
+            def upload_part(part_number, body):
+                response = s3_client.upload_part(Bucket=bucket_name, Key=object_key, UploadId=upload_id,
+                                                 PartNumber=part_number, Body=body)
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+            parts = []
+            pending = set()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                part_number, body = 1, first_part
+                while body:
+                    # Memory stays around part_size x concurrency however long the stream is
+                    if len(pending) >= concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    future = executor.submit(upload_part, part_number, body)
+                    parts.append(future)
+                    pending.add(future)
+                    part_number, body = part_number + 1, read_exactly(stream, part_size)
+                parts = [future.result() for future in parts]
+
+            # The condition is checked when the parts are assembled, so nothing changes if it fails
+            return s3_client.complete_multipart_upload(Bucket=bucket_name, Key=object_key, UploadId=upload_id,
+                                                       MultipartUpload={'Parts': parts}, **conditions)['ETag']
+        except BaseException:
+            s3_client.abort_multipart_upload(Bucket=bucket_name, Key=object_key, UploadId=upload_id)
+            raise
+    except ClientError as e:
+        if is_precondition_failure(e):
+            raise SyncConflictError(f"'{object_key}' in '{bucket_name}' changed since the last sync.")
+        raise
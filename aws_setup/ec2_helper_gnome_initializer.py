@@ -1,11 +1,9 @@
-import boto3
 from botocore.exceptions import ClientError
-
-ec2_client = boto3.client('ec2')
-iam_client = boto3.client('iam')
+from Utilities.aws_clients import get_client
 
 
 def create_helper_gnome_ssm_role():
+    iam_client = get_client('iam')
     role_name = 'HelperGnomeSSMRole'
     try:
         iam_client.get_role(RoleName=role_name)
@@ -44,6 +42,7 @@ def create_helper_gnome_ssm_role():
 
 
 def create_ec2_instance():
+    ec2_client = get_client('ec2')
     try:
         response = ec2_client.run_instances(
             ImageId='******',
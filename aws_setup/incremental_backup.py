@@ -0,0 +1,264 @@
+import argparse
+import base64
+import hashlib
+import hmac
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+
+from aws_setup.db_snapshot import temporary_snapshot, iter_compressed_chunks, iter_decompressed_chunks
+from aws_setup.stream_crypto import read_exactly, iter_encrypted_chunks, iter_decrypted_chunks
+from aws_setup.key_provider import get_key_provider, new_data_key, data_key_from_metadata
+from Utilities.aws_clients import get_client
+
+#**********************************************************************
+# Incremental backup layout
+#**********************************************************************
+# <prefix>/chunks/<chunk id>             one encrypted (and optionally compressed) chunk of the DB
+# <prefix>/snapshots/<timestamp>.json    encrypted manifest listing the chunk ids of one snapshot
+# Every object has its own data key, wrapped by the master key in its metadata (see key_provider).
+# The DB snapshot is split into chunk_size pieces aligned to SQLite pages. A chunk id is an HMAC of
+# its plaintext under a random id key kept inside the encrypted manifests and carried over from one
+# snapshot to the next while the codec stays the same, so identical chunks share one object and the
+# ids reveal nothing about the content. A backup uploads only the chunks the latest snapshot
+# doesn't already reference, so its cost follows the amount of change rather than the DB size.
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_WORKERS = 8
+DEFAULT_COMPRESSION = "zlib"
+MANIFEST_VERSION = 2
+BACKUP_SECRET_NAME = "db_encryption_key_photo_project"
+
+
+#**********************************************************************
+# Keys and object names
+#**********************************************************************
+def chunk_id(id_key, chunk):
+    return hmac.new(id_key, chunk, hashlib.sha256).hexdigest()
+
+
+def backup_prefix(db_name):
+    return f"incremental/{db_name}"
+
+
+def chunk_object_key(prefix, identifier):
+    return f"{prefix}/chunks/{identifier}"
+
+
+def snapshot_object_key(prefix, snapshot_id):
+    return f"{prefix}/snapshots/{snapshot_id}.json"
+
+
+def aligned_chunk_size(chunk_size, page_size):
+    """Round the chunk size down to whole pages so a page change touches a single chunk."""
+    return max(page_size, chunk_size - chunk_size % page_size)
+
+
+#**********************************************************************
+# Encrypt and decrypt small objects in memory
+#**********************************************************************
+def seal(data, key, compression):
+    compressed = b''.join(iter_compressed_chunks(io.BytesIO(data), compression))
+    return b''.join(iter_encrypted_chunks(io.BytesIO(compressed), key))
+
+
+def unseal(data, key, compression):
+    return b''.join(iter_decompressed_chunks(iter_decrypted_chunks(io.BytesIO(data), key), compression))
+
+
+def put_sealed_object(s3_client, bucket_name, object_key, data, key_provider, compression):
+    data_key, metadata = new_data_key(key_provider)
+    s3_client.put_object(Bucket=bucket_name, Key=object_key, Body=seal(data, data_key, compression),
+                         Metadata=metadata)
+
+
+def get_sealed_object(s3_client, bucket_name, object_key, key_provider, compression):
+    response = s3_client.get_object(Bucket=bucket_name, Key=object_key)
+    return unseal(response['Body'].read(), data_key_from_metadata(key_provider, response['Metadata']), compression)
+
+
+#**********************************************************************
+# Snapshot manifests
+#**********************************************************************
+def list_snapshots(s3_client, bucket_name, db_name):
+    """Return the snapshot ids stored for a database, oldest first."""
+    prefix = f"{backup_prefix(db_name)}/snapshots/"
+    snapshot_ids = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            snapshot_ids.append(obj['Key'][len(prefix):-len('.json')])
+    return sorted(snapshot_ids)
+
+
+def load_manifest(s3_client, bucket_name, db_name, snapshot_id, key_provider):
+    """Download and decrypt the manifest of one snapshot."""
+    manifest_key = snapshot_object_key(backup_prefix(db_name), snapshot_id)
+    manifest = json.loads(get_sealed_object(s3_client, bucket_name, manifest_key, key_provider, 'none'))
+    manifest['id_key'] = base64.b64decode(manifest['id_key'])
+    return manifest
+
+
+#**********************************************************************
+# Back up only the chunks that changed
+#**********************************************************************
+def backup_incremental(conn, s3_client, bucket_name, db_name, key_provider, chunk_size=DEFAULT_CHUNK_SIZE,
+                       compression=DEFAULT_COMPRESSION, max_workers=DEFAULT_WORKERS):
+    """Upload the chunks of the database that the latest snapshot lacks and write a new manifest."""
+    started = time.perf_counter()
+    prefix = backup_prefix(db_name)
+
+    # Every chunk the latest snapshot lists is already in the bucket, named with its id key. A manifest
+    # records one codec for all of its chunks, so after a codec change the chunks are written again under
+    # a new id key; reusing the ids would overwrite chunks that older snapshots decode with their codec.
+    snapshot_ids = list_snapshots(s3_client, bucket_name, db_name)
+    stored_chunks = set()
+    latest = None
+    if snapshot_ids:
+        latest = load_manifest(s3_client, bucket_name, db_name, snapshot_ids[-1], key_provider)
+    if latest is not None and latest['compression'] == compression:
+        stored_chunks.update(latest['chunks'])
+        id_key = latest['id_key']
+    else:
+        id_key = os.urandom(32)
+
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    chunk_size = aligned_chunk_size(chunk_size, page_size)
+
+    def upload_chunk(identifier, chunk):
+        put_sealed_object(s3_client, bucket_name, chunk_object_key(prefix, identifier), chunk, key_provider,
+                          compression)
+        return len(chunk)
+
+    chunks = []
+    uploads = []
+    pending = set()
+    db_size = 0
+    with temporary_snapshot(conn) as snapshot_path, open(snapshot_path, 'rb') as db_file:
+        # Only hashing is done for unchanged chunks; new ones are uploaded while the file is still being read
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                chunk = read_exactly(db_file, chunk_size)
+                if not chunk:
+                    break
+                db_size += len(chunk)
+                identifier = chunk_id(id_key, chunk)
+                chunks.append(identifier)
+                if identifier not in stored_chunks:
+                    stored_chunks.add(identifier)
+                    # Cap the chunks waiting in memory when most of the database is new
+                    if len(pending) >= max_workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    future = executor.submit(upload_chunk, identifier, chunk)
+                    uploads.append(future)
+                    pending.add(future)
+            uploaded_bytes = sum(future.result() for future in uploads)
+
+    snapshot_id = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'db_name': db_name,
+        'created': snapshot_id,
+        'size': db_size,
+        'chunk_size': chunk_size,
+        'compression': compression,
+        'id_key': base64.b64encode(id_key).decode(),
+        'chunks': chunks
+    }
+    # The manifest goes up last, so a snapshot only becomes visible once all of its chunks exist
+    put_sealed_object(s3_client, bucket_name, snapshot_object_key(prefix, snapshot_id),
+                      json.dumps(manifest).encode(), key_provider, 'none')
+
+    print(f"Snapshot {snapshot_id}: uploaded {len(uploads)}/{len(chunks)} chunks "
+          f"({uploaded_bytes}/{db_size} bytes) in {time.perf_counter() - started:.2f}s.")
+    return snapshot_id
+
+
+#**********************************************************************
+# Rebuild a snapshot from its chunks
+#**********************************************************************
+def restore_incremental(s3_client, bucket_name, db_name, key_provider, destination_path, snapshot_id=None,
+                        max_workers=DEFAULT_WORKERS):
+    """Download the chunks of a snapshot in parallel and atomically write the rebuilt database."""
+    started = time.perf_counter()
+    prefix = backup_prefix(db_name)
+
+    if snapshot_id is None:
+        snapshot_ids = list_snapshots(s3_client, bucket_name, db_name)
+        if not snapshot_ids:
+            raise FileNotFoundError(f"No incremental snapshots of '{db_name}' in bucket '{bucket_name}'.")
+        snapshot_id = snapshot_ids[-1]
+    manifest = load_manifest(s3_client, bucket_name, db_name, snapshot_id, key_provider)
+    chunk_size = manifest['chunk_size']
+    id_key = manifest['id_key']
+
+    # Repeated chunks are fetched once and written at every offset they occur
+    offsets = {}
+    for index, identifier in enumerate(manifest['chunks']):
+        offsets.setdefault(identifier, []).append(index * chunk_size)
+
+    destination_dir = os.path.dirname(os.path.abspath(destination_path))
+    handle, temporary_path = tempfile.mkstemp(prefix='.restore-', dir=destination_dir)
+    try:
+        os.ftruncate(handle, manifest['size'])
+
+        def restore_chunk(identifier):
+            chunk = get_sealed_object(s3_client, bucket_name, chunk_object_key(prefix, identifier), key_provider,
+                                      manifest['compression'])
+            if not hmac.compare_digest(chunk_id(id_key, chunk), identifier):
+                raise ValueError(f"Chunk {identifier} does not match its id.")
+            for offset in offsets[identifier]:
+                os.pwrite(handle, chunk, offset)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(restore_chunk, offsets))
+        os.fsync(handle)
+        os.close(handle)
+        handle = None
+        os.replace(temporary_path, destination_path)
+    except BaseException:
+        if handle is not None:
+            os.close(handle)
+        os.remove(temporary_path)
+        raise
+
+    print(f"Restored snapshot {snapshot_id} ({manifest['size']} bytes, {len(offsets)} unique chunks) "
+          f"to '{destination_path}' in {time.perf_counter() - started:.2f}s.")
+    return snapshot_id
+
+
+#**********************************************************************
+# Command line
+#**********************************************************************
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incremental, chunk-level backups of the Photo Project database')
+    parser.add_argument('action', choices=('backup', 'restore', 'list'))
+    parser.add_argument('--bucket', required=True, help='Bucket holding the backups')
+    parser.add_argument('--db', required=True, help='Database to back up, or the path to restore to')
+    parser.add_argument('--snapshot', help='Snapshot id to restore (default: the latest)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Chunk size in bytes')
+    parser.add_argument('--compression', choices=('none', 'zlib', 'bz2', 'lzma'), default=DEFAULT_COMPRESSION)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Parallel chunk uploads or downloads')
+    args = parser.parse_args()
+
+    s3_client = get_client('s3', min_pool_connections=args.workers)
+    key_provider = get_key_provider(BACKUP_SECRET_NAME)
+    db_name = os.path.basename(args.db)
+    if args.action == 'list':
+        for snapshot_id in list_snapshots(s3_client, args.bucket, db_name):
+            print(snapshot_id)
+    elif args.action == 'backup':
+        conn = sqlite3.connect(args.db)
+        try:
+            backup_incremental(conn, s3_client, args.bucket, db_name, key_provider,
+                               chunk_size=args.chunk_size, compression=args.compression, max_workers=args.workers)
+        finally:
+            conn.close()
+    else:
+        restore_incremental(s3_client, args.bucket, db_name, key_provider, args.db, snapshot_id=args.snapshot,
+                            max_workers=args.workers)
@@ -0,0 +1,84 @@
+import os
+import sqlite3
+
+import pytest
+from moto import mock_aws
+
+from aws_setup.incremental_backup import backup_incremental, restore_incremental, list_snapshots, backup_prefix
+from aws_setup.key_provider import KeyProvider
+from Utilities.aws_clients import get_client, reset_clients
+
+BUCKET = 'incremental-backup-test'
+CHUNK_SIZE = 4096
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        reset_clients()
+        s3_client = get_client('s3')
+        s3_client.create_bucket(Bucket=BUCKET)
+        yield s3_client
+        reset_clients()
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'photos.sqlite'))
+    conn.execute("CREATE TABLE photos (name TEXT)")
+    with conn:
+        conn.executemany("INSERT INTO photos VALUES (?)", [(os.urandom(64).hex(),) for _ in range(200)])
+    yield conn
+    conn.close()
+
+
+def photo_count(path):
+    restored = sqlite3.connect(path)
+    try:
+        return restored.execute("SELECT COUNT(*) FROM photos").fetchone()[0]
+    finally:
+        restored.close()
+
+
+def chunk_count(s3_client):
+    response = s3_client.list_objects_v2(Bucket=BUCKET, Prefix=f"{backup_prefix('photos.sqlite')}/chunks/")
+    return response['KeyCount']
+
+
+def test_only_changed_chunks_are_uploaded(s3_client, conn, tmp_path):
+    key_provider = KeyProvider('incremental-test-key')
+    first = backup_incremental(conn, s3_client, BUCKET, 'photos.sqlite', key_provider, chunk_size=CHUNK_SIZE)
+    first_chunks = chunk_count(s3_client)
+    with conn:
+        conn.execute("INSERT INTO photos VALUES ('new')")
+    second = backup_incremental(conn, s3_client, BUCKET, 'photos.sqlite', key_provider, chunk_size=CHUNK_SIZE)
+    assert list_snapshots(s3_client, BUCKET, 'photos.sqlite') == [first, second]
+    assert first_chunks < chunk_count(s3_client) < 2 * first_chunks
+
+    restore_incremental(s3_client, BUCKET, 'photos.sqlite', key_provider, str(tmp_path / 'latest.sqlite'))
+    restore_incremental(s3_client, BUCKET, 'photos.sqlite', key_provider, str(tmp_path / 'first.sqlite'), first)
+    assert photo_count(str(tmp_path / 'latest.sqlite')) == 201
+    assert photo_count(str(tmp_path / 'first.sqlite')) == 200
+
+
+def test_codec_change_keeps_every_snapshot_restorable(s3_client, conn, tmp_path):
+    key_provider = KeyProvider('incremental-test-key')
+    first = backup_incremental(conn, s3_client, BUCKET, 'photos.sqlite', key_provider, chunk_size=CHUNK_SIZE,
+                               compression='zlib')
+    with conn:
+        conn.execute("INSERT INTO photos VALUES ('new')")
+    backup_incremental(conn, s3_client, BUCKET, 'photos.sqlite', key_provider, chunk_size=CHUNK_SIZE,
+                       compression='lzma')
+
+    restore_incremental(s3_client, BUCKET, 'photos.sqlite', key_provider, str(tmp_path / 'latest.sqlite'))
+    restore_incremental(s3_client, BUCKET, 'photos.sqlite', key_provider, str(tmp_path / 'first.sqlite'), first)
+    assert photo_count(str(tmp_path / 'latest.sqlite')) == 201
+    assert photo_count(str(tmp_path / 'first.sqlite')) == 200
+
+
+def test_restore_without_snapshots_raises(s3_client, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        restore_incremental(s3_client, BUCKET, 'photos.sqlite', KeyProvider('incremental-test-key'),
+                            str(tmp_path / 'restored.sqlite'))
+    assert not os.path.exists(tmp_path / 'restored.sqlite')
@@ -0,0 +1,211 @@
+import argparse
+import base64
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from Utilities.aws_clients import get_client
+
+#**********************************************************************
+# Envelope encryption
+#**********************************************************************
+# Each object is encrypted with its own random data key. The data key is wrapped (AES-GCM) by the
+# master key in Secrets Manager and stored in the object's metadata together with the version id
+# of the master key that wrapped it. Rotating the master key only re-wraps that metadata with a
+# server-side copy; object bodies are never re-encrypted.
+
+DEFAULT_KEY_TTL = 300  # Seconds the current master key is trusted before asking Secrets Manager again
+WRAPPED_KEY_METADATA = 'wrapped-key'
+KEY_VERSION_METADATA = 'key-version'
+WRAP_AAD = b'warinpocket-data-key-v1'
+NONCE_SIZE = 12
+
+providers = {}
+providers_lock = threading.Lock()
+
+
+class KeyUnwrapError(Exception):
+    """Raised when an object has no wrapped data key or it can't be unwrapped with the master key it names."""
+
+
+#**********************************************************************
+# Master key provider with an in-process cache
+#**********************************************************************
+class KeyProvider:
+    """Fetches master keys from Secrets Manager and caches them in process."""
+
+    def __init__(self, secret_name, ttl=DEFAULT_KEY_TTL, secrets_client=None):
+        self.secret_name = secret_name
+        self.ttl = ttl
+        self.secrets_client = secrets_client
+        self.lock = threading.Lock()
+        self.current = None
+        self.current_expires = 0
+        self.versions = {}  # Version ids are immutable, so their keys never expire
+
+    def client(self):
+        if self.secrets_client is None:
+            self.secrets_client = get_client('secretsmanager')
+        return self.secrets_client
+
+    def get_current_key(self):
+        """Return (version id, key) of the current master key, creating the secret if it doesn't exist."""
+        with self.lock:
+            if self.current and time.monotonic() < self.current_expires:
+                return self.current
+            try:
+                response = self.client().get_secret_value(SecretId=self.secret_name)
+            except self.client().exceptions.ResourceNotFoundException:
+                response = self.client().create_secret(Name=self.secret_name,
+                                                       SecretString=Fernet.generate_key().decode())
+                print(f"Generated a new encryption key and stored it in Secrets Manager under secret name "
+                      f"'{self.secret_name}'.")
+                response = self.client().get_secret_value(SecretId=self.secret_name,
+                                                          VersionId=response['VersionId'])
+            self.current = (response['VersionId'], response['SecretString'].encode())
+            self.current_expires = time.monotonic() + self.ttl
+            self.versions[self.current[0]] = self.current[1]
+            return self.current
+
+    def get_key(self, version_id):
+        """Return the master key with the given version id."""
+        with self.lock:
+            if version_id not in self.versions:
+                response = self.client().get_secret_value(SecretId=self.secret_name, VersionId=version_id)
+                self.versions[version_id] = response['SecretString'].encode()
+            return self.versions[version_id]
+
+    def invalidate(self):
+        with self.lock:
+            self.current = None
+
+    def rotate(self):
+        """Store a new master key as the current version and return (version id, key)."""
+        response = self.client().put_secret_value(SecretId=self.secret_name,
+                                                  SecretString=Fernet.generate_key().decode())
+        self.invalidate()
+        print(f"Stored a new master key version {response['VersionId']} in secret '{self.secret_name}'.")
+        return response['VersionId'], self.get_key(response['VersionId'])
+
+
+def get_key_provider(secret_name, ttl=DEFAULT_KEY_TTL):
+    """Return the shared provider for a secret so every caller uses one cache."""
+    with providers_lock:
+        if secret_name not in providers:
+            providers[secret_name] = KeyProvider(secret_name, ttl)
+        return providers[secret_name]
+
+
+#**********************************************************************
+# Wrap and unwrap data keys
+#**********************************************************************
+def derive_wrapping_key(master_key):
+    master = base64.urlsafe_b64decode(master_key)
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'warinpocket-wrap-v1').derive(master)
+
+
+def wrap_data_key(master_key, data_key):
+    nonce = os.urandom(NONCE_SIZE)
+    wrapped = AESGCM(derive_wrapping_key(master_key)).encrypt(nonce, base64.urlsafe_b64decode(data_key), WRAP_AAD)
+    return base64.b64encode(nonce + wrapped).decode()
+
+
+def unwrap_data_key(master_key, token):
+    blob = base64.b64decode(token)
+    try:
+        data_key = AESGCM(derive_wrapping_key(master_key)).decrypt(blob[:NONCE_SIZE], blob[NONCE_SIZE:], WRAP_AAD)
+    except InvalidTag:
+        raise KeyUnwrapError("Wrapped data key failed authentication.")
+    return base64.urlsafe_b64encode(data_key)
+
+
+def key_metadata(master_version, master_key, data_key):
+    return {WRAPPED_KEY_METADATA: wrap_data_key(master_key, data_key), KEY_VERSION_METADATA: master_version}
+
+
+def new_data_key(provider):
+    """Return a fresh data key and the object metadata that stores it wrapped by the current master key."""
+    data_key = base64.urlsafe_b64encode(os.urandom(32))
+    master_version, master_key = provider.get_current_key()
+    return data_key, key_metadata(master_version, master_key, data_key)
+
+
+def data_key_from_metadata(provider, metadata):
+    """Return the key an object was encrypted with, given its metadata."""
+    if WRAPPED_KEY_METADATA not in metadata:
+        raise KeyUnwrapError("Object has no wrapped data key.")
+    return unwrap_data_key(provider.get_key(metadata[KEY_VERSION_METADATA]), metadata[WRAPPED_KEY_METADATA])
+
+
+#**********************************************************************
+# Rotate the master key across stored backups
+#**********************************************************************
+def rewrap_object(s3_client, provider, bucket_name, object_key, master_version, master_key):
+    """Re-wrap one object's data key under the given master key. Returns True if the object changed."""
+    head = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+    metadata = head['Metadata']
+    if metadata.get(KEY_VERSION_METADATA) == master_version:
+        return False
+    data_key = data_key_from_metadata(provider, metadata)
+
+    metadata.update(key_metadata(master_version, master_key, data_key))
+    # Managed copy stays server-side and switches to multipart copy for large objects
+    s3_client.copy({'Bucket': bucket_name, 'Key': object_key}, bucket_name, object_key,
+                   ExtraArgs={'Metadata': metadata, 'MetadataDirective': 'REPLACE',
+                              'ContentType': head.get('ContentType', 'binary/octet-stream')})
+    return True
+
+
+def rotate_master_key(s3_client, provider, bucket_name, object_keys, max_workers=16):
+    """Store a new master key and re-wrap the data keys of object_keys under it in parallel."""
+    master_version, master_key = provider.rotate()
+
+    def rewrap_one(object_key):
+        try:
+            return object_key, rewrap_object(s3_client, provider, bucket_name, object_key, master_version,
+                                             master_key), None
+        except (ClientError, KeyUnwrapError) as e:
+            return object_key, False, str(e)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(rewrap_one, object_keys))
+
+    for object_key, changed, error in results:
+        if error is not None:
+            print(f"FAILED {object_key}: {error}")
+    rewrapped = sum(1 for object_key, changed, error in results if changed)
+    print(f"Re-wrapped {rewrapped}/{len(results)} objects under key version {master_version} "
+          f"in {time.perf_counter() - started:.2f}s.")
+    return results
+
+
+def list_object_keys(s3_client, bucket_name, prefixes):
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for prefix in prefixes:
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rotate the backup master key and re-wrap stored data keys')
+    parser.add_argument('--bucket', required=True, help='Bucket holding the encrypted backups')
+    parser.add_argument('--secret', default='db_encryption_key_photo_project', help='Secret holding the master key')
+    parser.add_argument('--prefix', action='append', dest='prefixes',
+                        help='Only re-wrap objects under this prefix (repeatable, default: the DB backups)')
+    parser.add_argument('--workers', type=int, default=16, help='Number of parallel re-wraps')
+    args = parser.parse_args()
+
+    prefixes = args.prefixes or ['warinpocket.sqlite', 'incremental/']
+    s3_client = get_client('s3', min_pool_connections=args.workers)
+    object_keys = list(list_object_keys(s3_client, args.bucket, prefixes))
+    rotate_master_key(s3_client, get_key_provider(args.secret), args.bucket, object_keys, max_workers=args.workers)
@@ -1,56 +1,98 @@
-#from moto import mock_s3, mock_secretsmanager, mock_iam, mock_resourcegroupstaggingapi
-from moto import mock_aws
-# Mock all AWS services before running the script logic
-#mock_s3().start()
-#mock_secretsmanager().start()
-#mock_iam().start()
-#mock_resourcegroupstaggingapi().start()
-mock_aws().start()
-
-# Your existing script below this point remains unchanged
 import os
 import sqlite3
-import boto3
+import argparse
 import shutil
 from botocore.exceptions import ClientError
 import uuid
-from cryptography.fernet import Fernet
+from aws_setup.stream_crypto import EncryptingReader, StreamDecryptionError
+from aws_setup.db_snapshot import (snapshot_db, temporary_snapshot, CompressingReader, COMPRESSION_CODECS,
+                                  DECOMPRESSION_ERRORS)
+from aws_setup.incremental_backup import backup_incremental, restore_incremental
+from aws_setup.key_provider import get_key_provider, new_data_key, KeyUnwrapError
+from aws_setup.db_restore import restore_db_to_file, restore_db_to_memory, RestoreError
+from aws_setup.db_sync import (load_sync_state, local_fingerprint, hash_local_db, record_sync, check_remote,
+                               plan_db_sync, conditional_upload, SyncConflictError, SOURCE_HASH_METADATA)
+from aws_setup.resource_inventory import (ResourceInventory, BUCKETS_SCOPE, DEFAULT_INVENTORY_PATH, tag_scope,
+                                          scan_all_buckets)
+from aws_setup.resource_discovery import resource_record, discover_project_resources
+from Utilities.aws_clients import get_client, start_local_mock
+from Utilities.profiling import add_profile_arguments, profile_from_args
 
 DB_NAME = "warinpocket.sqlite"
 LOCAL_DB_PATH = f"/Users/renncollins/PycharmProjects/PhotoProject/{DB_NAME}"
 secret_name = "photo_project_encryption_key"
+BACKUP_SECRET_NAME = "db_encryption_key_photo_project"
 
-s3_client = boto3.client('s3')
-resource_client = boto3.client('resourcegroupstaggingapi')
+# Multipart settings for streaming the encrypted DB: memory stays around part size x concurrency
+BACKUP_PART_SIZE = 8 * 1024 * 1024
+BACKUP_PART_CONCURRENCY = 4
+
+# Compression applied to the snapshot before encryption: 'none', 'zlib', 'bz2' or 'lzma'.
+# The codec is stored in the object's metadata so a restore knows how to undo it.
+BACKUP_COMPRESSION = "zlib"
+BACKUP_COMPRESSION_LEVEL = None  # None uses the codec's default level
+
+# Incremental backups upload only the changed chunks of the DB plus a small manifest per snapshot,
+# under incremental/<DB_NAME>/ in the bucket. Restore them with `python -m aws_setup.incremental_backup`.
+INCREMENTAL_BACKUP = False
+
+# What sync_db_with_s3() does when both the local DB and the backup changed since the last sync:
+# None only reports the conflict, "push" keeps the local DB and "pull" keeps the backup.
+SYNC_CONFLICT_POLICY = None
+
+# Local cache of bucket names and tagged resources, so lookups don't scan AWS on every run.
+# If it can't be opened or written the lookups go to AWS directly.
+INVENTORY_PATH = DEFAULT_INVENTORY_PATH
+INVENTORY_TTL = 15 * 60
+inventory = None
 
 #**********************************************************************
 # Function List (Ordered by Call Sequence)
 #**********************************************************************
-# check_s3_bucket_exists() -> str or None: Lists all S3 buckets with the specific prefix and returns the first one.
+# check_s3_bucket_exists(refresh: bool) -> str or None: Returns the first S3 bucket with the specific prefix, from the inventory cache.
 # check_local_db() -> bool: Checks if the local SQLite database exists.
 # create_s3_bucket() -> str or None: Creates a new S3 bucket and returns the bucket name.
 # upload_db_to_s3_bucket(bucket_name: str): Uploads the local SQLite database to the specified S3 bucket.
 # load_db() -> sqlite3.Connection or None: Loads the local SQLite database if it exists.
 # check_db_in_s3_bucket(bucket_name: str) -> bool: Checks if the SQLite database exists in the specified S3 bucket.
-# download_db_from_s3(bucket_name: str): Downloads the SQLite database from the specified S3 bucket.
+# download_db_from_s3(bucket_name: str, in_memory: bool) -> sqlite3.Connection, True or None: Downloads and decrypts the SQLite database from the specified S3 bucket.
 # create_new_photo_project_db() -> sqlite3.Connection or None: Creates a new SQLite database for the Photo Project.
 # insert_s3_bucket_into_db(conn: sqlite3.Connection, bucket_name: str): Inserts the S3 bucket name into the SQLite database.
 # get_s3_bucket_name_from_db(conn: sqlite3.Connection) -> str or None: Retrieves the S3 bucket name from the SQLite database.
 # check_db_specified_bucket_exists(conn: sqlite3.Connection) -> bool: Checks if the S3 bucket exists in AWS.
-# search_for_photo_project_resources(): Searches for all AWS resources tagged 'PhotoProject' and prints them.
+# search_for_photo_project_resources(refresh: bool): Prints all AWS resources tagged 'PhotoProject', from the inventory cache.
+# sync_db_with_s3(bucket_name: str, conn) -> sqlite3.Connection: Pushes or pulls the DB only when one side changed.
+# backup_db(incremental: bool, compression: str) -> str or None: Backs up the local DB to the bucket recorded in it.
+# restore_db(refresh: bool, incremental: bool, snapshot_id: str) -> bool: Restores the local DB from the project bucket.
+# sync_all(refresh: bool) -> sqlite3.Connection or None: Creates the bucket and DB if missing, then syncs them.
+# main(argv: list): Command line entry point (sync, backup or restore); --mock runs against a local moto mock.
+
+#**********************************************************************
+# Open the resource inventory cache
+#**********************************************************************
+def get_inventory():
+    """Return the shared resource inventory, opening it on first use."""
+    global inventory
+    if inventory is None:
+        inventory = ResourceInventory(INVENTORY_PATH, INVENTORY_TTL)
+    return inventory
 
 #**********************************************************************
 # Check if S3 bucket exists with the specific prefix
 #**********************************************************************
-def check_s3_bucket_exists():
-    """List all S3 buckets with the prefix 'warinpocketbucket-' and return the first one."""
+def check_s3_bucket_exists(refresh=False):
+    """Return the first S3 bucket with the prefix 'warinpocketbucket-', using the inventory cache."""
     prefix = "warinpocketbucket-"
     try:
-        response = s3_client.list_buckets()
-        for bucket in response['Buckets']:
-            if bucket['Name'].startswith(prefix):
-                print(f"Found bucket '{bucket['Name']}' with prefix '{prefix}'.")
-                return bucket['Name']
+        try:
+            bucket_name = get_inventory().find_bucket(prefix, force_refresh=refresh)
+        except sqlite3.Error as e:
+            print(f"Resource inventory unavailable ({e}), listing buckets directly.")
+            bucket_name = min((record['Identifier'] for record in scan_all_buckets()
+                               if record['Identifier'].startswith(prefix)), default=None)
+        if bucket_name:
+            print(f"Found bucket '{bucket_name}' with prefix '{prefix}'.")
+            return bucket_name
         print(f"No bucket found with prefix '{prefix}'.")
         return None
     except ClientError as e:
@@ -65,15 +107,10 @@ def check_s3_bucket_exists():
 #**********************************************************************
 def encrypt_file(source_file_path, encrypted_file_path, key):
     """Encrypt the source file and save the encrypted content to a separate file."""
-    fernet = Fernet(key)
-
-    with open(source_file_path, 'rb') as file:
-        original = file.read()  # Read the original file
-
-    encrypted = fernet.encrypt(original)  # Encrypt the file
-
-    with open(encrypted_file_path, 'wb') as encrypted_file:
-        encrypted_file.write(encrypted)  # Write the encrypted content to the new file
+    # Stream chunk by chunk so memory use doesn't grow with the file
+    with open(source_file_path, 'rb') as file, open(encrypted_file_path, 'wb') as encrypted_file:
+        reader = EncryptingReader(file, key)
+        shutil.copyfileobj(reader, encrypted_file, 1024 * 1024)
 
     print(f"File '{source_file_path}' encrypted and saved as '{encrypted_file_path}'.")
 #**********************************************************************
@@ -84,31 +121,10 @@ def encrypt_file(source_file_path, encrypted_file_path, key):
 
 
 def create_and_store_key_in_secrets_manager(secret_name):
-    """Generate a new encryption key and store it in AWS Secrets Manager if it doesn't already exist."""
-    secrets_client = boto3.client('secretsmanager')
-
-    # Check if the secret already exists
+    """Return the encryption key from AWS Secrets Manager, generating and storing one if it doesn't already exist."""
+    # The provider caches the key in process, so repeated backups don't each call Secrets Manager
     try:
-        # Try to retrieve the secret to see if it exists
-        response = secrets_client.get_secret_value(SecretId=secret_name)
-        print(f"Encryption key already exists in Secrets Manager under secret name '{secret_name}'.")
-        return response['SecretString'].encode()
-    except secrets_client.exceptions.ResourceNotFoundException:
-        # If the secret doesn't exist, generate a new encryption key
-        key = Fernet.generate_key()
-        print(f"Generated a new encryption key: {key.decode()}")
-
-        # Store the new key in Secrets Manager
-        try:
-            secrets_client.create_secret(
-                Name=secret_name,
-                SecretString=key.decode()  # Store the key as a string
-            )
-            print(f"Encryption key successfully stored in Secrets Manager under secret name '{secret_name}'.")
-            return key
-        except ClientError as e:
-            print(f"Error storing encryption key in Secrets Manager: {e}")
-            return None
+        return get_key_provider(secret_name).get_current_key()[1]
     except ClientError as e:
         print(f"Error retrieving secret from Secrets Manager: {e}")
         return None
@@ -119,7 +135,12 @@ def create_and_store_key_in_secrets_manager(secret_name):
 def copy_db():
     """Copy the database file to a new location."""
     try:
-        shutil.copy(LOCAL_DB_PATH, f"{LOCAL_DB_PATH}_copy")
+        # The backup API gives a consistent copy even while the database is being written
+        conn = sqlite3.connect(LOCAL_DB_PATH)
+        try:
+            snapshot_db(conn, f"{LOCAL_DB_PATH}_copy")
+        finally:
+            conn.close()
         print(f"Database copied from '{LOCAL_DB_PATH}' to '{LOCAL_DB_PATH}_copy'.")
     except Exception as e:
         print(f"Error copying the database: {e}")
@@ -141,6 +162,7 @@ def check_local_db():
 # Create a new S3 bucket
 #**********************************************************************
 def create_s3_bucket():
+    s3_client = get_client('s3')
     bucket_name = f"warinpocketbucket-{uuid.uuid4()}"
     #current_region = boto3.session.Session().region_name
     try:
@@ -161,6 +183,14 @@ def create_s3_bucket():
             }
         )
 
+        # Record the bucket so the cached lookups see it before their next scan
+        record = resource_record(f"arn:aws:s3:::{bucket_name}", {'Project': 'PhotoProject'})
+        try:
+            get_inventory().record_resource(BUCKETS_SCOPE, record)
+            get_inventory().record_resource(tag_scope('Project', 'PhotoProject'), record)
+        except sqlite3.Error as e:
+            print(f"Could not record the new bucket in the resource inventory: {e}")
+
         print(f"New Bucket '{bucket_name}' created in us-east-1.")
         return bucket_name
     except ClientError as e:
@@ -170,11 +200,18 @@ def create_s3_bucket():
 #**********************************************************************
 # Upload SQLite database to S3 bucket
 #**********************************************************************
-def upload_db_to_s3_bucket(conn):
-    """Encrypt a copy of the SQLite database and upload it to the specified S3 bucket."""
-    # Use the correct secret name as a string
-    key = create_and_store_key_in_secrets_manager("db_encryption_key_photo_project")
-    encrypted_db_path = f"{LOCAL_DB_PATH}_copy"  # The temporary encrypted copy path
+def upload_db_to_s3_bucket(conn, compression=None, compression_level=None, incremental=None, if_match=None,
+                           if_none_match=None):
+    """Snapshot, compress and encrypt the SQLite database as a stream and upload it to the specified S3 bucket.
+
+    if_match/if_none_match make the upload conditional on the backup's current ETag. Returns the new ETag.
+    """
+    s3_client = get_client('s3')
+    compression = compression or BACKUP_COMPRESSION
+    if compression_level is None:
+        compression_level = BACKUP_COMPRESSION_LEVEL
+    if incremental is None:
+        incremental = INCREMENTAL_BACKUP
 
     # Retrieve the S3 bucket name from the database
     bucket_name = get_s3_bucket_name_from_db(conn)
@@ -184,25 +221,37 @@ def upload_db_to_s3_bucket(conn):
         print("Error: S3 bucket name not found in the database.")
         return
 
-    if key:
-        # Step 1: Copy the database
-        copy_db()  # This will create the _copy version of the DB
-
-        # Step 2: Encrypt the copied database
-        encrypt_file(encrypted_db_path, encrypted_db_path, key)
-
+    key_provider = get_key_provider(BACKUP_SECRET_NAME)
+    if incremental:
         try:
-            # Step 3: Upload the encrypted copy to S3 with the original filename
-            s3_client.upload_file(encrypted_db_path, bucket_name, DB_NAME)
-            print(f"Encrypted database '{DB_NAME}' uploaded to S3 bucket '{bucket_name}'.")
-
-            # Step 4: Remove the encrypted copy after upload
-            os.remove(encrypted_db_path)
-            print(f"Encrypted file '{encrypted_db_path}' deleted after upload.")
-        except ClientError as e:
-            print(f"Error uploading database to S3: {e}")
+            backup_incremental(conn, s3_client, bucket_name, DB_NAME, key_provider, compression=compression)
+        except (ClientError, sqlite3.Error) as e:
+            print(f"Error uploading incremental backup to S3: {e}")
     else:
-        print("Error: Encryption key not found or created.")
+        try:
+            # Envelope encryption: a fresh data key per backup, stored wrapped by the master key in the metadata
+            key, key_metadata = new_data_key(key_provider)
+            # Fingerprint and hash the DB before the snapshot, so a write made during the upload shows up
+            # as a change at the next sync instead of being recorded as synced
+            fingerprint = local_fingerprint(LOCAL_DB_PATH)
+            local_sha256 = hash_local_db(LOCAL_DB_PATH, load_sync_state(LOCAL_DB_PATH, bucket_name))
+            metadata = {'compression': compression, SOURCE_HASH_METADATA: local_sha256, **key_metadata}
+            # Snapshot through the backup API so writes during the upload can't tear the copy, then
+            # compress and encrypt while uploading: both stages run chunk by chunk and feed straight
+            # into a multipart upload, so the private snapshot is the only copy written to disk
+            with temporary_snapshot(conn) as snapshot_path, open(snapshot_path, 'rb') as db_file:
+                stream = EncryptingReader(CompressingReader(db_file, compression, compression_level), key)
+                etag = conditional_upload(s3_client, bucket_name, DB_NAME, stream, metadata, if_match=if_match,
+                                          if_none_match=if_none_match, part_size=BACKUP_PART_SIZE,
+                                          concurrency=BACKUP_PART_CONCURRENCY)
+            record_sync(LOCAL_DB_PATH, bucket_name, etag, local_sha256, fingerprint)
+            print(f"Encrypted database '{DB_NAME}' ({compression} compressed) uploaded to S3 bucket '{bucket_name}'.")
+            return etag
+        except SyncConflictError as e:
+            print(f"Not uploading: {e}")
+        except (ClientError, sqlite3.Error) as e:
+            print(f"Error uploading database to S3: {e}")
+    return None
 #**********************************************************************
 # Load the local SQLite database
 #**********************************************************************
@@ -222,6 +271,7 @@ def load_db():
 #**********************************************************************
 def check_db_in_s3_bucket(bucket_name):
     """Check if the SQLite database is present in the specified S3 bucket."""
+    s3_client = get_client('s3')
     try:
         s3_client.head_object(Bucket=bucket_name, Key=DB_NAME)
         print(f"Database '{DB_NAME}' exists in S3 bucket '{bucket_name}'.")
@@ -237,12 +287,73 @@ def check_db_in_s3_bucket(bucket_name):
 #**********************************************************************
 # Download SQLite database from S3 bucket
 #**********************************************************************
-def download_db_from_s3(bucket_name):
+def download_db_from_s3(bucket_name, in_memory=False):
+    """Download, decrypt and verify the database backup.
+
+    Returns an in-memory connection if in_memory is set, otherwise True once the local file is replaced;
+    None if the download failed.
+    """
+    s3_client = get_client('s3')
+    key_provider = get_key_provider(BACKUP_SECRET_NAME)
     try:
-        s3_client.download_file(bucket_name, DB_NAME, LOCAL_DB_PATH)
+        if in_memory:
+            # Read-only use: the decrypted DB only ever exists in this process's memory
+            conn = restore_db_to_memory(s3_client, bucket_name, DB_NAME, key_provider)
+            print(f"Database loaded into memory from S3 bucket '{bucket_name}'.")
+            return conn
+        etag, local_sha256 = restore_db_to_file(s3_client, bucket_name, DB_NAME, key_provider, LOCAL_DB_PATH)
+        record_sync(LOCAL_DB_PATH, bucket_name, etag, local_sha256)
         print(f"Database downloaded to {LOCAL_DB_PATH}")
-    except ClientError as e:
+        return True
+    except (ClientError, StreamDecryptionError, RestoreError, KeyUnwrapError, ValueError, *DECOMPRESSION_ERRORS) as e:
         print(f"Error downloading from S3: {e}")
+    return None
+
+#**********************************************************************
+# Sync the local database with its backup in S3
+#**********************************************************************
+def sync_db_with_s3(bucket_name, conn=None, on_conflict=None):
+    """Push or pull the database only if one side changed since the last sync. Returns the open connection."""
+    s3_client = get_client('s3')
+    on_conflict = on_conflict or SYNC_CONFLICT_POLICY
+    state = load_sync_state(LOCAL_DB_PATH, bucket_name)
+    local_exists = os.path.exists(LOCAL_DB_PATH)
+    fingerprint = local_fingerprint(LOCAL_DB_PATH)
+    local_sha256 = hash_local_db(LOCAL_DB_PATH, state) if local_exists else None
+
+    try:
+        # One HEAD; with a stored ETag S3 answers 304 without a body when the backup is unchanged
+        remote_status, head = check_remote(s3_client, bucket_name, DB_NAME, state.get('etag'))
+    except ClientError as e:
+        print(f"Error checking database in S3: {e}")
+        return conn
+    action = plan_db_sync(local_exists, local_sha256, state, remote_status, head)
+
+    if action == 'conflict':
+        print(f"Both the local database and the backup in '{bucket_name}' changed since the last sync.")
+        if on_conflict not in ('push', 'pull'):
+            print("Set SYNC_CONFLICT_POLICY to 'push' or 'pull' to resolve it.")
+            return conn
+        action = on_conflict
+
+    if action == 'none':
+        print(f"Database '{DB_NAME}' is in sync with S3 bucket '{bucket_name}'.")
+    elif action == 'record':
+        record_sync(LOCAL_DB_PATH, bucket_name, head['ETag'], local_sha256, fingerprint)
+        print(f"Database '{DB_NAME}' already matches the backup in S3 bucket '{bucket_name}'.")
+    elif action == 'push':
+        conn = conn or load_db()
+        if remote_status == 'missing':
+            upload_db_to_s3_bucket(conn, incremental=False, if_none_match='*')
+        else:
+            upload_db_to_s3_bucket(conn, incremental=False, if_match=head['ETag'] if head else state['etag'])
+    elif action == 'pull':
+        # The restore replaces the file, so reopen instead of keeping a handle on the old one
+        if conn:
+            conn.close()
+        download_db_from_s3(bucket_name)
+        conn = load_db()
+    return conn
 
 #**********************************************************************
 # Create a new SQLite database for the Photo Project
@@ -298,6 +409,7 @@ def get_s3_bucket_name_from_db(conn):
 #**********************************************************************
 def check_db_specified_bucket_exists(conn):
     """Check if the S3 bucket exists in AWS."""
+    s3_client = get_client('s3')
     bucket_name = get_s3_bucket_name_from_db(conn)
 
     if bucket_name:
@@ -315,13 +427,15 @@ def check_db_specified_bucket_exists(conn):
 #**********************************************************************
 # Search for all AWS resources tagged 'PhotoProject'
 #**********************************************************************
-def search_for_photo_project_resources():
+def search_for_photo_project_resources(refresh=False):
     """Search for all AWS resources tagged with 'PhotoProject' and print them."""
     try:
-        response = resource_client.get_resources(
-            TagFilters=[{'Key': 'Project', 'Values': ['PhotoProject']}]
-        )
-        resources = response.get('ResourceTagMappingList', [])
+        # Served from the inventory while it is fresh; a rescan follows every page of every resource type
+        try:
+            resources = get_inventory().tagged_resources('Project', 'PhotoProject', force_refresh=refresh)
+        except sqlite3.Error as e:
+            print(f"Resource inventory unavailable ({e}), searching AWS directly.")
+            resources = discover_project_resources('Project', 'PhotoProject')
         if resources:
             print("Resources tagged with 'PhotoProject':")
             for resource in resources:
@@ -331,43 +445,109 @@ def search_for_photo_project_resources():
     except ClientError as e:
         print(f"Error retrieving tagged resources: {e}")
 
+#**********************************************************************
+# Back up or restore the database on request
+#**********************************************************************
+def backup_db(incremental=False, compression=None):
+    """Upload the local database to the bucket recorded in it."""
+    conn = load_db()
+    if conn is None:
+        print(f"No local database at {LOCAL_DB_PATH} to back up.")
+        return None
+    try:
+        return upload_db_to_s3_bucket(conn, compression=compression, incremental=incremental)
+    finally:
+        conn.close()
+
+
+def restore_db(refresh=False, incremental=False, snapshot_id=None):
+    """Replace the local database with the latest backup (or an incremental snapshot) from the project bucket."""
+    bucket_name = check_s3_bucket_exists(refresh=refresh)
+    if not bucket_name:
+        print("No Photo Project bucket to restore from.")
+        return False
+    if not incremental:
+        return download_db_from_s3(bucket_name) is True
+    try:
+        restore_incremental(get_client('s3'), bucket_name, DB_NAME, get_key_provider(BACKUP_SECRET_NAME),
+                            LOCAL_DB_PATH, snapshot_id)
+        return True
+    except (ClientError, ValueError, KeyUnwrapError, StreamDecryptionError, *DECOMPRESSION_ERRORS) as e:
+        print(f"Error restoring incremental snapshot: {e}")
+        return False
+
+
 #**********************************************************************
 # MAIN LOGIC
 #**********************************************************************
-bucket_name = check_s3_bucket_exists()
-local_db_exists = check_local_db()  # Store the result of checking local DB existence
-conn = None  # Initialize connection variable
-
-if local_db_exists and not bucket_name:
-    # Case 1: Local DB exists, but no S3 bucket
-    print("Local DB exists, but no S3 bucket found.")
-    bucket_name = create_s3_bucket()
-    conn = load_db()  # Load the local DB into 'conn'
-    upload_db_to_s3_bucket(conn)  # Upload the local DB to the new S3 bucket
-
-elif local_db_exists and bucket_name:
-    # Case 2: Local DB exists and S3 bucket exists
-    print("Local DB and S3 bucket both exist.")
-    conn = load_db()  # Load the local DB into 'conn'
-    if not check_db_in_s3_bucket(bucket_name):  # If DB is not in the S3 bucket
-        upload_db_to_s3_bucket(conn)  # Upload the local DB to the S3 bucket
-
-elif not local_db_exists and bucket_name:
-    # Case 3: No local DB, but S3 bucket exists
-    print("No local DB, but S3 bucket found.")
-    if check_db_in_s3_bucket(bucket_name):  # If DB is in the S3 bucket
-        download_db_from_s3(bucket_name)  # Download the DB from S3
-        conn = load_db()  # Load the downloaded DB into 'conn'
+def sync_all(refresh=False):
+    """Make sure the bucket and the database exist on both sides, then sync them."""
+    bucket_name = check_s3_bucket_exists(refresh=refresh)
+    local_db_exists = check_local_db()  # Store the result of checking local DB existence
+    conn = None  # Initialize connection variable
+
+    if local_db_exists and not bucket_name:
+        # Case 1: Local DB exists, but no S3 bucket
+        print("Local DB exists, but no S3 bucket found.")
+        bucket_name = create_s3_bucket()
+        conn = load_db()  # Load the local DB into 'conn'
+        upload_db_to_s3_bucket(conn)  # Upload the local DB to the new S3 bucket
+
+    elif local_db_exists and bucket_name:
+        # Case 2: Local DB exists and S3 bucket exists
+        print("Local DB and S3 bucket both exist.")
+        conn = load_db()  # Load the local DB into 'conn'
+        conn = sync_db_with_s3(bucket_name, conn)  # Push or pull only what changed since the last sync
+
+    elif not local_db_exists and bucket_name:
+        # Case 3: No local DB, but S3 bucket exists
+        print("No local DB, but S3 bucket found.")
+        if check_db_in_s3_bucket(bucket_name):  # If DB is in the S3 bucket
+            download_db_from_s3(bucket_name)  # Download the DB from S3
+            conn = load_db()  # Load the downloaded DB into 'conn'
+        else:
+            print("No DB found in S3, creating a new one locally.")
+            conn = create_new_photo_project_db()
+            insert_s3_bucket_into_db(conn, bucket_name)  # The upload reads the bucket from the DB
+            upload_db_to_s3_bucket(conn)  # Upload the new DB to the S3 bucket
     else:
-        print("No DB found in S3, creating a new one locally.")
+        # Case 4: No local DB and no S3 bucket
+        print("Neither local DB nor S3 bucket found. Creating both.")
+        bucket_name = create_s3_bucket()
         conn = create_new_photo_project_db()
-        upload_db_to_s3_bucket(conn)  # Upload the new DB to the S3 bucket
-else:
-    # Case 4: No local DB and no S3 bucket
-    print("Neither local DB nor S3 bucket found. Creating both.")
-    bucket_name = create_s3_bucket()
-    conn = create_new_photo_project_db()
-    upload_db_to_s3_bucket(conn)
-
-# Search and print AWS resources tagged 'PhotoProject'
-search_for_photo_project_resources()
\ No newline at end of file
+        insert_s3_bucket_into_db(conn, bucket_name)
+        upload_db_to_s3_bucket(conn)
+
+    # Search and print AWS resources tagged 'PhotoProject'
+    search_for_photo_project_resources(refresh=refresh)
+    return conn
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check, back up and restore the Photo Project database.")
+    parser.add_argument('action', nargs='?', default='sync', choices=['sync', 'backup', 'restore'],
+                        help='sync (default) creates what is missing and syncs the DB; backup and restore only copy it')
+    parser.add_argument('--refresh', action='store_true', help='Rescan AWS instead of trusting the resource inventory')
+    parser.add_argument('--incremental', action='store_true', help='Back up or restore changed chunks only')
+    parser.add_argument('--snapshot', help='Incremental snapshot to restore (default: the latest)')
+    parser.add_argument('--compression', choices=COMPRESSION_CODECS, help='Compression codec for the backup')
+    parser.add_argument('--mock', action='store_true', help='Run against a local moto mock instead of AWS')
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.mock:
+        start_local_mock()
+
+    with profile_from_args(args, args.action):
+        if args.action == 'backup':
+            backup_db(args.incremental, args.compression)
+        elif args.action == 'restore':
+            restore_db(args.refresh, args.incremental, args.snapshot)
+        else:
+            conn = sync_all(refresh=args.refresh)
+            if conn is not None:
+                conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,11 @@
-import boto3
 from botocore.exceptions import ClientError
-from datetime import datetime
 import argparse
 import uuid
-
-dynamodb_client = boto3.client('dynamodb')
-s3_client = boto3.client('s3')
-iam_client = boto3.client('iam')
-
-
-# **************************************************
-# * convert tags response to a dictionary so its not such a pain in the ass *
-# **************************************************
-
-def convert_tags_to_dict(tag_set):
-    return {tag['Key']: tag['Value'] for tag in tag_set}
+from aws_setup.resource_discovery import discover_project_resources, group_by_type, default_workers
+from aws_setup.resource_registry import register_resources
+from aws_setup.resource_reconciler import reconcile, desired_state
+from Utilities.aws_clients import get_client
+from Utilities.profiling import add_profile_arguments, profile_from_args
 
 
 # **************************************************
@@ -22,6 +13,7 @@ def convert_tags_to_dict(tag_set):
 # **************************************************
 
 def check_dynamo_table_exists():
+    dynamodb_client = get_client('dynamodb')
     table_name = "PhotoProjectResources"
     try:
         dynamodb_client.describe_table(TableName=table_name)
@@ -34,40 +26,16 @@ def check_dynamo_table_exists():
 # * Function: find_resources_by_tag *
 # **************************************************
 
-def find_project_resources():
-    found_resources = {}
-    duplicate_resources = []
-
-    # Get the list of all S3 buckets
-    try:
-        response = s3_client.list_buckets()
-        s3_buckets = response['Buckets']
-    except ClientError as e:
-        print(f"Error retrieving S3 buckets: {e}")
-        return found_resources
-
-    # Check each S3 bucket for the specific tag "Project: PhotoProject"
-    for bucket in s3_buckets:
-        bucket_name = bucket['Name']
-        try:
-            # Get the tagging information for the current bucket
-            tagging_response = s3_client.get_bucket_tagging(Bucket=bucket_name)
-            tag_set = tagging_response['TagSet']
-            bucket_tags = convert_tags_to_dict(tag_set)  # Convert the list of tags to a dictionary
-        except ClientError as e:
-            print(f"Bucket '{bucket_name}' has no tags or failed to retrieve tags. Error: {e}")
-            continue  # Skip this bucket if there's no tagging information
-
-        # Look for the value "PhotoProject" for the "Project" tag
-        if bucket_tags.get('Project') == "PhotoProject":
-            if 's3' in found_resources:
-                duplicate_resources.append(bucket_name)
-            else:
-                found_resources['s3'] = bucket_name
+def find_project_resources(max_workers=default_workers, use_tagging_api=True):
+    """Return {resource type: [identifiers]} for every resource tagged "Project: PhotoProject"."""
+    # Tags are fetched concurrently (or through the Tagging API), so this no longer takes a call per bucket in turn
+    records = discover_project_resources('Project', 'PhotoProject', max_workers=max_workers,
+                                         use_tagging_api=use_tagging_api)
+    found_resources = group_by_type(records)
 
     # Raise an exception if duplicates are found
-    if duplicate_resources:
-        raise Exception(f"Duplicate S3 resources found: {duplicate_resources}")
+    if len(found_resources.get('s3', [])) > 1:
+        raise Exception(f"Duplicate S3 resources found: {found_resources['s3']}")
 
     return found_resources
 
@@ -82,6 +50,7 @@ def find_project_resources():
 
 
 def create_dynamodb_table():
+    dynamodb_client = get_client('dynamodb')
     table_name = "PhotoProjectResources"
 
     try:
@@ -115,29 +84,39 @@ def create_dynamodb_table():
 
 
 def add_resource_to_dynamodb(resource_type, resource_identifier):
+    dynamodb_client = get_client('dynamodb')
     table_name = "PhotoProjectResources"  # Hardcoded table name
 
     try:
-        # Add a resource to the DynamoDB table
-        dynamodb_client.put_item(
-            TableName=table_name,
-            Item={
-                'ResourceType': {'S': resource_type},  # Partition key (Resource Name)
-                'ResourceIdentifier': {'S': resource_identifier},  # ARN of the resource
-                'CreationDate': {'S': datetime.now().isoformat()}  # Current timestamp
-            }
-        )
+        # Goes through the registry writer so the item carries the table's ResourceName hash key
+        register_resources([(resource_type, resource_identifier)], table_name=table_name,
+                           dynamodb_client=dynamodb_client)
         print(f"Resource '{resource_type}'{resource_identifier} added to DynamoDB.")
 
     except ClientError as e:
         print(f"Error adding resource to DynamoDB: {e}")
 
 
+# **************************************************
+# * Function: fix_connections *
+# **************************************************
+
+def fix_connections(conditional=True):
+    """Register every tagged project resource in the DynamoDB registry in batches."""
+    records = discover_project_resources('Project', 'PhotoProject')
+    try:
+        return register_resources([(record['ResourceType'], record['Identifier']) for record in records],
+                                  conditional=conditional)
+    except ClientError as e:
+        print(f"Error registering resources in DynamoDB: {e}")
+
+
 # **************************************************
 # * Function: initialize_all_resources *
 # **************************************************
 
 def create_s3_bucket():
+    s3_client = get_client('s3')
     # Generate a unique bucket name using a UUID
     bucket_name = f"photo-project-{uuid.uuid4()}"
 
@@ -169,34 +148,13 @@ def create_s3_bucket():
 # * Function: initialize_all_resources *
 # **************************************************
 
-def initialize_all_resources():
-    # Check if DynamoDB table exists
-    table_name = "ResourceTrackingTable"
-    if check_dynamo_table_exists(table_name):
-        raise Exception(f"DynamoDB table '{table_name}' already exists.")
-
-    # Check for resources with project tag
-    project_tag = "PhotoProject"
-    found_resources = find_resources_by_tag('ProjectName', project_tag)
-    if found_resources:
-        raise Exception(f"Resources with tag 'ProjectName: {project_tag}' already exist: {found_resources}")
-
-    print("No existing resources found. Initializing new resources...")
-
-    # Initialize DynamoDB table
-    # Logic to create DynamoDB table and insert ARN tracking
-
-    # Initialize S3 bucket
-    if 's3' not in found_resources:
-        print("No S3 bucket found, creating one...")
-        bucket_name = create_s3_bucket()
-        if bucket_name:
-            add_resource_to_dynamodb('S3Bucket', bucket_name)
-    else:
-        print(f"S3 bucket '{found_resources['s3']}' already exists.")
-
-    # Initialize IAM roles
-    # Logic to create IAM roles and attach policies
+def initialize_all_resources(dry_run=False):
+    """Create whatever the project is missing: registry table, tagged S3 bucket, IAM roles and registry entries."""
+    # One read pass over tags, the registry and the roles, then only the missing pieces are created
+    steps, failed = reconcile(desired_state(), dry_run=dry_run)
+    if failed:
+        raise Exception(f"Could not initialize: {sorted(failed)}")
+    return steps
 
 
 # **************************************************
@@ -209,22 +167,32 @@ if __name__ == "__main__":
     parser.add_argument('--list-arns', action='store_true', help='List ARNs of all project resources.')
     parser.add_argument('--fix-connections', action='store_true',
                         help='Fix connections by adding tagged ARNs to DynamoDB.')
+    parser.add_argument('--overwrite-registry', action='store_true',
+                        help='With --fix-connections, overwrite existing registrations instead of skipping them.')
     parser.add_argument('--remove-all', action='store_true', help='Remove all resources, including DynamoDB and S3.')
+    parser.add_argument('--plan', action='store_true', help='Print what initializing would change without changing it.')
+    add_profile_arguments(parser)
 
     args = parser.parse_args()
+    actions = (args.overwrite_all, args.list_arns, args.fix_connections, args.overwrite_registry, args.remove_all,
+               args.plan)
+
+    with profile_from_args(args, 'photoproject_resource_initializer'):
+        if args.overwrite_all:
+            handle_overwrite_all()
 
-    if args.overwrite_all:
-        handle_overwrite_all()
+        if args.list_arns:
+            list_arns('ProjectName', 'PhotoProject')
 
-    if args.list_arns:
-        list_arns('ProjectName', 'PhotoProject')
+        if args.fix_connections:
+            fix_connections(conditional=not args.overwrite_registry)
 
-    if args.fix_connections:
-        fix_connections()
+        if args.remove_all:
+            remove_all_resources()
 
-    if args.remove_all:
-        remove_all_resources()
+        if args.plan:
+            initialize_all_resources(dry_run=True)
 
-    # Default behavior: Initialize everything, throw exception if resources exist
-    if not any(vars(args).values()):  # If no arguments were passed
-        initialize_all_resources()
+        # Default behavior: create whatever is missing, leaving existing resources as they are
+        if not any(actions):  # If no actions were passed
+            initialize_all_resources()
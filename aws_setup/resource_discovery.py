@@ -0,0 +1,194 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from Utilities.aws_clients import get_client
+
+default_workers = 16
+default_tag_key = 'Project'
+default_tag_value = 'PhotoProject'
+
+# Error codes that just mean "this resource has no tags", not a failure worth reporting
+untagged_error_codes = ('NoSuchTagSet', 'NoSuchTagSetError')
+
+
+# **************************************************
+# * Describe a resource from its ARN *
+# **************************************************
+
+def resource_record(arn, tags):
+    """Build the record every discovery path returns: ARN, type (the ARN's service), short identifier and tags."""
+    parts = arn.split(':', 5)
+    resource = parts[5]
+    identifier = resource.rsplit('/', 1)[-1] if '/' in resource else resource.rsplit(':', 1)[-1]
+    return {'ResourceARN': arn, 'ResourceType': parts[2], 'Identifier': identifier, 'Tags': tags}
+
+
+def convert_tags_to_dict(tag_set):
+    return {tag['Key']: tag['Value'] for tag in tag_set}
+
+
+def shared_client(service, max_workers):
+    # One client per service shared by every worker thread; the pool needs a connection per worker
+    return get_client(service, min_pool_connections=max_workers)
+
+
+# **************************************************
+# * Function: discover_with_tagging_api *
+# **************************************************
+
+def discover_with_tagging_api(tag_key, tag_value, max_workers=default_workers):
+    """Return every resource the Resource Groups Tagging API knows with the tag, following all pages."""
+    tagging_client = shared_client('resourcegroupstaggingapi', max_workers)
+    records = []
+    paginator = tagging_client.get_paginator('get_resources')
+    for page in paginator.paginate(TagFilters=[{'Key': tag_key, 'Values': [tag_value]}]):
+        for mapping in page.get('ResourceTagMappingList', []):
+            records.append(resource_record(mapping['ResourceARN'], convert_tags_to_dict(mapping.get('Tags', []))))
+    return records
+
+
+# **************************************************
+# * Function: scan_tags_concurrently *
+# **************************************************
+
+def scan_tags_concurrently(names, fetch_record, tag_key, tag_value, max_workers=default_workers, errors=None):
+    """Fetch the record of each named resource over a bounded pool and keep the ones carrying the tag.
+
+    Resources whose tags couldn't be read are left out and, if errors is a list, reported in it.
+    """
+    def fetch(name):
+        try:
+            return fetch_record(name)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in untagged_error_codes:
+                print(f"Failed to retrieve tags for '{name}': {e.response['Error']['Message']}")
+                if errors is not None:
+                    errors.append(e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return [record for record in executor.map(fetch, names)
+                if record and record['Tags'].get(tag_key) == tag_value]
+
+
+# **************************************************
+# * Function: scan_s3_buckets *
+# **************************************************
+
+def scan_s3_buckets(tag_key, tag_value, max_workers=default_workers, errors=None):
+    s3_client = shared_client('s3', max_workers)
+    bucket_names = []
+    for page in s3_client.get_paginator('list_buckets').paginate():
+        bucket_names.extend(bucket['Name'] for bucket in page.get('Buckets', []))
+
+    def fetch_record(name):
+        tag_set = s3_client.get_bucket_tagging(Bucket=name)['TagSet']
+        return resource_record(f"arn:aws:s3:::{name}", convert_tags_to_dict(tag_set))
+
+    return scan_tags_concurrently(bucket_names, fetch_record, tag_key, tag_value, max_workers, errors)
+
+
+# **************************************************
+# * Function: scan_dynamodb_tables *
+# **************************************************
+
+def scan_dynamodb_tables(tag_key, tag_value, max_workers=default_workers, errors=None):
+    dynamodb_client = shared_client('dynamodb', max_workers)
+    table_names = []
+    for page in dynamodb_client.get_paginator('list_tables').paginate():
+        table_names.extend(page['TableNames'])
+
+    def fetch_record(name):
+        table_arn = dynamodb_client.describe_table(TableName=name)['Table']['TableArn']
+        tags = []
+        for page in dynamodb_client.get_paginator('list_tags_of_resource').paginate(ResourceArn=table_arn):
+            tags.extend(page.get('Tags', []))
+        return resource_record(table_arn, convert_tags_to_dict(tags))
+
+    return scan_tags_concurrently(table_names, fetch_record, tag_key, tag_value, max_workers, errors)
+
+
+# **************************************************
+# * Function: scan_iam_roles *
+# **************************************************
+
+def scan_iam_roles(tag_key, tag_value, max_workers=default_workers, errors=None):
+    iam_client = shared_client('iam', max_workers)
+    role_arns = {}
+    for page in iam_client.get_paginator('list_roles').paginate():
+        role_arns.update((role['RoleName'], role['Arn']) for role in page['Roles'])
+
+    def fetch_record(name):
+        tags = []
+        for page in iam_client.get_paginator('list_role_tags').paginate(RoleName=name):
+            tags.extend(page.get('Tags', []))
+        return resource_record(role_arns[name], convert_tags_to_dict(tags))
+
+    return scan_tags_concurrently(list(role_arns), fetch_record, tag_key, tag_value, max_workers, errors)
+
+
+# **************************************************
+# * Function: discover_project_resources *
+# **************************************************
+
+def discover_project_resources(tag_key=default_tag_key, tag_value=default_tag_value, max_workers=default_workers,
+                               use_tagging_api=True, errors=None):
+    """Return records for every resource of every type carrying the tag.
+
+    The Tagging API answers for all regional services in a few paginated calls. If it can't be used,
+    S3 buckets and DynamoDB tables are scanned over a bounded thread pool instead. IAM roles are always
+    scanned that way because the Tagging API doesn't cover them. A failed scan only leaves its resources
+    out; pass a list as errors to learn that the result is incomplete.
+    """
+    records = None
+    if use_tagging_api:
+        try:
+            records = discover_with_tagging_api(tag_key, tag_value, max_workers)
+        except (ClientError, EndpointConnectionError) as e:
+            print(f"Tagging API unavailable, scanning services directly: {e}")
+
+    scans = [scan_iam_roles]
+    if records is None:
+        records = []
+        scans = [scan_s3_buckets, scan_dynamodb_tables, scan_iam_roles]
+
+    # The per-service scans are independent, so they run side by side as well
+    with ThreadPoolExecutor(max_workers=len(scans)) as executor:
+        futures = [executor.submit(scan, tag_key, tag_value, max_workers, errors) for scan in scans]
+        for future in futures:
+            try:
+                records.extend(future.result())
+            except ClientError as e:
+                print(f"Error scanning resources: {e}")
+                if errors is not None:
+                    errors.append(e)
+
+    # The Tagging API can also return IAM resources; keep one record per ARN
+    return list({record['ResourceARN']: record for record in records}.values())
+
+
+def group_by_type(records):
+    """Group discovery records as {resource type: [identifiers]}."""
+    grouped = {}
+    for record in records:
+        grouped.setdefault(record['ResourceType'], []).append(record['Identifier'])
+    return grouped
+
+
+# **************************************************
+# * Main Execution *
+# **************************************************
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List every AWS resource tagged for the Photo Project.")
+    parser.add_argument('--tag-key', default=default_tag_key, help='Tag key to match')
+    parser.add_argument('--tag-value', default=default_tag_value, help='Tag value to match')
+    parser.add_argument('--workers', type=int, default=default_workers, help='Concurrent tag lookups')
+    parser.add_argument('--no-tagging-api', action='store_true', help='Scan each service instead of the Tagging API')
+    args = parser.parse_args()
+
+    for record in discover_project_resources(args.tag_key, args.tag_value, args.workers,
+                                             use_tagging_api=not args.no_tagging_api):
+        print(f"{record['ResourceType']}\t{record['Identifier']}\t{record['ResourceARN']}")
@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from aws_setup.resource_discovery import discover_project_resources, resource_record
+from Utilities.aws_clients import get_client
+
+#**********************************************************************
+# Inventory layout
+#**********************************************************************
+# A small SQLite cache of what exists in AWS, so lookups don't have to ask AWS on every run.
+# Resources are grouped into scopes, each filled by one fully paginated scan:
+#   s3:buckets           every bucket in the account, tagged or not
+#   tag:<key>=<value>    every resource of every type carrying the tag
+# Each scope has its own TTL. A refresh upserts what the scan saw, bumping last_seen, and only
+# deletes rows of that scope the scan didn't see, so the other scopes stay warm.
+
+DEFAULT_INVENTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resource_inventory.sqlite")
+DEFAULT_TTL = 15 * 60
+BUCKETS_SCOPE = "s3:buckets"
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS resources (
+        scope TEXT NOT NULL,
+        arn TEXT NOT NULL,
+        resource_type TEXT NOT NULL,
+        identifier TEXT NOT NULL,
+        tags TEXT NOT NULL,
+        last_seen REAL NOT NULL,
+        PRIMARY KEY (scope, arn)
+    );
+    CREATE INDEX IF NOT EXISTS resources_by_identifier ON resources (scope, identifier);
+    CREATE TABLE IF NOT EXISTS scans (
+        scope TEXT PRIMARY KEY,
+        scanned_at REAL NOT NULL
+    );
+'''
+
+
+def tag_scope(tag_key, tag_value):
+    return f"tag:{tag_key}={tag_value}"
+
+
+#**********************************************************************
+# Scans that fill a scope
+#**********************************************************************
+def scan_all_buckets():
+    """Return a record for every bucket in the account, following all pages."""
+    s3_client = get_client('s3')
+    records = []
+    for page in s3_client.get_paginator('list_buckets').paginate():
+        records.extend(resource_record(f"arn:aws:s3:::{bucket['Name']}", {}) for bucket in page.get('Buckets', []))
+    return records
+
+
+#**********************************************************************
+# Inventory cache
+#**********************************************************************
+class ResourceInventory:
+    """SQLite cache of AWS resources with a TTL per scope."""
+
+    def __init__(self, path=DEFAULT_INVENTORY_PATH, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def scanned_at(self, scope):
+        with self.lock:
+            row = self.conn.execute("SELECT scanned_at FROM scans WHERE scope = ?", (scope,)).fetchone()
+        return row[0] if row else None
+
+    def is_fresh(self, scope):
+        scanned_at = self.scanned_at(scope)
+        return scanned_at is not None and time.time() - scanned_at < self.ttl
+
+    def store_scan(self, scope, records):
+        """Upsert the records a scan returned and drop the rows of the scope it no longer saw."""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                '''INSERT INTO resources (scope, arn, resource_type, identifier, tags, last_seen)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (scope, arn) DO UPDATE SET
+                       tags = excluded.tags, last_seen = excluded.last_seen''',
+                [(scope, record['ResourceARN'], record['ResourceType'], record['Identifier'],
+                  json.dumps(record['Tags'], sort_keys=True), now) for record in records]
+            )
+            removed = self.conn.execute("DELETE FROM resources WHERE scope = ? AND last_seen < ?",
+                                        (scope, now)).rowcount
+            self.conn.execute("INSERT OR REPLACE INTO scans (scope, scanned_at) VALUES (?, ?)", (scope, now))
+        return removed
+
+    def refresh(self, scope, scan, force=False):
+        """Run the scan for a scope if it has expired (or force is set). Returns True if it ran."""
+        if not force and self.is_fresh(scope):
+            return False
+        started = time.perf_counter()
+        records = scan()
+        removed = self.store_scan(scope, records)
+        print(f"Inventory '{scope}' refreshed: {len(records)} resources, {removed} gone, "
+              f"in {time.perf_counter() - started:.2f}s.")
+        return True
+
+    def record_resource(self, scope, record):
+        """Add a resource this process just created, so the cache doesn't wait for the next scan."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                '''INSERT OR REPLACE INTO resources (scope, arn, resource_type, identifier, tags, last_seen)
+                   VALUES (?, ?, ?, ?, ?, ?)''',
+                (scope, record['ResourceARN'], record['ResourceType'], record['Identifier'],
+                 json.dumps(record['Tags'], sort_keys=True), time.time())
+            )
+
+    def resources(self, scope):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT arn, resource_type, identifier, tags FROM resources WHERE scope = ? ORDER BY arn", (scope,)
+            ).fetchall()
+        return [{'ResourceARN': arn, 'ResourceType': resource_type, 'Identifier': identifier, 'Tags': json.loads(tags)}
+                for arn, resource_type, identifier, tags in rows]
+
+    #******************************************************************
+    # Lookups
+    #******************************************************************
+    def tagged_resources(self, tag_key, tag_value, force_refresh=False):
+        """Return every resource carrying the tag, from the cache while it is fresh."""
+        scope = tag_scope(tag_key, tag_value)
+        self.refresh(scope, lambda: discover_project_resources(tag_key, tag_value), force_refresh)
+        return self.resources(scope)
+
+    def find_bucket(self, prefix, force_refresh=False):
+        """Return the first bucket whose name starts with prefix, or None."""
+        refreshed = self.refresh(BUCKETS_SCOPE, scan_all_buckets, force_refresh)
+        bucket_name = self.first_bucket(prefix)
+        # A miss usually leads to creating a bucket, so confirm it against AWS before trusting the cache
+        if bucket_name is None and not refreshed:
+            self.refresh(BUCKETS_SCOPE, scan_all_buckets, force=True)
+            bucket_name = self.first_bucket(prefix)
+        return bucket_name
+
+    def first_bucket(self, prefix):
+        with self.lock:
+            # Range scan on the index instead of LIKE, which would treat '_' in the prefix as a wildcard
+            row = self.conn.execute(
+                '''SELECT identifier FROM resources WHERE scope = ? AND identifier >= ? AND identifier < ?
+                   ORDER BY identifier LIMIT 1''',
+                (BUCKETS_SCOPE, prefix, prefix + '\U0010ffff')
+            ).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self.conn.close()
+
+
+#**********************************************************************
+# Command line
+#**********************************************************************
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show the cached inventory of Photo Project resources')
+    parser.add_argument('--refresh', action='store_true', help='Rescan AWS even if the cache is still fresh')
+    parser.add_argument('--inventory', default=DEFAULT_INVENTORY_PATH, help='Inventory database path')
+    parser.add_argument('--ttl', type=int, default=DEFAULT_TTL, help='Seconds before a scope is rescanned')
+    parser.add_argument('--tag-key', default='Project')
+    parser.add_argument('--tag-value', default='PhotoProject')
+    args = parser.parse_args()
+
+    inventory = ResourceInventory(args.inventory, args.ttl)
+    started = time.perf_counter()
+    for record in inventory.tagged_resources(args.tag_key, args.tag_value, force_refresh=args.refresh):
+        print(f"{record['ResourceType']}\t{record['Identifier']}\t{record['ResourceARN']}")
+    print(f"Lookup took {(time.perf_counter() - started) * 1000:.1f} ms.")
+    inventory.close()
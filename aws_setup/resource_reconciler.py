@@ -0,0 +1,439 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from aws_setup.resource_discovery import (discover_project_resources, default_tag_key, default_tag_value,
+                                          default_workers)
+from aws_setup.check_and_initialize_roles import ec2_service_role_policy, ec2_service_role_policy_name
+from aws_setup.resource_registry import TABLE_NAME, read_registry, register_resources, deregister_resources
+from Utilities.aws_clients import get_client
+
+DEFAULT_BUCKET_PREFIX = "warinpocketbucket-"
+
+EC2_TRUST_POLICY = {
+    "Version": "2012-10-17",
+    "Statement": [
+        {
+            "Effect": "Allow",
+            "Principal": {"Service": "ec2.amazonaws.com"},
+            "Action": "sts:AssumeRole"
+        }
+    ]
+}
+DEFAULT_ROLES = {'PhotoProjectRole': EC2_TRUST_POLICY}
+# Roles that carry the inline S3/SQS policy of check_and_initialize_roles, built from the bucket name and queue ARN
+DEFAULT_ROLE_POLICIES = {'PhotoProjectRole': ec2_service_role_policy}
+
+
+# **************************************************
+# * How reconciling works *
+# **************************************************
+# The desired state is declared once: the tag every project resource carries, the registry table,
+# one S3 bucket (by name prefix), the IAM roles with the inline policies granting them the bucket
+# (and the SQS queue when its ARN is given), and the local SQLite DB whose Resources table
+# points at the bucket (only when a DB path is given). read_actual_state() reads all of it in one concurrent pass. plan_reconcile()
+# diffs the two into steps, each naming the steps it must wait for, and apply_plan() runs the steps
+# whose dependencies are done side by side, wave after wave. Only bookkeeping is ever deleted:
+# registry items and Resources rows pointing at resources that no longer exist. Tagged resources
+# outside the desired state are reported as unmanaged, never removed.
+
+def desired_state(bucket_prefix=DEFAULT_BUCKET_PREFIX, table_name=TABLE_NAME, roles=None, db_path=None,
+                  tag_key=default_tag_key, tag_value=default_tag_value, role_policies=None, queue_arn=None):
+    return {
+        'tag': (tag_key, tag_value),
+        'table': table_name,
+        'bucket_prefix': bucket_prefix,
+        'roles': DEFAULT_ROLES if roles is None else roles,
+        'role_policies': DEFAULT_ROLE_POLICIES if role_policies is None else role_policies,
+        'queue_arn': queue_arn,
+        'db_path': db_path
+    }
+
+
+def reconciler_client(service, max_workers=default_workers):
+    return get_client(service, min_pool_connections=max_workers)
+
+
+# **************************************************
+# * Function: read_actual_state *
+# **************************************************
+
+def read_registry_state(table_name, max_workers):
+    """Return the registered (type, identifier) pairs, or None if the registry table doesn't exist."""
+    try:
+        grouped = read_registry(table_name, dynamodb_client=reconciler_client('dynamodb', max_workers))
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceNotFoundException':
+            return None
+        raise
+    return {(resource_type, identifier) for resource_type, identifiers in grouped.items()
+            for identifier in identifiers}
+
+
+def read_role_state(role_names, max_workers):
+    """Return {role name: tags} for the declared roles that exist."""
+    iam_client = reconciler_client('iam', max_workers)
+
+    def fetch(role_name):
+        try:
+            role = iam_client.get_role(RoleName=role_name)['Role']
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchEntity':
+                return None
+            raise
+        return role_name, {tag['Key']: tag['Value'] for tag in role.get('Tags', [])}
+
+    with ThreadPoolExecutor(max_workers=max(len(role_names), 1)) as executor:
+        return dict(role for role in executor.map(fetch, role_names) if role)
+
+
+def read_role_policy_state(role_names, max_workers):
+    """Return {role name: inline policy document or None} for the roles that carry a policy."""
+    iam_client = reconciler_client('iam', max_workers)
+
+    def fetch(role_name):
+        try:
+            response = iam_client.get_role_policy(RoleName=role_name,
+                                                  PolicyName=ec2_service_role_policy_name(role_name))
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchEntity':
+                return role_name, None
+            raise
+        return role_name, response['PolicyDocument']
+
+    with ThreadPoolExecutor(max_workers=max(len(role_names), 1)) as executor:
+        return dict(executor.map(fetch, role_names))
+
+
+def read_bucket_state(bucket_prefix, max_workers):
+    """Return the names of every bucket with the prefix, tagged or not, following all pages."""
+    s3_client = reconciler_client('s3', max_workers)
+    bucket_names = []
+    for page in s3_client.get_paginator('list_buckets').paginate():
+        bucket_names.extend(bucket['Name'] for bucket in page.get('Buckets', [])
+                            if bucket['Name'].startswith(bucket_prefix))
+    return sorted(bucket_names)
+
+
+def read_db_state(db_path):
+    """Return the S3 identifiers in the local Resources table, [] if the table is missing, None without a DB."""
+    if not db_path or not os.path.exists(db_path):
+        return None
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[0] for row in conn.execute("SELECT Identifier FROM Resources WHERE ResourceType = 'S3'")]
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+
+
+def read_actual_state(desired, max_workers=default_workers, use_tagging_api=True):
+    """Read tags, the registry, the buckets, the declared roles and policies and the local DB concurrently."""
+    tag_key, tag_value = desired['tag']
+    scan_errors = []
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        tagged = executor.submit(discover_project_resources, tag_key, tag_value, max_workers, use_tagging_api,
+                                 scan_errors)
+        buckets = executor.submit(read_bucket_state, desired['bucket_prefix'], max_workers)
+        registry = executor.submit(read_registry_state, desired['table'], max_workers)
+        roles = executor.submit(read_role_state, list(desired['roles']), max_workers)
+        role_policies = executor.submit(read_role_policy_state, list(desired['role_policies']), max_workers)
+        db_buckets = executor.submit(read_db_state, desired['db_path'])
+        return {
+            'tagged': tagged.result(),
+            'scan_errors': scan_errors,
+            'buckets': buckets.result(),
+            'registry': registry.result(),
+            'roles': roles.result(),
+            'role_policies': role_policies.result(),
+            'db_buckets': db_buckets.result()
+        }
+
+
+# **************************************************
+# * Steps that change AWS and the local DB *
+# **************************************************
+
+def create_registry_table(table_name, tags, max_workers):
+    dynamodb_client = reconciler_client('dynamodb', max_workers)
+    dynamodb_client.create_table(
+        TableName=table_name,
+        KeySchema=[{'AttributeName': 'ResourceName', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'ResourceName', 'AttributeType': 'S'}],
+        ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5},
+        Tags=[{'Key': key, 'Value': value} for key, value in tags.items()]
+    )
+    dynamodb_client.get_waiter('table_exists').wait(TableName=table_name)
+
+
+def tag_registry_table(table_name, tags, max_workers):
+    dynamodb_client = reconciler_client('dynamodb', max_workers)
+    table_arn = dynamodb_client.describe_table(TableName=table_name)['Table']['TableArn']
+    dynamodb_client.tag_resource(ResourceArn=table_arn, Tags=[{'Key': key, 'Value': value}
+                                                              for key, value in tags.items()])
+
+
+def create_bucket(bucket_name, tags, max_workers):
+    s3_client = reconciler_client('s3', max_workers)
+    s3_client.create_bucket(Bucket=bucket_name)
+    s3_client.put_bucket_tagging(Bucket=bucket_name, Tagging={'TagSet': [{'Key': key, 'Value': value}
+                                                                         for key, value in tags.items()]})
+
+
+def tag_bucket(bucket_name, tags, max_workers):
+    s3_client = reconciler_client('s3', max_workers)
+    # put_bucket_tagging replaces the whole tag set, so keep the tags the bucket already has
+    try:
+        tag_set = s3_client.get_bucket_tagging(Bucket=bucket_name)['TagSet']
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchTagSet', 'NoSuchTagSetError'):
+            raise
+        tag_set = []
+    merged = {tag['Key']: tag['Value'] for tag in tag_set}
+    merged.update(tags)
+    s3_client.put_bucket_tagging(Bucket=bucket_name, Tagging={'TagSet': [{'Key': key, 'Value': value}
+                                                                         for key, value in merged.items()]})
+
+
+def create_role(role_name, trust_policy, tags, max_workers):
+    reconciler_client('iam', max_workers).create_role(
+        RoleName=role_name,
+        AssumeRolePolicyDocument=json.dumps(trust_policy),
+        Tags=[{'Key': key, 'Value': value} for key, value in tags.items()]
+    )
+
+
+def put_role_policy(role_name, policy_document, max_workers):
+    reconciler_client('iam', max_workers).put_role_policy(RoleName=role_name,
+                                                          PolicyName=ec2_service_role_policy_name(role_name),
+                                                          PolicyDocument=json.dumps(policy_document))
+
+
+def tag_role(role_name, tags, max_workers):
+    reconciler_client('iam', max_workers).tag_role(RoleName=role_name, Tags=[{'Key': key, 'Value': value}
+                                                                             for key, value in tags.items()])
+
+
+def update_db_resources(db_path, insert, delete):
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS Resources (ResourceType TEXT NOT NULL, Identifier TEXT NOT NULL)")
+            conn.executemany("DELETE FROM Resources WHERE ResourceType = 'S3' AND Identifier = ?",
+                             [(identifier,) for identifier in delete])
+            conn.executemany("INSERT INTO Resources (ResourceType, Identifier) VALUES ('S3', ?)",
+                             [(identifier,) for identifier in insert])
+    finally:
+        conn.close()
+
+
+def registry_step(action, resources, table_name, max_workers):
+    if action == 'register':
+        written, skipped, failed = register_resources(resources, table_name, conditional=True,
+                                                      max_workers=max_workers,
+                                                      dynamodb_client=reconciler_client('dynamodb', max_workers))
+    else:
+        deleted, failed = deregister_resources(resources, table_name, max_workers,
+                                               dynamodb_client=reconciler_client('dynamodb', max_workers))
+    if failed:
+        raise Exception(f"{failed} registry items could not be written.")
+
+
+# **************************************************
+# * Function: plan_reconcile *
+# **************************************************
+
+def step(step_id, action, resource_type, identifier, run, requires=()):
+    return {'id': step_id, 'action': action, 'type': resource_type, 'identifier': identifier, 'run': run,
+            'requires': list(requires)}
+
+
+def plan_reconcile(desired, actual, max_workers=default_workers):
+    """Diff the desired state against the actual one. Returns (steps, unmanaged records)."""
+    tag_key, tag_value = desired['tag']
+    tags = {tag_key: tag_value}
+    table_name = desired['table']
+    steps = []
+
+    tagged_ids = {(record['ResourceType'], record['Identifier']) for record in actual['tagged']}
+    managed = set()
+
+    # Registry table
+    table_step = None
+    if actual['registry'] is None:
+        table_step = f"create:dynamodb:{table_name}"
+        steps.append(step(table_step, 'create', 'dynamodb', table_name,
+                          lambda: create_registry_table(table_name, tags, max_workers)))
+    elif ('dynamodb', table_name) not in tagged_ids:
+        steps.append(step(f"tag:dynamodb:{table_name}", 'tag', 'dynamodb', table_name,
+                          lambda: tag_registry_table(table_name, tags, max_workers)))
+    managed.add(('dynamodb', table_name))
+
+    # One bucket with the declared prefix; a tagged one if there is one, otherwise an existing bucket
+    # the tag is missing on (or the Tagging API doesn't list yet) is tagged rather than duplicated
+    buckets = sorted(record['Identifier'] for record in actual['tagged'] if record['ResourceType'] == 's3'
+                     and record['Identifier'].startswith(desired['bucket_prefix']))
+    bucket_step = None
+    if buckets:
+        bucket_name = buckets[0]
+    elif actual['buckets']:
+        bucket_name = actual['buckets'][0]
+        steps.append(step(f"tag:s3:{bucket_name}", 'tag', 's3', bucket_name,
+                          lambda: tag_bucket(bucket_name, tags, max_workers)))
+    else:
+        bucket_name = f"{desired['bucket_prefix']}{uuid.uuid4()}"
+        bucket_step = f"create:s3:{bucket_name}"
+        steps.append(step(bucket_step, 'create', 's3', bucket_name,
+                          lambda: create_bucket(bucket_name, tags, max_workers)))
+    managed.add(('s3', bucket_name))
+
+    # Roles
+    role_steps = {}
+    for role_name, trust_policy in desired['roles'].items():
+        if role_name not in actual['roles']:
+            role_steps[role_name] = f"create:iam:{role_name}"
+            steps.append(step(role_steps[role_name], 'create', 'iam', role_name,
+                              lambda role_name=role_name, trust_policy=trust_policy:
+                              create_role(role_name, trust_policy, tags, max_workers)))
+        elif actual['roles'][role_name].get(tag_key) != tag_value:
+            steps.append(step(f"tag:iam:{role_name}", 'tag', 'iam', role_name,
+                              lambda role_name=role_name: tag_role(role_name, tags, max_workers)))
+        managed.add(('iam', role_name))
+
+    # Inline policies granting the roles the bucket, rewritten whenever they differ
+    for role_name, build_policy in desired['role_policies'].items():
+        policy_document = build_policy(bucket_name, desired['queue_arn'])
+        if actual['role_policies'].get(role_name) != policy_document:
+            steps.append(step(f"policy:iam:{role_name}", 'update', 'iam', f"{role_name} inline policy",
+                              lambda role_name=role_name, policy_document=policy_document:
+                              put_role_policy(role_name, policy_document, max_workers),
+                              [role_steps[role_name]] if role_name in role_steps else []))
+
+    unmanaged = [record for record in actual['tagged']
+                 if (record['ResourceType'], record['Identifier']) not in managed]
+
+    # The registry lists every tagged resource, so it waits for whatever is being created
+    registered = actual['registry'] or set()
+    wanted = managed | tagged_ids
+    missing = sorted(wanted - registered)
+    # After a failed scan the tagged resources are incomplete, so nothing registered can be called stale
+    stale = [] if actual['scan_errors'] else sorted(registered - wanted)
+    if missing:
+        steps.append(step("register", 'register', 'registry', f"{len(missing)} items",
+                          lambda: registry_step('register', missing, table_name, max_workers),
+                          [step_id for step_id in [table_step, bucket_step, *role_steps.values()] if step_id]))
+    if stale:
+        steps.append(step("deregister", 'delete', 'registry', f"{len(stale)} items",
+                          lambda: registry_step('deregister', stale, table_name, max_workers)))
+
+    # The local DB points at the bucket
+    db_buckets = actual['db_buckets']
+    if db_buckets is not None and db_buckets != [bucket_name]:
+        insert = [] if bucket_name in db_buckets else [bucket_name]
+        delete = [identifier for identifier in db_buckets if identifier != bucket_name]
+        db_path = desired['db_path']
+        steps.append(step("sqlite:Resources", 'update', 'sqlite', os.path.basename(db_path),
+                          lambda: update_db_resources(db_path, insert, delete),
+                          [bucket_step] if bucket_step else []))
+
+    return steps, unmanaged
+
+
+# **************************************************
+# * Function: apply_plan *
+# **************************************************
+
+def print_plan(steps, unmanaged):
+    symbols = {'create': '+', 'delete': '-', 'tag': '~', 'register': '+', 'update': '~'}
+    for planned in steps:
+        after = f" (after {', '.join(planned['requires'])})" if planned['requires'] else ""
+        print(f"  {symbols[planned['action']]} {planned['action']} {planned['type']} {planned['identifier']}{after}")
+    for record in unmanaged:
+        print(f"  ? unmanaged {record['ResourceType']} {record['Identifier']}")
+
+
+def apply_plan(steps, max_workers=default_workers):
+    """Run the steps in dependency order, independent ones in parallel. Returns the ids of failed steps."""
+    done, failed = set(), set()
+    remaining = list(steps)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while remaining:
+            skipped = [planned for planned in remaining if failed.intersection(planned['requires'])]
+            ready = [planned for planned in remaining if set(planned['requires']) <= done]
+            for planned in skipped:
+                print(f"Skipping {planned['id']}: a step it depends on failed.")
+                failed.add(planned['id'])
+            if not ready:
+                remaining = [planned for planned in remaining if planned not in skipped]
+                if remaining and not skipped:
+                    raise Exception(f"Steps with unmet dependencies: {[planned['id'] for planned in remaining]}")
+                continue
+
+            futures = {planned['id']: executor.submit(planned['run']) for planned in ready}
+            for step_id, future in futures.items():
+                try:
+                    future.result()
+                    done.add(step_id)
+                    print(f"Done: {step_id}")
+                except Exception as e:
+                    failed.add(step_id)
+                    print(f"Failed: {step_id}: {e}")
+            remaining = [planned for planned in remaining if planned['id'] not in done | failed]
+    return failed
+
+
+# **************************************************
+# * Function: reconcile *
+# **************************************************
+
+def reconcile(desired=None, dry_run=False, max_workers=default_workers, use_tagging_api=True):
+    """Bring the project resources to the desired state. Returns the plan's steps and the failed step ids."""
+    desired = desired or desired_state()
+    started = time.perf_counter()
+    actual = read_actual_state(desired, max_workers, use_tagging_api)
+    steps, unmanaged = plan_reconcile(desired, actual, max_workers)
+    print(f"Read the actual state in {time.perf_counter() - started:.2f}s.")
+    if actual['scan_errors']:
+        print(f"{len(actual['scan_errors'])} discovery scans failed; not removing registry items this run.")
+
+    if not steps:
+        print("Everything is in the desired state.")
+        print_plan(steps, unmanaged)
+        return steps, set()
+
+    print(f"Plan ({len(steps)} steps):")
+    print_plan(steps, unmanaged)
+    if dry_run:
+        return steps, set()
+    failed = apply_plan(steps, max_workers)
+    print(f"Reconciled in {time.perf_counter() - started:.2f}s ({len(failed)} steps failed).")
+    return steps, failed
+
+
+# **************************************************
+# * Main Execution *
+# **************************************************
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bring the Photo Project's AWS resources to their desired state.")
+    parser.add_argument('--dry-run', action='store_true', help='Only print the plan')
+    parser.add_argument('--db', help='Local SQLite DB whose Resources table is kept in sync')
+    parser.add_argument('--bucket-prefix', default=DEFAULT_BUCKET_PREFIX, help='Name prefix of the project bucket')
+    parser.add_argument('--table', default=TABLE_NAME, help='DynamoDB registry table')
+    parser.add_argument('--queue-arn', help='SQS queue the EC2 service role may receive from and delete in')
+    parser.add_argument('--workers', type=int, default=default_workers, help='Concurrent AWS calls')
+    parser.add_argument('--no-tagging-api', action='store_true', help='Scan each service instead of the Tagging API')
+    args = parser.parse_args()
+
+    _, failed_steps = reconcile(desired_state(args.bucket_prefix, args.table, db_path=args.db,
+                                              queue_arn=args.queue_arn), args.dry_run,
+                                args.workers, use_tagging_api=not args.no_tagging_api)
+    if failed_steps:
+        raise SystemExit(1)
@@ -0,0 +1,242 @@
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from botocore.exceptions import ClientError
+
+from Utilities.aws_clients import get_client
+
+TABLE_NAME = "PhotoProjectResources"
+batch_size = 25  # BatchWriteItem limit
+default_workers = 4
+max_attempts = 8
+base_backoff = 0.05
+max_backoff = 5.0
+default_segments = 4
+
+
+# **************************************************
+# * Registry item layout *
+# **************************************************
+# The table's hash key is ResourceName, built as "<ResourceType>#<Identifier>" so the same name
+# can be registered for different resource types. ResourceType and Identifier are also stored as
+# attributes for readers, with the CreationDate of the registration.
+
+def registry_key(resource_type, identifier):
+    return f"{resource_type}#{identifier}"
+
+
+def registry_item(resource_type, identifier, creation_date=None):
+    return {
+        'ResourceName': {'S': registry_key(resource_type, identifier)},
+        'ResourceType': {'S': resource_type},
+        'Identifier': {'S': identifier},
+        'CreationDate': {'S': creation_date or datetime.now().isoformat()}
+    }
+
+
+def registry_client(max_workers=default_workers):
+    return get_client('dynamodb', min_pool_connections=max_workers)
+
+
+def backoff_delay(attempt):
+    # Full jitter keeps parallel writers from retrying in lockstep
+    return random.uniform(0, min(max_backoff, base_backoff * 2 ** attempt))
+
+
+# **************************************************
+# * Function: write_batch *
+# **************************************************
+
+def write_batch(dynamodb_client, table_name, items, request_type='PutRequest'):
+    """Write up to 25 items (or delete up to 25 keys with request_type='DeleteRequest'), retrying whatever
+    DynamoDB leaves unprocessed. Returns the items never written."""
+    field = 'Item' if request_type == 'PutRequest' else 'Key'
+    requests = [{request_type: {field: item}} for item in items]
+    for attempt in range(max_attempts):
+        try:
+            response = dynamodb_client.batch_write_item(RequestItems={table_name: requests})
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('ProvisionedThroughputExceededException', 'ThrottlingException',
+                                                   'RequestLimitExceeded'):
+                raise
+        else:
+            requests = response.get('UnprocessedItems', {}).get(table_name, [])
+            if not requests:
+                return []
+        time.sleep(backoff_delay(attempt))
+    return [request[request_type][field] for request in requests]
+
+
+# **************************************************
+# * Function: put_if_absent *
+# **************************************************
+
+def put_if_absent(dynamodb_client, table_name, item):
+    """Write an item only if its key isn't registered yet. Returns True if it was written."""
+    for attempt in range(max_attempts):
+        try:
+            dynamodb_client.put_item(TableName=table_name, Item=item,
+                                     ConditionExpression='attribute_not_exists(ResourceName)')
+            return True
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code == 'ConditionalCheckFailedException':
+                return False
+            if code not in ('ProvisionedThroughputExceededException', 'ThrottlingException'):
+                raise
+            time.sleep(backoff_delay(attempt))
+    raise Exception(f"Gave up registering '{item['ResourceName']['S']}' after {max_attempts} attempts.")
+
+
+# **************************************************
+# * Function: register_resources *
+# **************************************************
+
+def register_resources(resources, table_name=TABLE_NAME, conditional=False, max_workers=default_workers,
+                       dynamodb_client=None):
+    """Register (resource_type, identifier) pairs in the registry table.
+
+    By default items go through BatchWriteItem, 25 per request with several requests in flight, and
+    existing registrations are overwritten. BatchWriteItem can't carry conditions, so conditional=True
+    writes each item with an attribute_not_exists condition instead: existing registrations keep their
+    CreationDate and rerunning is idempotent. Returns (written, skipped, failed) counts.
+    """
+    if dynamodb_client is None:
+        dynamodb_client = registry_client(max_workers)
+
+    # A batch may not contain the same key twice
+    items = list({registry_key(*resource): registry_item(*resource) for resource in resources}.values())
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if conditional:
+            results = list(executor.map(lambda item: put_if_absent(dynamodb_client, table_name, item), items))
+            written, skipped, failed = results.count(True), results.count(False), 0
+        else:
+            batches = [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+            leftovers = executor.map(lambda batch: write_batch(dynamodb_client, table_name, batch), batches)
+            unwritten = [item for leftover in leftovers for item in leftover]
+            for item in unwritten:
+                print(f"Failed to register '{item['ResourceName']['S']}' after {max_attempts} attempts.")
+            written, skipped, failed = len(items) - len(unwritten), 0, len(unwritten)
+
+    print(f"Registered {written} resources in '{table_name}' ({skipped} already registered, {failed} failed) "
+          f"in {time.perf_counter() - started:.2f}s.")
+    return written, skipped, failed
+
+
+# **************************************************
+# * Function: deregister_resources *
+# **************************************************
+
+def deregister_resources(resources, table_name=TABLE_NAME, max_workers=default_workers, dynamodb_client=None):
+    """Remove (resource_type, identifier) pairs from the registry table in batches. Returns (deleted, failed)."""
+    if dynamodb_client is None:
+        dynamodb_client = registry_client(max_workers)
+
+    keys = [{'ResourceName': {'S': name}} for name in {registry_key(*resource) for resource in resources}]
+    batches = [keys[start:start + batch_size] for start in range(0, len(keys), batch_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        leftovers = executor.map(lambda batch: write_batch(dynamodb_client, table_name, batch, 'DeleteRequest'),
+                                 batches)
+        unwritten = [key for leftover in leftovers for key in leftover]
+    for key in unwritten:
+        print(f"Failed to deregister '{key['ResourceName']['S']}' after {max_attempts} attempts.")
+    return len(keys) - len(unwritten), len(unwritten)
+
+
+# **************************************************
+# * Function: scan_segment *
+# **************************************************
+
+def scan_segment(dynamodb_client, table_name, segment, total_segments, pages, stop, page_size=None):
+    """Scan one segment page by page, putting each page's grouped identifiers on the pages queue."""
+    parameters = {
+        'TableName': table_name,
+        'Segment': segment,
+        'TotalSegments': total_segments,
+        # Only the two attributes the readers need, not whole items
+        'ProjectionExpression': '#type, #identifier',
+        'ExpressionAttributeNames': {'#type': 'ResourceType', '#identifier': 'Identifier'}
+    }
+    if page_size:
+        parameters['Limit'] = page_size
+
+    def put(value):
+        # Give up if the reader stopped consuming, instead of blocking on a full queue forever
+        while not stop.is_set():
+            try:
+                pages.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for page in dynamodb_client.get_paginator('scan').paginate(**parameters):
+            grouped = {}
+            for item in page.get('Items', []):
+                resource_type = item.get('ResourceType', {}).get('S')
+                identifier = item.get('Identifier', {}).get('S')
+                if resource_type and identifier:
+                    grouped.setdefault(resource_type, []).append(identifier)
+            if grouped and not put(grouped):
+                return
+    except Exception as e:
+        put(e)
+    finally:
+        put(None)
+
+
+# **************************************************
+# * Function: iter_registry *
+# **************************************************
+
+def iter_registry(table_name=TABLE_NAME, total_segments=default_segments, page_size=None, dynamodb_client=None):
+    """Yield {ResourceType: [Identifier, ...]} page by page from a parallel segmented scan.
+
+    Every segment follows LastEvaluatedKey to the end. At most two pages per segment wait in memory,
+    so a large registry streams through in bounded memory; merge the pages with read_registry().
+    """
+    if dynamodb_client is None:
+        dynamodb_client = registry_client(total_segments)
+
+    pages = queue.Queue(maxsize=total_segments * 2)
+    stop = threading.Event()
+    workers = [threading.Thread(target=scan_segment, daemon=True,
+                                args=(dynamodb_client, table_name, segment, total_segments, pages, stop, page_size))
+               for segment in range(total_segments)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        running = total_segments
+        while running:
+            page = pages.get()
+            if page is None:
+                running -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield page
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+
+# **************************************************
+# * Function: read_registry *
+# **************************************************
+
+def read_registry(table_name=TABLE_NAME, total_segments=default_segments, page_size=None, dynamodb_client=None):
+    """Return the whole registry grouped as {ResourceType: [Identifier, ...]}."""
+    grouped = {}
+    for page in iter_registry(table_name, total_segments, page_size, dynamodb_client):
+        for resource_type, identifiers in page.items():
+            grouped.setdefault(resource_type, []).extend(identifiers)
+    return grouped
@@ -0,0 +1,86 @@
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from aws_setup import resource_registry
+from aws_setup.resource_registry import (register_resources, deregister_resources, read_registry, write_batch,
+                                         registry_item)
+from Utilities.aws_clients import get_client, reset_clients
+
+TABLE = 'RegistryTest'
+
+
+@pytest.fixture
+def dynamodb_client(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        reset_clients()
+        dynamodb_client = get_client('dynamodb')
+        dynamodb_client.create_table(
+            TableName=TABLE,
+            KeySchema=[{'AttributeName': 'ResourceName', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'ResourceName', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        yield dynamodb_client
+        reset_clients()
+
+
+def test_batch_register_and_segmented_read(dynamodb_client):
+    buckets = [('s3', f"bucket-{number}") for number in range(60)]
+    roles = [('iam', f"role-{number}") for number in range(7)]
+    # A repeated resource would make BatchWriteItem reject the whole batch
+    written, skipped, failed = register_resources(buckets + roles + buckets[:3], TABLE,
+                                                  dynamodb_client=dynamodb_client)
+    assert (written, skipped, failed) == (67, 0, 0)
+
+    # Small pages over several segments still add up to the whole table
+    registry = read_registry(TABLE, total_segments=3, page_size=7, dynamodb_client=dynamodb_client)
+    assert sorted(registry['s3']) == sorted(identifier for _, identifier in buckets)
+    assert sorted(registry['iam']) == sorted(identifier for _, identifier in roles)
+
+    deleted, failed = deregister_resources(buckets[:30], TABLE, dynamodb_client=dynamodb_client)
+    assert (deleted, failed) == (30, 0)
+    assert len(read_registry(TABLE, dynamodb_client=dynamodb_client)['s3']) == 30
+
+
+def test_conditional_register_keeps_existing_items(dynamodb_client):
+    register_resources([('s3', 'bucket')], TABLE, conditional=True, dynamodb_client=dynamodb_client)
+    first = dynamodb_client.get_item(TableName=TABLE, Key={'ResourceName': {'S': 's3#bucket'}})['Item']
+    written, skipped, failed = register_resources([('s3', 'bucket'), ('iam', 'role')], TABLE, conditional=True,
+                                                  dynamodb_client=dynamodb_client)
+    assert (written, skipped, failed) == (1, 1, 0)
+    again = dynamodb_client.get_item(TableName=TABLE, Key={'ResourceName': {'S': 's3#bucket'}})['Item']
+    assert again['CreationDate'] == first['CreationDate']
+
+
+def test_read_of_missing_table_raises(dynamodb_client):
+    with pytest.raises(ClientError):
+        read_registry('MissingTable', total_segments=2, dynamodb_client=dynamodb_client)
+
+
+class ThrottledClient:
+    """Processes processed_per_call requests of each batch write and leaves the rest, as DynamoDB may under load."""
+
+    def __init__(self, processed_per_call=1):
+        self.processed_per_call = processed_per_call
+        self.calls = []
+
+    def batch_write_item(self, RequestItems):
+        requests = RequestItems[TABLE]
+        self.calls.append(len(requests))
+        return {'UnprocessedItems': {TABLE: requests[self.processed_per_call:]}}
+
+
+def test_write_batch_retries_unprocessed_items(monkeypatch):
+    monkeypatch.setattr(resource_registry, 'backoff_delay', lambda attempt: 0)
+    items = [registry_item('s3', f"bucket-{number}") for number in range(5)]
+
+    client = ThrottledClient()
+    assert write_batch(client, TABLE, items) == []
+    assert client.calls == [5, 4, 3, 2, 1]
+
+    # Items still unprocessed after the last attempt are handed back to the caller
+    client = ThrottledClient(processed_per_call=0)
+    assert write_batch(client, TABLE, items) == items
+    assert len(client.calls) == resource_registry.max_attempts
@@ -0,0 +1,158 @@
+import base64
+import io
+import os
+import struct
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+#**********************************************************************
+# Stream format
+#**********************************************************************
+# header: MAGIC (4) | version (1) | chunk size (4, big-endian) | salt (16)
+# body:   one AES-256-GCM record per chunk, each chunk_size bytes of plaintext plus a 16 byte tag.
+#         The last record is always shorter than chunk_size (possibly empty) and is the only one
+#         authenticated as final, so truncating, reordering or appending records fails to decrypt.
+# The per-file key is derived with HKDF and the random salt from the object's own data key, which is
+# stored wrapped by the master key in the object's metadata (see key_provider), and each record's
+# nonce is its sequence number.
+
+MAGIC = b'WIPS'
+VERSION = 1
+HEADER_FORMAT = '>4sBI16s'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+TAG_SIZE = 16
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class StreamDecryptionError(Exception):
+    """Raised when an encrypted stream is malformed, truncated or fails authentication."""
+
+
+#**********************************************************************
+# Derive the per-file AES key from the data key
+#**********************************************************************
+def derive_stream_key(key, salt):
+    """Derive a 256-bit AES-GCM key for one stream from a data key and a salt."""
+    master_key = base64.urlsafe_b64decode(key)
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=b'warinpocket-stream-v1').derive(master_key)
+
+
+def record_nonce(sequence):
+    return sequence.to_bytes(12, 'big')
+
+
+def record_aad(header, final):
+    return header + (b'\x01' if final else b'\x00')
+
+
+def read_exactly(source, size):
+    """Read up to size bytes, only returning fewer at the end of the stream."""
+    data = bytearray()
+    while len(data) < size:
+        chunk = source.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data)
+
+
+#**********************************************************************
+# Readable file object over a stream of byte chunks
+#**********************************************************************
+class ChunkStreamReader(io.RawIOBase):
+    """Exposes an iterator of byte chunks as a readable file object, holding one chunk at a time."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+        self.offset = 0
+        self.finished = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        # Fill the whole request so multipart uploads get full-sized parts
+        filled = 0
+        while filled < len(target):
+            if self.offset == len(self.buffer):
+                if self.finished:
+                    break
+                self.buffer, self.offset = next(self.chunks, None), 0
+                if self.buffer is None:
+                    self.buffer, self.finished = b'', True
+                continue
+            count = min(len(target) - filled, len(self.buffer) - self.offset)
+            target[filled:filled + count] = self.buffer[self.offset:self.offset + count]
+            self.offset += count
+            filled += count
+        return filled
+
+
+#**********************************************************************
+# Streaming encryptor
+#**********************************************************************
+def iter_encrypted_chunks(source, key, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the encrypted stream for a plaintext file object, reading one chunk at a time."""
+    salt = os.urandom(16)
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, chunk_size, salt)
+    aesgcm = AESGCM(derive_stream_key(key, salt))
+    yield header
+
+    sequence = 0
+    while True:
+        plaintext = read_exactly(source, chunk_size)
+        final = len(plaintext) < chunk_size
+        yield aesgcm.encrypt(record_nonce(sequence), plaintext, record_aad(header, final))
+        sequence += 1
+        if final:
+            return
+
+
+class EncryptingReader(ChunkStreamReader):
+    """Reads plaintext from a file object and returns the encrypted stream, one chunk in memory at a time."""
+
+    def __init__(self, source, key, chunk_size=DEFAULT_CHUNK_SIZE):
+        super().__init__(iter_encrypted_chunks(source, key, chunk_size))
+
+
+#**********************************************************************
+# Streaming decryptor
+#**********************************************************************
+def iter_decrypted_chunks(source, key):
+    """Yield authenticated plaintext chunks from an encrypted stream."""
+    header = read_exactly(source, HEADER_SIZE)
+    if len(header) != HEADER_SIZE:
+        raise StreamDecryptionError("Encrypted stream is too short to contain a header.")
+    magic, version, chunk_size, salt = struct.unpack(HEADER_FORMAT, header)
+    if magic != MAGIC or version != VERSION:
+        raise StreamDecryptionError("Not a supported encrypted stream.")
+
+    aesgcm = AESGCM(derive_stream_key(key, salt))
+    record_size = chunk_size + TAG_SIZE
+    sequence = 0
+    while True:
+        record = read_exactly(source, record_size)
+        # Only the final record is shorter than a full one
+        final = len(record) < record_size
+        try:
+            plaintext = aesgcm.decrypt(record_nonce(sequence), record, record_aad(header, final))
+        except InvalidTag:
+            raise StreamDecryptionError(f"Encrypted stream failed authentication at record {sequence}.")
+        sequence += 1
+        if plaintext:
+            yield plaintext
+        if final:
+            return
+
+
+def decrypt_stream(source, destination, key):
+    """Decrypt an encrypted stream from one file object into another. Returns the plaintext size."""
+    size = 0
+    for chunk in iter_decrypted_chunks(source, key):
+        destination.write(chunk)
+        size += len(chunk)
+    return size
@@ -0,0 +1,66 @@
+import io
+import os
+
+import pytest
+from cryptography.fernet import Fernet
+
+from aws_setup.stream_crypto import (EncryptingReader, StreamDecryptionError, decrypt_stream, iter_encrypted_chunks,
+                                     HEADER_SIZE, TAG_SIZE)
+
+CHUNK_SIZE = 1024
+
+
+def encrypt(plaintext, key):
+    return b''.join(iter_encrypted_chunks(io.BytesIO(plaintext), key, CHUNK_SIZE))
+
+
+def decrypt(ciphertext, key):
+    destination = io.BytesIO()
+    decrypt_stream(io.BytesIO(ciphertext), destination, key)
+    return destination.getvalue()
+
+
+@pytest.mark.parametrize('size', [0, 1, CHUNK_SIZE - 1, CHUNK_SIZE, 3 * CHUNK_SIZE, 3 * CHUNK_SIZE + 17])
+def test_round_trip(size):
+    key = Fernet.generate_key()
+    plaintext = os.urandom(size)
+    ciphertext = encrypt(plaintext, key)
+    assert decrypt(ciphertext, key) == plaintext
+    # The reader gives the same stream layout as the generator it wraps
+    streamed = EncryptingReader(io.BytesIO(plaintext), key, CHUNK_SIZE).read()
+    assert len(streamed) == len(ciphertext) and decrypt(streamed, key) == plaintext
+
+
+def test_flipped_byte_fails_authentication():
+    key = Fernet.generate_key()
+    ciphertext = bytearray(encrypt(os.urandom(2 * CHUNK_SIZE + 10), key))
+    ciphertext[HEADER_SIZE + CHUNK_SIZE + 5] ^= 1
+    with pytest.raises(StreamDecryptionError):
+        decrypt(bytes(ciphertext), key)
+
+
+def test_truncated_or_reordered_stream_fails():
+    key = Fernet.generate_key()
+    ciphertext = encrypt(os.urandom(2 * CHUNK_SIZE + 10), key)
+    record_size = CHUNK_SIZE + TAG_SIZE
+    header, first, second = (ciphertext[:HEADER_SIZE], ciphertext[HEADER_SIZE:HEADER_SIZE + record_size],
+                             ciphertext[HEADER_SIZE + record_size:HEADER_SIZE + 2 * record_size])
+    last = ciphertext[HEADER_SIZE + 2 * record_size:]
+
+    # Cutting the stream at a record boundary drops the record authenticated as final
+    with pytest.raises(StreamDecryptionError):
+        decrypt(header + first + second, key)
+    with pytest.raises(StreamDecryptionError):
+        decrypt(header + second + first + last, key)
+    with pytest.raises(StreamDecryptionError):
+        decrypt(ciphertext + first, key)
+
+
+def test_wrong_key_or_header_fails():
+    ciphertext = encrypt(b'photo project', Fernet.generate_key())
+    with pytest.raises(StreamDecryptionError):
+        decrypt(ciphertext, Fernet.generate_key())
+    with pytest.raises(StreamDecryptionError):
+        decrypt(b'XXXX' + ciphertext[4:], Fernet.generate_key())
+    with pytest.raises(StreamDecryptionError):
+        decrypt(ciphertext[:HEADER_SIZE - 1], Fernet.generate_key())
@@ -0,0 +1,117 @@
+import os
+import random
+import sqlite3
+
+from aws_setup.resource_registry import register_resources
+from s3_tasks.id_allocator import alphanum
+from Utilities.aws_clients import get_client
+
+#**********************************************************************
+# Synthetic data
+#**********************************************************************
+# Every generator takes a seed so two runs at the same scale build the same data, and writes
+# straight to the (mocked) AWS clients or a scratch directory it is given.
+
+PROJECT_TAG = {'Key': 'Project', 'Value': 'PhotoProject'}
+OTHER_TAG = {'Key': 'Project', 'Value': 'SomethingElse'}
+
+
+def is_tagged(index, tagged_fraction):
+    # Spread the tagged resources evenly instead of putting them all first
+    return tagged_fraction > 0 and int(index * tagged_fraction) != int((index + 1) * tagged_fraction)
+
+
+def make_buckets(count, tagged_fraction=0.1, prefix='bench-bucket'):
+    """Create count buckets, tagging about tagged_fraction of them for the project. Returns their names."""
+    s3_client = get_client('s3')
+    names = []
+    for index in range(count):
+        name = f"{prefix}-{index:05d}"
+        s3_client.create_bucket(Bucket=name)
+        tag = PROJECT_TAG if is_tagged(index, tagged_fraction) else OTHER_TAG
+        s3_client.put_bucket_tagging(Bucket=name, Tagging={'TagSet': [tag]})
+        names.append(name)
+    return names
+
+
+def make_tables(count, tagged_fraction=0.1, prefix='bench-table'):
+    dynamodb_client = get_client('dynamodb')
+    for index in range(count):
+        tag = PROJECT_TAG if is_tagged(index, tagged_fraction) else OTHER_TAG
+        dynamodb_client.create_table(
+            TableName=f"{prefix}-{index:05d}",
+            KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST',
+            Tags=[tag]
+        )
+
+
+def make_roles(count, tagged_fraction=0.1, prefix='bench-role'):
+    iam_client = get_client('iam')
+    for index in range(count):
+        tag = PROJECT_TAG if is_tagged(index, tagged_fraction) else OTHER_TAG
+        iam_client.create_role(RoleName=f"{prefix}-{index:05d}", AssumeRolePolicyDocument='{}', Tags=[tag])
+
+
+def make_objects(bucket_name, count, size=1024, seed=0):
+    """Put count objects of size random bytes into a bucket."""
+    s3_client = get_client('s3')
+    generator = random.Random(seed)
+    for index in range(count):
+        s3_client.put_object(Bucket=bucket_name, Key=f"objects/{index:07d}.bin", Body=generator.randbytes(size))
+
+
+def make_registry_rows(count, table_name='PhotoProjectResources', types=('s3', 'dynamodb', 'iam')):
+    """Create the registry table and register count resources spread over the given types."""
+    dynamodb_client = get_client('dynamodb')
+    dynamodb_client.create_table(
+        TableName=table_name,
+        KeySchema=[{'AttributeName': 'ResourceName', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'ResourceName', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    resources = [(types[index % len(types)], f"resource-{index:07d}") for index in range(count)]
+    return register_resources(resources, table_name=table_name, dynamodb_client=dynamodb_client)
+
+
+def make_files(directory, count, size=4096, duplicate_fraction=0.0, seed=0):
+    """Write count files of size bytes into directory, about duplicate_fraction of them repeating content."""
+    os.makedirs(directory, exist_ok=True)
+    generator = random.Random(seed)
+    paths = []
+    previous = None
+    for index in range(count):
+        if previous is not None and generator.random() < duplicate_fraction:
+            content = previous
+        else:
+            content = generator.randbytes(size)
+        path = os.path.join(directory, f"photo-{index:06d}.jpg")
+        with open(path, 'wb') as file:
+            file.write(content)
+        paths.append(path)
+        previous = content
+    return paths
+
+
+def make_mapping(count, keys_per_file=1, id_width=6, seed=0):
+    """Return a mapping in the legacy filename_mapping.json layout with count files."""
+    generator = random.Random(seed)
+    mapping = {'bucket_name': 'bench-bucket', 'used_ids': set()}
+    for index in range(count):
+        random_id = ''.join(generator.choice(alphanum) for _ in range(id_width))
+        mapping['used_ids'].add(random_id)
+        mapping[f"photo-{index:07d}.jpg"] = [f"{random_id}-{suffix}.jpg" for suffix in range(keys_per_file)]
+    return mapping
+
+
+def make_sqlite_db(path, rows, row_size=200, seed=0):
+    """Create a SQLite database of roughly rows x row_size bytes, half of it compressible text."""
+    generator = random.Random(seed)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS Photos (id INTEGER PRIMARY KEY, name TEXT, data BLOB)")
+        conn.executemany("INSERT INTO Photos (name, data) VALUES (?, ?)",
+                         [(f"photo-{index:07d}.jpg " * (row_size // 40), generator.randbytes(row_size // 2))
+                          for index in range(rows)])
+    return conn
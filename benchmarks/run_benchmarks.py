@@ -0,0 +1,241 @@
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from moto import mock_aws
+
+from aws_setup.db_snapshot import temporary_snapshot, CompressingReader
+from aws_setup.resource_discovery import discover_project_resources
+from aws_setup.resource_registry import read_registry
+from aws_setup.stream_crypto import EncryptingReader, iter_decrypted_chunks
+from benchmarks import generators
+from s3_tasks import upload_to_s3
+from s3_tasks.id_allocator import alphanum
+from s3_tasks.mapping_store import open_mapping_store
+from Utilities.aws_clients import reset_clients
+
+#**********************************************************************
+# Offline benchmark suite
+#**********************************************************************
+# Every benchmark builds its own synthetic data with the generators, in a scratch directory and,
+# when it talks to AWS, inside a fresh moto mock, so the suite needs no network or credentials.
+# Only the operation being measured is timed, never the data generation. Results are written as
+# JSON; pass an earlier results file as --baseline to print the change of every metric.
+# Moto answers in-process, so AWS timings measure our client-side work and call counts, not
+# network latency: compare them between runs, not with production.
+
+SCALES = {
+    'small': {'files': 40, 'file_size': 16 * 1024, 'id_width': 2, 'id_fill': 0.9, 'mapping_files': 2000,
+              'buckets': 40, 'tables': 10, 'roles': 20, 'tagged_fraction': 0.1, 'registry_rows': 1000,
+              'db_rows': 20000},
+    'medium': {'files': 200, 'file_size': 64 * 1024, 'id_width': 3, 'id_fill': 0.5, 'mapping_files': 20000,
+               'buckets': 200, 'tables': 40, 'roles': 80, 'tagged_fraction': 0.1, 'registry_rows': 10000,
+               'db_rows': 200000},
+    'large': {'files': 1000, 'file_size': 256 * 1024, 'id_width': 3, 'id_fill': 0.9, 'mapping_files': 100000,
+              'buckets': 1000, 'tables': 100, 'roles': 300, 'tagged_fraction': 0.05, 'registry_rows': 100000,
+              'db_rows': 1000000},
+}
+
+
+@contextlib.contextmanager
+def offline_aws():
+    """A fresh moto mock with shared clients built inside it."""
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        reset_clients()
+        try:
+            yield
+        finally:
+            reset_clients()
+
+
+def quiet():
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def use_mapping_store(path, id_width=None):
+    """Point upload_to_s3 at a scratch mapping store."""
+    upload_to_s3.db_file = path
+    upload_to_s3.mapping_store = None
+    upload_to_s3.id_allocator = None
+    upload_to_s3.id_width = id_width or upload_to_s3.default_id_width
+
+
+#**********************************************************************
+# Benchmarks
+#**********************************************************************
+def bench_upload(scale, workdir):
+    """Upload throughput of upload_files_to_s3 into a moto bucket."""
+    paths = generators.make_files(os.path.join(workdir, 'photos'), scale['files'], scale['file_size'])
+    with offline_aws():
+        use_mapping_store(os.path.join(workdir, 'upload-mapping.sqlite'))
+        with quiet():
+            upload_to_s3.check_or_create_bucket()
+            results, seconds = timed(upload_to_s3.upload_files_to_s3, paths)
+        upload_to_s3.get_mapping_store().close()
+    uploaded = sum(1 for result in results if result[2] == 'uploaded')
+    total_bytes = scale['files'] * scale['file_size']
+    return {'files': len(paths), 'uploaded': uploaded, 'seconds': seconds, 'files_per_second': len(paths) / seconds,
+            'mb_per_second': total_bytes / seconds / 1e6}
+
+
+def bench_id_allocation(scale, workdir):
+    """Cost of generate_random_filename as the ID space fills up, per tenth of the space."""
+    use_mapping_store(os.path.join(workdir, 'ids-mapping.sqlite'), scale['id_width'])
+    space = len(alphanum) ** scale['id_width']
+    allocations = int(space * scale['id_fill'])
+    step = max(allocations // 10, 1)
+    deciles = []
+    for start in range(0, allocations, step):
+        count = min(step, allocations - start)
+        _, seconds = timed(lambda: [upload_to_s3.generate_random_filename(f"photo-{start + index}.jpg")
+                                    for index in range(count)])
+        deciles.append({'fill': round((start + count) / space, 3), 'us_per_id': seconds / count * 1e6})
+    upload_to_s3.get_mapping_store().close()
+    return {'id_space': space, 'allocated': allocations, 'deciles': deciles,
+            'us_per_id_last': deciles[-1]['us_per_id'] if deciles else None}
+
+
+def bench_mapping(scale, workdir):
+    """Full save and load of the filename mapping in each store backend."""
+    mapping = generators.make_mapping(scale['mapping_files'])
+    results = {'files': scale['mapping_files']}
+    for backend, extension in (('sqlite', '.sqlite'), ('json', '.json')):
+        store = open_mapping_store(os.path.join(workdir, f"mapping-bench{extension}"))
+        _, save_seconds = timed(store.save_mapping, mapping)
+        loaded, load_seconds = timed(store.load_mapping)
+        store.close()
+        results[backend] = {'save_seconds': save_seconds, 'load_seconds': load_seconds,
+                            'loaded_files': len(loaded) - 2}
+    return results
+
+
+def bench_discovery(scale, workdir):
+    """discover_project_resources through the Tagging API and by scanning each service."""
+    fraction = scale['tagged_fraction']
+    with offline_aws():
+        generators.make_buckets(scale['buckets'], fraction)
+        generators.make_tables(scale['tables'], fraction)
+        generators.make_roles(scale['roles'], fraction)
+        with quiet():
+            tagging, tagging_seconds = timed(discover_project_resources, use_tagging_api=True)
+            scanned, scan_seconds = timed(discover_project_resources, use_tagging_api=False)
+    return {'resources': scale['buckets'] + scale['tables'] + scale['roles'],
+            'tagging_api': {'found': len(tagging), 'seconds': tagging_seconds},
+            'service_scan': {'found': len(scanned), 'seconds': scan_seconds}}
+
+
+def bench_registry(scale, workdir):
+    """Batched registry writes and segmented registry scans."""
+    with offline_aws():
+        with quiet():
+            (written, _, failed), write_seconds = timed(generators.make_registry_rows, scale['registry_rows'])
+        results = {'rows': scale['registry_rows'], 'write': {'written': written, 'failed': failed,
+                                                             'rows_per_second': written / write_seconds}}
+        for segments in (1, 4):
+            grouped, seconds = timed(read_registry, total_segments=segments)
+            rows = sum(len(identifiers) for identifiers in grouped.values())
+            results[f"scan_{segments}_segments"] = {'rows': rows, 'seconds': seconds,
+                                                    'rows_per_second': rows / seconds}
+    return results
+
+
+def bench_backup_encryption(scale, workdir):
+    """Snapshot, compress and encrypt the database as a stream, then decrypt it again, per codec."""
+    conn = generators.make_sqlite_db(os.path.join(workdir, 'bench.sqlite'), scale['db_rows'])
+    key = base64.urlsafe_b64encode(os.urandom(32))
+    results = {'db_bytes': os.path.getsize(os.path.join(workdir, 'bench.sqlite'))}
+    for codec in ('none', 'zlib', 'lzma'):
+        started = time.perf_counter()
+        with temporary_snapshot(conn) as snapshot_path, open(snapshot_path, 'rb') as db_file:
+            encrypted = EncryptingReader(CompressingReader(db_file, codec), key).read()
+        encrypt_seconds = time.perf_counter() - started
+        _, decrypt_seconds = timed(lambda: sum(len(chunk) for chunk in
+                                               iter_decrypted_chunks(io.BytesIO(encrypted), key)))
+        results[codec] = {'encrypt_seconds': encrypt_seconds, 'decrypt_seconds': decrypt_seconds,
+                          'encrypt_mb_per_second': results['db_bytes'] / encrypt_seconds / 1e6,
+                          'output_ratio': len(encrypted) / results['db_bytes']}
+    conn.close()
+    return results
+
+
+BENCHMARKS = {
+    'upload': bench_upload,
+    'id_allocation': bench_id_allocation,
+    'mapping': bench_mapping,
+    'discovery': bench_discovery,
+    'registry': bench_registry,
+    'backup_encryption': bench_backup_encryption,
+}
+
+
+#**********************************************************************
+# Results
+#**********************************************************************
+def flatten(results, prefix=''):
+    """Yield (dotted name, value) for every number in a nested result."""
+    for name, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{name}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{name}", value
+
+
+def compare(results, baseline):
+    previous = dict(flatten(baseline.get('results', {})))
+    for name, value in flatten(results):
+        if previous.get(name):
+            print(f"  {name:<55} {previous[name]:>12.4g} -> {value:>12.4g}  ({value / previous[name] - 1:+.1%})")
+
+
+def run_benchmarks(scale_name='small', names=None, overrides=None):
+    scale = dict(SCALES[scale_name], **(overrides or {}))
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='photoproject-bench-') as workdir:
+        for name in names or BENCHMARKS:
+            print(f"Running {name}...")
+            benchmark_dir = os.path.join(workdir, name)
+            os.makedirs(benchmark_dir)
+            results[name], seconds = timed(BENCHMARKS[name], scale, benchmark_dir)
+            print(f"  done in {seconds:.2f}s")
+    return {'created': datetime.now(timezone.utc).isoformat(), 'python': sys.version.split()[0],
+            'platform': platform.platform(), 'scale': scale_name, 'parameters': scale, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the offline (moto) performance benchmarks.')
+    parser.add_argument('--scale', choices=SCALES, default='small', help='Size of the synthetic data')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help='Benchmarks to run (default: all)')
+    parser.add_argument('--set', nargs='+', default=[], metavar='NAME=VALUE',
+                        help='Override scale parameters, e.g. --set buckets=500 registry_rows=50000')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON results file to write')
+    parser.add_argument('--baseline', help='Earlier results file to compare with')
+    args = parser.parse_args()
+
+    overrides = {}
+    for setting in args.set:
+        name, value = setting.split('=', 1)
+        overrides[name] = float(value) if '.' in value else int(value)
+
+    report = run_benchmarks(args.scale, args.only, overrides)
+    with open(args.output, 'w') as results_file:
+        json.dump(report, results_file, indent=4)
+    print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            print(f"Compared with {args.baseline}:")
+            compare(report['results'], json.load(baseline_file))
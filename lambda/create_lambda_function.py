@@ -2,8 +2,9 @@ import boto3
 import json
 import zipfile
 import os
+from Utilities.aws_clients import get_client
 
-lanbda_handshake = boto3.client('lambda')
+lanbda_handshake = get_client('lambda')
 
 import boto3
 import json
@@ -0,0 +1,64 @@
+import argparse
+import runpy
+import sys
+
+from Utilities.profiling import add_profile_arguments, profile_from_args
+
+#**********************************************************************
+# photoproject <command>
+#**********************************************************************
+# One entry point for the project's scripts: python -m photoproject <command> [options].
+# Only argparse and the profiling options (standard library only) are imported up front. The
+# module behind a command (and with it boto3, cryptography and the botocore service models) is
+# imported when that command runs, and moto only with --mock. Commands backed by a script run it exactly as `python -m <module>` would.
+# Check startup cost with `python -m photoproject.startup_benchmark`. --metrics reports every AWS
+# API call the command made (see Utilities.api_metrics) and --profile writes a CPU and memory
+# profile of it (see Utilities.profiling).
+
+# command: (module, action passed to photo_project_resource_check or None to run the module, help)
+COMMANDS = {
+    'upload': ('s3_tasks.upload_to_s3', None, 'Upload files to the project bucket'),
+    'sync': ('aws_setup.photo_project_resource_check', 'sync',
+             'Create the bucket and database if missing and sync the database with its backup'),
+    'backup': ('aws_setup.photo_project_resource_check', 'backup', 'Back up the local database to S3'),
+    'restore': ('aws_setup.photo_project_resource_check', 'restore', 'Restore the local database from S3'),
+    'discover': ('aws_setup.resource_discovery', None, 'List every resource tagged for the project'),
+    'inventory': ('aws_setup.resource_inventory', None, 'List project resources from the local inventory cache'),
+    'reconcile': ('aws_setup.resource_reconciler', None, 'Bring the project resources to their desired state'),
+    'roles': ('aws_setup.check_and_initialize_roles', None, 'Check and initialize the project IAM roles'),
+}
+
+
+def run_command(command, argv):
+    module_name, action, _ = COMMANDS[command]
+    if action:
+        from aws_setup.photo_project_resource_check import main
+        return main([action, *argv])
+    sys.argv = [f"photoproject {command}", *argv]
+    runpy.run_module(module_name, run_name='__main__', alter_sys=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='photoproject', description='Photo Project command line.')
+    parser.add_argument('--mock', action='store_true', help='Run against a local moto mock instead of AWS')
+    parser.add_argument('--metrics', action='store_true', help='Print per-operation AWS API metrics at exit')
+    parser.add_argument('--metrics-json', metavar='PATH', help='Also write the API metrics as JSON')
+    parser.add_argument('--metrics-prom', metavar='PATH', help='Also write the API metrics as a Prometheus textfile')
+    add_profile_arguments(parser)
+    parser.add_argument('command', choices=COMMANDS, metavar='command',
+                        help=', '.join(f"{name}: {help_text}" for name, (_, _, help_text) in COMMANDS.items()))
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Options of the command (see <command> --help)')
+    args = parser.parse_args(argv)
+
+    if args.metrics or args.metrics_json or args.metrics_prom:
+        from Utilities.api_metrics import enable
+        enable(args.metrics_json, args.metrics_prom, summary=args.metrics)
+    if args.mock:
+        from Utilities.aws_clients import start_local_mock
+        start_local_mock()
+    with profile_from_args(args, args.command):
+        run_command(args.command, args.args)
+
+
+if __name__ == '__main__':
+    main()
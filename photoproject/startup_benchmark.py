@@ -0,0 +1,98 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+#**********************************************************************
+# Startup benchmark
+#**********************************************************************
+# Runs `python -X importtime -m photoproject ...` for a few cheap invocations and reports the wall
+# time and the import time, with the slowest imports. Each target lists modules it must not load:
+# the bare dispatcher must stay free of boto3 and cryptography, no command may load moto without
+# --mock, and the commands that don't touch backups must not load cryptography. A target over its
+# budget or loading a forbidden module fails the run, so import regressions show up in CI.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RUNS = 5
+
+# (arguments, forbidden modules, budget in ms for the median import time or None)
+TARGETS = [
+    (['--help'], ('boto3', 'botocore', 'cryptography', 'moto'), 50),
+    (['discover', '--help'], ('cryptography', 'moto'), None),
+    (['inventory', '--help'], ('cryptography', 'moto'), None),
+    (['reconcile', '--help'], ('cryptography', 'moto'), None),
+    (['upload', '--help'], ('cryptography', 'moto'), None),
+    (['backup', '--help'], ('moto',), None),
+]
+
+
+def parse_importtime(stderr):
+    """Return {module: (self us, cumulative us)} and the import time in us from -X importtime output.
+
+    The interpreter's own startup (site and whatever .pth files it loads) is left out of the total.
+    """
+    modules = {}
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+        total += int(self_us)
+    return modules, total - modules.get('site', (0, 0))[1]
+
+
+def measure(arguments, runs=DEFAULT_RUNS):
+    wall_ms, import_ms = [], []
+    modules = {}
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'photoproject', *arguments],
+                                cwd=REPO_ROOT, capture_output=True, text=True)
+        wall_ms.append((time.perf_counter() - started) * 1000)
+        modules, total = parse_importtime(result.stderr)
+        import_ms.append(total / 1000)
+    return {'wall_ms': statistics.median(wall_ms), 'import_ms': statistics.median(import_ms), 'modules': modules}
+
+
+def run_benchmark(runs=DEFAULT_RUNS, top=5):
+    """Measure every target. Returns (results, failures)."""
+    results, failures = [], []
+    for arguments, forbidden, budget_ms in TARGETS:
+        name = ' '.join(arguments)
+        measured = measure(arguments, runs)
+        loaded = sorted(module for module in forbidden if module in measured['modules'])
+        slowest = sorted(measured['modules'].items(), key=lambda item: item[1][1], reverse=True)[:top]
+        results.append({'target': name, 'wall_ms': round(measured['wall_ms'], 1),
+                        'import_ms': round(measured['import_ms'], 1), 'forbidden_loaded': loaded,
+                        'slowest': [[module, cumulative / 1000] for module, (_, cumulative) in slowest]})
+
+        print(f"{name:<20} wall {measured['wall_ms']:7.1f} ms   imports {measured['import_ms']:7.1f} ms")
+        for module, (_, cumulative) in slowest:
+            print(f"    {cumulative / 1000:7.1f} ms  {module}")
+        if loaded:
+            failures.append(f"'{name}' loaded {', '.join(loaded)}")
+        if budget_ms is not None and measured['import_ms'] > budget_ms:
+            failures.append(f"'{name}' spent {measured['import_ms']:.1f} ms importing (budget {budget_ms} ms)")
+    return results, failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the startup time of the photoproject command.')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help='Runs per target; the median is reported')
+    parser.add_argument('--top', type=int, default=5, help='Slowest imports to show per target')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results, failures = run_benchmark(args.runs, args.top)
+    if args.json:
+        with open(args.json, 'w') as results_file:
+            json.dump({'python': sys.version.split()[0], 'runs': args.runs, 'results': results,
+                       'failures': failures}, results_file, indent=4)
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,83 @@
+import hashlib
+import hmac
+import secrets
+
+
+alphanum = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+default_id_width = 6
+feistel_rounds = 4
+
+
+class IdSpaceExhausted(Exception):
+    """Raised when every ID of the allocator's width has been handed out."""
+
+
+# ---------------------------------------------------
+# ID Allocation
+# ---------------------------------------------------
+
+# ***************************************************
+# Counter-based allocator with a keyed permutation
+# ***************************************************
+class IdAllocator:
+    """Allocates fixed-width IDs in constant time from a counter and a secret keyed permutation."""
+
+    def __init__(self, store, width=default_id_width):
+        if width < 1:
+            raise ValueError("ID width must be at least 1.")
+        self.store = store
+        self.width = width
+        self.space = len(alphanum) ** width
+        self._half_bits = ((self.space - 1).bit_length() + 1) // 2
+        self._half_mask = (1 << self._half_bits) - 1
+        self._key = None
+
+    def _permutation_key(self):
+        """Load the permutation key from the store, creating it on first use."""
+        if self._key is None:
+            with self.store.transaction():
+                key = self.store.get_setting('id_permutation_key')
+                if not key:
+                    key = secrets.token_hex(32)
+                    self.store.set_setting('id_permutation_key', key)
+            self._key = bytes.fromhex(key)
+        return self._key
+
+    def _round(self, round_number, value):
+        digest = hmac.new(self._permutation_key(), f'{round_number}:{value}'.encode(), hashlib.sha256).digest()
+        return int.from_bytes(digest[:8], 'big') & self._half_mask
+
+    def permute(self, value):
+        """Map a counter value onto the ID space without collisions."""
+        # Cycle-walk: the Feistel network permutes a slightly larger power-of-two domain
+        while True:
+            left, right = value >> self._half_bits, value & self._half_mask
+            for round_number in range(feistel_rounds):
+                left, right = right, left ^ self._round(round_number, right)
+            value = (left << self._half_bits) | right
+            if value < self.space:
+                return value
+
+    def encode(self, value):
+        """Encode a number as a fixed-width ID."""
+        characters = []
+        for _ in range(self.width):
+            value, remainder = divmod(value, len(alphanum))
+            characters.append(alphanum[remainder])
+        return ''.join(reversed(characters))
+
+    def allocate(self):
+        """Reserve and return the next unused ID."""
+        counter_name = f'id_counter_{self.width}'
+        with self.store.transaction():
+            counter = int(self.store.get_setting(counter_name) or 0)
+            while True:
+                if counter >= self.space:
+                    raise IdSpaceExhausted(f"All {self.space} IDs of width {self.width} are used. Increase the ID width.")
+                random_id = self.encode(self.permute(counter))
+                counter += 1
+                # IDs from the old random scheme may already be taken, so skip over them
+                if self.store.reserve_id(random_id):
+                    break
+            self.store.set_setting(counter_name, str(counter))
+        return random_id
@@ -0,0 +1,46 @@
+import pytest
+
+from s3_tasks.id_allocator import IdAllocator, IdSpaceExhausted, alphanum
+from s3_tasks.mapping_store import open_mapping_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = open_mapping_store(str(tmp_path / 'mapping.sqlite'))
+    yield store
+    store.close()
+
+
+def test_permutation_stays_in_range_without_collisions(store):
+    allocator = IdAllocator(store, width=2)
+    values = [allocator.permute(value) for value in range(allocator.space)]
+    assert sorted(values) == list(range(allocator.space))
+
+
+def test_allocates_every_id_once_then_raises(store):
+    allocator = IdAllocator(store, width=2)
+    # IDs taken by the old random scheme are skipped over
+    store.reserve_id('00')
+    store.reserve_id('zz')
+
+    with store.transaction():
+        ids = [allocator.allocate() for _ in range(allocator.space - 2)]
+    assert len(set(ids)) == len(ids)
+    assert all(len(random_id) == 2 and set(random_id) <= set(alphanum) for random_id in ids)
+    assert '00' not in ids and 'zz' not in ids
+
+    with pytest.raises(IdSpaceExhausted):
+        allocator.allocate()
+
+
+def test_counter_and_key_survive_reopening(tmp_path):
+    path = str(tmp_path / 'mapping.sqlite')
+    store = open_mapping_store(path)
+    first = [IdAllocator(store, width=3).allocate() for _ in range(5)]
+    store.close()
+
+    store = open_mapping_store(path)
+    allocator = IdAllocator(store, width=3)
+    second = [allocator.allocate() for _ in range(5)]
+    store.close()
+    assert len(set(first + second)) == 10
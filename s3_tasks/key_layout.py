@@ -0,0 +1,159 @@
+import argparse
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import botocore
+from s3_tasks.mapping_store import reserved_keys
+from Utilities.aws_clients import get_client
+
+
+max_prefix_depth = 16
+delete_batch_size = 1000
+delete_attempts = 2  # Keys S3 fails to delete are retried once before being reported
+
+# ---------------------------------------------------
+# Key Layout Functions
+# ---------------------------------------------------
+
+# ***************************************************
+# Read the configured prefix depth from the store
+# ***************************************************
+def get_prefix_depth(store):
+    """Return the number of hash prefix levels used for new keys (0 means flat)."""
+    return int(store.get_setting('key_prefix_depth') or 0)
+
+# ***************************************************
+# Strip any hash prefixes from a key
+# ***************************************************
+def strip_key_prefix(key):
+    """Return the '<id>-<suffix><ext>' part of a key, whatever its layout."""
+    return key.rsplit('/', 1)[-1]
+
+# ***************************************************
+# Build the hash prefix for a key
+# ***************************************************
+def key_prefix(key_name, depth):
+    """Return the 'ab/cd/' style prefix derived from the key name's hash."""
+    if not 0 <= depth <= max_prefix_depth:
+        raise ValueError(f"Prefix depth must be between 0 and {max_prefix_depth}.")
+    digest = hashlib.md5(key_name.encode()).hexdigest()
+    return ''.join(f'{digest[level * 2:level * 2 + 2]}/' for level in range(depth))
+
+# ***************************************************
+# Apply the layout to a key
+# ***************************************************
+def apply_key_layout(key, depth):
+    """Return the key rewritten for the given prefix depth."""
+    key_name = strip_key_prefix(key)
+    return f'{key_prefix(key_name, depth)}{key_name}'
+
+# ***************************************************
+# Delete keys in batches
+# ***************************************************
+def delete_keys(s3_handshake, bucket_name, keys):
+    """Delete keys with batched delete_objects calls. Returns [(key, error message)] for the keys left behind."""
+    failed = []
+    for start in range(0, len(keys), delete_batch_size):
+        batch = keys[start:start + delete_batch_size]
+        for attempt in range(delete_attempts):
+            # Quiet mode only reports the keys that could not be deleted
+            response = s3_handshake.delete_objects(
+                Bucket=bucket_name,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+            errors = response.get('Errors', [])
+            batch = [error['Key'] for error in errors]
+            if not batch:
+                break
+        failed.extend((error['Key'], f"{error.get('Code')}: {error.get('Message')}") for error in errors)
+    return failed
+
+# ---------------------------------------------------
+# Migration Functions
+# ---------------------------------------------------
+
+# ***************************************************
+# Re-key existing objects into a new layout
+# ***************************************************
+def migrate_key_layout(store, depth, max_workers=16, dry_run=False):
+    """Copy every mapped object to its key in the new layout, update the mapping and delete the old keys."""
+    bucket_name = store.get_bucket_name()
+    mapping = store.load_mapping()
+
+    moves = {}
+    for filename, keys in mapping.items():
+        if filename in reserved_keys:
+            continue
+        for key in keys:
+            new_key = apply_key_layout(key, depth)
+            if new_key != key:
+                moves[key] = new_key
+
+    print(f"{len(moves)} objects in '{bucket_name}' need re-keying for prefix depth {depth}.")
+    if dry_run:
+        for old_key, new_key in moves.items():
+            print(f"{old_key} -> {new_key}")
+        return []
+    if not moves:
+        store.set_setting('key_prefix_depth', str(depth))
+        return []
+
+    s3_handshake = get_client('s3', min_pool_connections=max_workers)
+
+    def copy_one(move):
+        old_key, new_key = move
+        try:
+            # Managed copy stays server-side and switches to multipart copy for large objects
+            s3_handshake.copy({'Bucket': bucket_name, 'Key': old_key}, bucket_name, new_key)
+            return old_key, new_key, None
+        except botocore.exceptions.ClientError as e:
+            return old_key, new_key, e.response['Error']['Message']
+        except Exception as e:
+            return old_key, new_key, str(e)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(copy_one, moves.items()))
+
+    # Point the mapping at the copies before removing the originals
+    copied = [(old_key, new_key) for old_key, new_key, error in results if error is None]
+    with store.transaction():
+        for old_key, new_key in copied:
+            store.replace_key(old_key, new_key)
+        if len(copied) == len(results):
+            store.set_setting('key_prefix_depth', str(depth))
+
+    failed_deletes = delete_keys(s3_handshake, bucket_name, [old_key for old_key, new_key in copied])
+
+    for old_key, new_key, error in results:
+        if error is not None:
+            print(f"FAILED {old_key}: {error}")
+    for old_key, error in failed_deletes:
+        print(f"NOT DELETED {old_key}: {error}")
+    elapsed = time.perf_counter() - started
+    print(f"Re-keyed {len(copied)}/{len(results)} objects in {elapsed:.2f}s.")
+    if len(copied) != len(results):
+        print("Some objects failed to copy. The prefix depth was not changed; run the migration again.")
+    if failed_deletes:
+        print(f"{len(failed_deletes)} old keys could not be deleted. They are no longer mapped and can be "
+              f"removed by hand.")
+    return results
+
+# ---------------------------------------------------
+# Main Execution
+# ---------------------------------------------------
+
+if __name__ == '__main__':
+    from s3_tasks import upload_to_s3
+
+    parser = argparse.ArgumentParser(description='Move uploaded objects into a hash-prefixed key layout')
+    parser.add_argument('depth', type=int, help='Number of two-character hash prefix levels (0 for a flat layout)')
+    parser.add_argument('--workers', type=int, default=16, help='Number of parallel server-side copies')
+    parser.add_argument('--mapping-file', default=upload_to_s3.db_file, help='Mapping store to migrate')
+    parser.add_argument('--dry-run', action='store_true', help='Only print the planned moves')
+    args = parser.parse_args()
+
+    upload_to_s3.db_file = args.mapping_file
+    migrate_key_layout(upload_to_s3.get_mapping_store(), args.depth, max_workers=args.workers,
+                       dry_run=args.dry_run)
@@ -0,0 +1,95 @@
+import argparse
+import json
+import sys
+
+import botocore
+
+from Utilities.aws_clients import get_client
+
+
+output_formats = ('text', 'jsonl', 'tsv')
+default_page_size = 1000
+
+# ---------------------------------------------------
+# Listing Functions
+# ---------------------------------------------------
+
+# ***************************************************
+# Stream objects from a bucket page by page
+# ***************************************************
+def iter_s3_objects(bucket_name, prefix='', start_after='', max_keys=None, page_size=default_page_size,
+                    s3_handshake=None):
+    """Yield object summaries one at a time, fetching further pages only as they are consumed."""
+    if s3_handshake is None:
+        s3_handshake = get_client('s3')
+
+    parameters = {'Bucket': bucket_name, 'Prefix': prefix}
+    if start_after:
+        parameters['StartAfter'] = start_after
+    pagination = {'PageSize': page_size}
+    if max_keys:
+        pagination['MaxItems'] = max_keys
+
+    paginator = s3_handshake.get_paginator('list_objects_v2')
+    for page in paginator.paginate(PaginationConfig=pagination, **parameters):
+        yield from page.get('Contents', [])
+
+# ***************************************************
+# Format one object summary for output
+# ***************************************************
+def format_s3_object(obj, output_format):
+    """Format an object summary as plain text, a JSON line or a TSV row."""
+    if output_format == 'text':
+        return obj['Key']
+
+    record = {
+        'Key': obj['Key'],
+        'Size': obj.get('Size'),
+        'LastModified': obj['LastModified'].isoformat() if obj.get('LastModified') else None,
+        'ETag': obj.get('ETag', '').strip('"'),
+        'StorageClass': obj.get('StorageClass')
+    }
+    if output_format == 'jsonl':
+        return json.dumps(record)
+    return '\t'.join('' if value is None else str(value) for value in record.values())
+
+# ***************************************************
+# Print objects as they arrive
+# ***************************************************
+def print_s3_objects(bucket_name, prefix='', start_after='', max_keys=None, output_format='text',
+                     output=sys.stdout, s3_handshake=None):
+    """Stream a bucket listing to output without holding it in memory. Returns the object count."""
+    if output_format not in output_formats:
+        raise ValueError(f"Unknown output format '{output_format}'. Use one of {output_formats}.")
+
+    count = 0
+    try:
+        for obj in iter_s3_objects(bucket_name, prefix, start_after, max_keys, s3_handshake=s3_handshake):
+            if count == 0 and output_format == 'text':
+                print("Files in the bucket:", file=output)
+            print(format_s3_object(obj, output_format), file=output, flush=count == 0)
+            count += 1
+        if count == 0 and output_format == 'text':
+            print("The bucket is empty or does not exist.", file=output)
+    except botocore.exceptions.ClientError as e:
+        print(f"Error listing files: {e.response['Error']['Message']}", file=sys.stderr)
+    return count
+
+# ---------------------------------------------------
+# Main Execution
+# ---------------------------------------------------
+
+if __name__ == '__main__':
+    from s3_tasks import upload_to_s3
+
+    parser = argparse.ArgumentParser(description='List objects in the upload bucket')
+    parser.add_argument('--prefix', default='', help='Only list keys under this prefix')
+    parser.add_argument('--start-after', default='', help='Start listing after this key')
+    parser.add_argument('--max-keys', type=int, help='Stop after this many keys')
+    parser.add_argument('--format', choices=output_formats, default='text', help='Output format')
+    parser.add_argument('--mapping-file', default=upload_to_s3.db_file, help='Mapping store holding the bucket name')
+    args = parser.parse_args()
+
+    upload_to_s3.db_file = args.mapping_file
+    print_s3_objects(upload_to_s3.get_mapping_store().get_bucket_name(), prefix=args.prefix,
+                     start_after=args.start_after, max_keys=args.max_keys, output_format=args.format)
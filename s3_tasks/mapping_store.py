@@ -0,0 +1,565 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+busy_timeout_seconds = 30
+reserved_keys = ('bucket_name', 'used_ids', 'settings', 'multipart_uploads', 'content_index', 'sync_manifest')
+manifest_fields = ('size', 'mtime_ns', 'sha256', 'key')
+multipart_fields = ('filename', 'key', 'upload_id', 'part_size', 'file_size', 'file_mtime', 'started_at')
+
+# ---------------------------------------------------
+# Mapping Store Interface
+# ---------------------------------------------------
+
+# ***************************************************
+# Base class shared by every mapping backend
+# ***************************************************
+class MappingStore:
+    """Stores the bucket name, the used IDs and the keys generated for each original filename."""
+
+    def transaction(self):
+        """Group several operations into one atomic update."""
+        raise NotImplementedError
+
+    def get_bucket_name(self):
+        raise NotImplementedError
+
+    def set_bucket_name(self, bucket_name):
+        raise NotImplementedError
+
+    def get_setting(self, name):
+        """Return a stored setting, or None if it has never been set."""
+        raise NotImplementedError
+
+    def set_setting(self, name, value):
+        raise NotImplementedError
+
+    def is_id_used(self, random_id):
+        raise NotImplementedError
+
+    def reserve_id(self, random_id):
+        """Mark an ID as used. Returns False if it was already taken."""
+        raise NotImplementedError
+
+    def get_keys(self, filename):
+        """Return the generated keys for a filename, oldest first."""
+        raise NotImplementedError
+
+    def add_key(self, filename, key):
+        raise NotImplementedError
+
+    def has_key(self, key):
+        """Return True if any filename maps to the key."""
+        raise NotImplementedError
+
+    def replace_key(self, old_key, new_key):
+        """Rename a generated key wherever it is recorded."""
+        raise NotImplementedError
+
+    def remove_filename(self, filename):
+        """Forget a filename and return the keys it mapped to."""
+        raise NotImplementedError
+
+    def get_content_key(self, sha256):
+        """Return the key already holding content with this SHA-256, or None."""
+        raise NotImplementedError
+
+    def add_content(self, sha256, key, size):
+        raise NotImplementedError
+
+    def remove_content_key(self, key):
+        raise NotImplementedError
+
+    def load_manifest(self):
+        """Return the sync manifest as {source_path: {size, mtime_ns, sha256, key}} in one read."""
+        raise NotImplementedError
+
+    def set_manifest_entry(self, source_path, size, mtime_ns, sha256, key):
+        raise NotImplementedError
+
+    def remove_manifest_entry(self, source_path):
+        raise NotImplementedError
+
+    def get_multipart_upload(self, filename):
+        """Return the unfinished multipart upload recorded for a filename, or None."""
+        raise NotImplementedError
+
+    def start_multipart_upload(self, filename, key, upload_id, part_size, file_size, file_mtime, started_at):
+        raise NotImplementedError
+
+    def add_multipart_part(self, upload_id, part_number, etag):
+        raise NotImplementedError
+
+    def get_multipart_parts(self, upload_id):
+        """Return the completed parts of an upload as {part_number: etag}."""
+        raise NotImplementedError
+
+    def forget_multipart_upload(self, upload_id):
+        raise NotImplementedError
+
+    def list_multipart_uploads(self):
+        raise NotImplementedError
+
+    def load_mapping(self):
+        """Return the whole mapping in the legacy filename_mapping.json layout."""
+        raise NotImplementedError
+
+    def save_mapping(self, mapping):
+        """Replace the whole store with a mapping in the legacy layout."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+# ---------------------------------------------------
+# JSON Backend
+# ---------------------------------------------------
+
+# ***************************************************
+# Legacy whole-file JSON store
+# ***************************************************
+class JsonMappingStore(MappingStore):
+    """Keeps the original filename_mapping.json format. Every transaction reads and rewrites the file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._mapping = None
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._depth == 0:
+                self._mapping = self._read()
+            self._depth += 1
+            try:
+                yield self
+                if self._depth == 1:
+                    self._write(self._mapping)
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._mapping = None
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {'bucket_name': '', 'used_ids': set()}
+        with open(self.path, 'r') as file:
+            mapping = json.load(file)
+        # Convert 'used_ids' to a set for efficient operations
+        mapping['used_ids'] = set(mapping.get('used_ids', []))
+        mapping.setdefault('bucket_name', '')
+        return mapping
+
+    def _write(self, mapping):
+        # Convert 'used_ids' back to a list for JSON serialization, then swap the file into place
+        data = dict(mapping, used_ids=list(mapping['used_ids']))
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(data, file)
+        os.replace(temp_path, self.path)
+
+    def get_bucket_name(self):
+        with self.transaction():
+            return self._mapping['bucket_name']
+
+    def set_bucket_name(self, bucket_name):
+        with self.transaction():
+            self._mapping['bucket_name'] = bucket_name
+
+    def get_setting(self, name):
+        with self.transaction():
+            return self._mapping.get('settings', {}).get(name)
+
+    def set_setting(self, name, value):
+        with self.transaction():
+            self._mapping.setdefault('settings', {})[name] = value
+
+    def is_id_used(self, random_id):
+        with self.transaction():
+            return random_id in self._mapping['used_ids']
+
+    def reserve_id(self, random_id):
+        with self.transaction():
+            if random_id in self._mapping['used_ids']:
+                return False
+            self._mapping['used_ids'].add(random_id)
+            return True
+
+    def get_keys(self, filename):
+        with self.transaction():
+            return list(self._mapping.get(filename, []))
+
+    def add_key(self, filename, key):
+        with self.transaction():
+            self._mapping.setdefault(filename, []).append(key)
+
+    def has_key(self, key):
+        with self.transaction():
+            return any(key in keys for filename, keys in self._mapping.items() if filename not in reserved_keys)
+
+    def replace_key(self, old_key, new_key):
+        with self.transaction():
+            for filename, keys in self._mapping.items():
+                if filename not in reserved_keys:
+                    self._mapping[filename] = [new_key if key == old_key else key for key in keys]
+            for entry in self._mapping.get('content_index', {}).values():
+                if entry['key'] == old_key:
+                    entry['key'] = new_key
+            for entry in self._mapping.get('sync_manifest', {}).values():
+                if entry['key'] == old_key:
+                    entry['key'] = new_key
+
+    def remove_filename(self, filename):
+        with self.transaction():
+            return self._mapping.pop(filename, []) if filename not in reserved_keys else []
+
+    def get_content_key(self, sha256):
+        with self.transaction():
+            entry = self._mapping.get('content_index', {}).get(sha256)
+            return entry['key'] if entry else None
+
+    def add_content(self, sha256, key, size):
+        with self.transaction():
+            self._mapping.setdefault('content_index', {})[sha256] = {'key': key, 'size': size}
+
+    def remove_content_key(self, key):
+        with self.transaction():
+            content_index = self._mapping.get('content_index', {})
+            for sha256 in [sha256 for sha256, entry in content_index.items() if entry['key'] == key]:
+                del content_index[sha256]
+
+    def load_manifest(self):
+        with self.transaction():
+            return {path: dict(entry) for path, entry in self._mapping.get('sync_manifest', {}).items()}
+
+    def set_manifest_entry(self, source_path, size, mtime_ns, sha256, key):
+        with self.transaction():
+            self._mapping.setdefault('sync_manifest', {})[source_path] = dict(
+                zip(manifest_fields, (size, mtime_ns, sha256, key)))
+
+    def remove_manifest_entry(self, source_path):
+        with self.transaction():
+            self._mapping.get('sync_manifest', {}).pop(source_path, None)
+
+    def get_multipart_upload(self, filename):
+        with self.transaction():
+            upload = self._mapping.get('multipart_uploads', {}).get(filename)
+            return {field: upload[field] for field in multipart_fields} if upload else None
+
+    def start_multipart_upload(self, filename, key, upload_id, part_size, file_size, file_mtime, started_at):
+        with self.transaction():
+            self._mapping.setdefault('multipart_uploads', {})[filename] = {
+                'filename': filename, 'key': key, 'upload_id': upload_id, 'part_size': part_size,
+                'file_size': file_size, 'file_mtime': file_mtime, 'started_at': started_at, 'parts': {}
+            }
+
+    def _find_multipart_upload(self, upload_id):
+        for upload in self._mapping.get('multipart_uploads', {}).values():
+            if upload['upload_id'] == upload_id:
+                return upload
+        return None
+
+    def add_multipart_part(self, upload_id, part_number, etag):
+        with self.transaction():
+            upload = self._find_multipart_upload(upload_id)
+            if upload is not None:
+                upload['parts'][str(part_number)] = etag
+
+    def get_multipart_parts(self, upload_id):
+        with self.transaction():
+            upload = self._find_multipart_upload(upload_id)
+            return {int(number): etag for number, etag in upload['parts'].items()} if upload else {}
+
+    def forget_multipart_upload(self, upload_id):
+        with self.transaction():
+            upload = self._find_multipart_upload(upload_id)
+            if upload is not None:
+                del self._mapping['multipart_uploads'][upload['filename']]
+
+    def list_multipart_uploads(self):
+        with self.transaction():
+            return [{field: upload[field] for field in multipart_fields}
+                    for upload in self._mapping.get('multipart_uploads', {}).values()]
+
+    def load_mapping(self):
+        with self.transaction():
+            mapping = dict(self._mapping)
+        mapping['used_ids'] = set(mapping['used_ids'])
+        return mapping
+
+    def save_mapping(self, mapping):
+        with self.transaction():
+            self._mapping = dict(mapping, used_ids=set(mapping.get('used_ids', [])))
+
+# ---------------------------------------------------
+# SQLite Backend
+# ---------------------------------------------------
+
+# ***************************************************
+# Indexed SQLite store
+# ***************************************************
+class SqliteMappingStore(MappingStore):
+    """Indexed SQLite store. Each update touches only its own rows and is safe across processes."""
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS settings (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS used_ids (
+            id TEXT PRIMARY KEY
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS generated_keys (
+            seq INTEGER PRIMARY KEY,
+            original_name TEXT NOT NULL,
+            key TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS generated_keys_by_name ON generated_keys (original_name, seq);
+        CREATE INDEX IF NOT EXISTS generated_keys_by_key ON generated_keys (key);
+        CREATE TABLE IF NOT EXISTS multipart_uploads (
+            filename TEXT PRIMARY KEY,
+            key TEXT NOT NULL,
+            upload_id TEXT NOT NULL UNIQUE,
+            part_size INTEGER NOT NULL,
+            file_size INTEGER NOT NULL,
+            file_mtime REAL NOT NULL,
+            started_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS multipart_parts (
+            upload_id TEXT NOT NULL,
+            part_number INTEGER NOT NULL,
+            etag TEXT NOT NULL,
+            PRIMARY KEY (upload_id, part_number)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS content_index (
+            sha256 TEXT PRIMARY KEY,
+            key TEXT NOT NULL,
+            size INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS content_index_by_key ON content_index (key);
+        CREATE TABLE IF NOT EXISTS sync_manifest (
+            source_path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            key TEXT NOT NULL
+        ) WITHOUT ROWID;
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        # Autocommit mode so transactions are controlled explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=busy_timeout_seconds, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(self.schema)
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield self
+                finally:
+                    self._depth -= 1
+                return
+
+            # Take the write lock up front so concurrent runs queue instead of failing mid-update
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._depth = 1
+            try:
+                yield self
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            else:
+                self._conn.execute('COMMIT')
+            finally:
+                self._depth = 0
+
+    def _execute(self, sql, parameters=()):
+        """Run a write in its own transaction, or the caller's, and return the affected row count."""
+        with self.transaction():
+            return self._conn.execute(sql, parameters).rowcount
+
+    def _fetch(self, sql, parameters=()):
+        """Run a read against the latest committed state, or the caller's transaction."""
+        with self._lock:
+            return self._conn.execute(sql, parameters).fetchall()
+
+    def get_bucket_name(self):
+        return self.get_setting('bucket_name') or ''
+
+    def set_bucket_name(self, bucket_name):
+        self.set_setting('bucket_name', bucket_name)
+
+    def get_setting(self, name):
+        rows = self._fetch("SELECT value FROM settings WHERE name = ?", (name,))
+        return rows[0][0] if rows else None
+
+    def set_setting(self, name, value):
+        self._execute("INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)", (name, value))
+
+    def is_id_used(self, random_id):
+        return bool(self._fetch("SELECT 1 FROM used_ids WHERE id = ?", (random_id,)))
+
+    def reserve_id(self, random_id):
+        return self._execute("INSERT OR IGNORE INTO used_ids (id) VALUES (?)", (random_id,)) == 1
+
+    def get_keys(self, filename):
+        rows = self._fetch("SELECT key FROM generated_keys WHERE original_name = ? ORDER BY seq", (filename,))
+        return [row[0] for row in rows]
+
+    def add_key(self, filename, key):
+        self._execute("INSERT INTO generated_keys (original_name, key) VALUES (?, ?)", (filename, key))
+
+    def has_key(self, key):
+        return bool(self._fetch("SELECT 1 FROM generated_keys WHERE key = ? LIMIT 1", (key,)))
+
+    def replace_key(self, old_key, new_key):
+        with self.transaction():
+            self._conn.execute("UPDATE generated_keys SET key = ? WHERE key = ?", (new_key, old_key))
+            self._conn.execute("UPDATE content_index SET key = ? WHERE key = ?", (new_key, old_key))
+            self._conn.execute("UPDATE sync_manifest SET key = ? WHERE key = ?", (new_key, old_key))
+
+    def remove_filename(self, filename):
+        with self.transaction():
+            keys = self.get_keys(filename)
+            self._conn.execute("DELETE FROM generated_keys WHERE original_name = ?", (filename,))
+        return keys
+
+    def get_content_key(self, sha256):
+        rows = self._fetch("SELECT key FROM content_index WHERE sha256 = ?", (sha256,))
+        return rows[0][0] if rows else None
+
+    def add_content(self, sha256, key, size):
+        self._execute("INSERT OR REPLACE INTO content_index (sha256, key, size) VALUES (?, ?, ?)",
+                      (sha256, key, size))
+
+    def remove_content_key(self, key):
+        self._execute("DELETE FROM content_index WHERE key = ?", (key,))
+
+    def load_manifest(self):
+        rows = self._fetch(f"SELECT source_path, {', '.join(manifest_fields)} FROM sync_manifest")
+        return {row[0]: dict(zip(manifest_fields, row[1:])) for row in rows}
+
+    def set_manifest_entry(self, source_path, size, mtime_ns, sha256, key):
+        self._execute(f"INSERT OR REPLACE INTO sync_manifest (source_path, {', '.join(manifest_fields)}) "
+                      f"VALUES (?, ?, ?, ?, ?)", (source_path, size, mtime_ns, sha256, key))
+
+    def remove_manifest_entry(self, source_path):
+        self._execute("DELETE FROM sync_manifest WHERE source_path = ?", (source_path,))
+
+    def get_multipart_upload(self, filename):
+        rows = self._fetch(f"SELECT {', '.join(multipart_fields)} FROM multipart_uploads WHERE filename = ?",
+                           (filename,))
+        return dict(zip(multipart_fields, rows[0])) if rows else None
+
+    def start_multipart_upload(self, filename, key, upload_id, part_size, file_size, file_mtime, started_at):
+        self._execute(f"INSERT OR REPLACE INTO multipart_uploads ({', '.join(multipart_fields)}) "
+                      f"VALUES (?, ?, ?, ?, ?, ?, ?)",
+                      (filename, key, upload_id, part_size, file_size, file_mtime, started_at))
+
+    def add_multipart_part(self, upload_id, part_number, etag):
+        self._execute("INSERT OR REPLACE INTO multipart_parts (upload_id, part_number, etag) VALUES (?, ?, ?)",
+                      (upload_id, part_number, etag))
+
+    def get_multipart_parts(self, upload_id):
+        rows = self._fetch("SELECT part_number, etag FROM multipart_parts WHERE upload_id = ?", (upload_id,))
+        return dict(rows)
+
+    def forget_multipart_upload(self, upload_id):
+        with self.transaction():
+            self._conn.execute("DELETE FROM multipart_parts WHERE upload_id = ?", (upload_id,))
+            self._conn.execute("DELETE FROM multipart_uploads WHERE upload_id = ?", (upload_id,))
+
+    def list_multipart_uploads(self):
+        rows = self._fetch(f"SELECT {', '.join(multipart_fields)} FROM multipart_uploads")
+        return [dict(zip(multipart_fields, row)) for row in rows]
+
+    def load_mapping(self):
+        with self.transaction():
+            mapping = {
+                'bucket_name': self.get_bucket_name(),
+                'used_ids': {row[0] for row in self._conn.execute("SELECT id FROM used_ids")}
+            }
+            for original_name, key in self._conn.execute(
+                    "SELECT original_name, key FROM generated_keys ORDER BY seq"):
+                mapping.setdefault(original_name, []).append(key)
+        return mapping
+
+    def save_mapping(self, mapping):
+        with self.transaction():
+            self._conn.execute("DELETE FROM settings WHERE name = 'bucket_name'")
+            self._conn.execute("DELETE FROM used_ids")
+            self._conn.execute("DELETE FROM generated_keys")
+            merge_mapping(self, mapping)
+
+    def close(self):
+        self._conn.close()
+
+# ---------------------------------------------------
+# Store Helpers
+# ---------------------------------------------------
+
+# ***************************************************
+# Open the right backend for a path
+# ***************************************************
+def open_mapping_store(path):
+    """Open a JSON store for '.json' paths and an SQLite store for anything else."""
+    if path.endswith('.json'):
+        return JsonMappingStore(path)
+    return SqliteMappingStore(path)
+
+# ***************************************************
+# Merge a legacy mapping dictionary into a store
+# ***************************************************
+def merge_mapping(store, mapping):
+    """Merge a mapping in the legacy layout into a store, skipping keys it already has."""
+    with store.transaction():
+        if mapping.get('bucket_name'):
+            store.set_bucket_name(mapping['bucket_name'])
+        for random_id in mapping.get('used_ids', []):
+            store.reserve_id(random_id)
+        for filename, keys in mapping.items():
+            if filename in reserved_keys:
+                continue
+            existing = set(store.get_keys(filename))
+            for key in keys:
+                if key not in existing:
+                    store.add_key(filename, key)
+
+# ***************************************************
+# One-time import of an existing JSON mapping
+# ***************************************************
+def import_json_mapping(json_path, store):
+    """Import an existing filename_mapping.json into a store. Safe to run more than once."""
+    with open(json_path, 'r') as file:
+        mapping = json.load(file)
+    merge_mapping(store, mapping)
+    filenames = [name for name in mapping if name not in reserved_keys]
+    print(f"Imported {len(filenames)} filenames from '{json_path}'.")
+
+# ---------------------------------------------------
+# Main Execution
+# ---------------------------------------------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import a filename_mapping.json file into an SQLite mapping store')
+    parser.add_argument('json_file', help='Path to the existing filename_mapping.json')
+    parser.add_argument('store_file', help='Path to the SQLite mapping store to create or update')
+    args = parser.parse_args()
+
+    store = open_mapping_store(args.store_file)
+    import_json_mapping(args.json_file, store)
+    store.close()
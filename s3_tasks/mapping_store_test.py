@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from s3_tasks.mapping_store import (open_mapping_store, merge_mapping, import_json_mapping, JsonMappingStore,
+                                    SqliteMappingStore)
+
+
+@pytest.fixture(params=['mapping.json', 'mapping.sqlite'])
+def store(request, tmp_path):
+    store = open_mapping_store(str(tmp_path / request.param))
+    yield store
+    store.close()
+
+
+def test_open_picks_backend_by_extension(tmp_path):
+    json_store = open_mapping_store(str(tmp_path / 'mapping.json'))
+    sqlite_store = open_mapping_store(str(tmp_path / 'mapping.sqlite'))
+    assert isinstance(json_store, JsonMappingStore) and isinstance(sqlite_store, SqliteMappingStore)
+    json_store.close()
+    sqlite_store.close()
+
+
+def test_keys_content_and_manifest(store):
+    store.set_bucket_name('bucket')
+    assert store.reserve_id('abc123')
+    assert not store.reserve_id('abc123')
+    store.add_key('a.jpg', 'abc123-0.jpg')
+    store.add_key('a.jpg', 'abc123-1.jpg')
+    store.add_content('sha-a', 'abc123-1.jpg', 10)
+    store.set_manifest_entry('/photos/a.jpg', 10, 1, 'sha-a', 'abc123-1.jpg')
+
+    assert store.get_bucket_name() == 'bucket'
+    assert store.is_id_used('abc123')
+    assert store.get_keys('a.jpg') == ['abc123-0.jpg', 'abc123-1.jpg']
+    assert store.has_key('abc123-0.jpg') and not store.has_key('missing.jpg')
+    assert store.get_content_key('sha-a') == 'abc123-1.jpg'
+
+    # A key renamed by a layout migration is renamed everywhere it is referenced
+    store.replace_key('abc123-1.jpg', 'ab/abc123-1.jpg')
+    assert store.get_keys('a.jpg') == ['abc123-0.jpg', 'ab/abc123-1.jpg']
+    assert store.get_content_key('sha-a') == 'ab/abc123-1.jpg'
+    assert store.load_manifest()['/photos/a.jpg']['key'] == 'ab/abc123-1.jpg'
+
+    assert store.remove_filename('a.jpg') == ['abc123-0.jpg', 'ab/abc123-1.jpg']
+    assert store.get_keys('a.jpg') == []
+
+
+def test_reserved_names_are_not_filenames(store):
+    store.set_bucket_name('bucket')
+    assert store.remove_filename('bucket_name') == []
+    assert store.get_bucket_name() == 'bucket'
+
+
+def test_failed_transaction_is_not_saved(store):
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            store.add_key('a.jpg', 'abc123-0.jpg')
+            raise RuntimeError('interrupted')
+    assert store.get_keys('a.jpg') == []
+
+
+def test_merge_mapping_skips_existing_keys(store):
+    store.add_key('a.jpg', 'abc123-0.jpg')
+    merge_mapping(store, {'bucket_name': 'bucket', 'used_ids': ['abc123', 'def456'],
+                          'a.jpg': ['abc123-0.jpg', 'abc123-1.jpg'], 'b.jpg': ['def456-0.jpg']})
+    merge_mapping(store, {'b.jpg': ['def456-0.jpg']})
+
+    mapping = store.load_mapping()
+    assert mapping['bucket_name'] == 'bucket'
+    assert mapping['used_ids'] == {'abc123', 'def456'}
+    assert mapping['a.jpg'] == ['abc123-0.jpg', 'abc123-1.jpg']
+    assert mapping['b.jpg'] == ['def456-0.jpg']
+
+
+def test_import_json_mapping_is_repeatable(tmp_path, store):
+    json_path = tmp_path / 'filename_mapping.json'
+    json_path.write_text(json.dumps({'bucket_name': 'bucket', 'used_ids': ['abc123'], 'a.jpg': ['abc123-0.jpg']}))
+    import_json_mapping(str(json_path), store)
+    import_json_mapping(str(json_path), store)
+    assert store.get_keys('a.jpg') == ['abc123-0.jpg']
+    assert store.get_bucket_name() == 'bucket'
+    assert store.is_id_used('abc123')
+
+
+def test_sqlite_store_persists(tmp_path):
+    path = str(tmp_path / 'mapping.sqlite')
+    store = open_mapping_store(path)
+    store.add_key('a.jpg', 'abc123-0.jpg')
+    store.set_setting('id_counter_6', '1')
+    store.close()
+
+    store = open_mapping_store(path)
+    assert store.get_keys('a.jpg') == ['abc123-0.jpg']
+    assert store.get_setting('id_counter_6') == '1'
+    store.close()
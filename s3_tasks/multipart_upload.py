@@ -0,0 +1,167 @@
+import argparse
+import base64
+import hashlib
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import botocore
+
+from Utilities.aws_clients import get_client
+
+
+default_threshold = 64 * 1024 * 1024  # Files at least this large use resumable multipart uploads
+default_part_size = 16 * 1024 * 1024
+default_concurrency = 4
+minimum_part_size = 5 * 1024 * 1024  # S3 rejects smaller parts except the last one
+maximum_parts = 10000
+
+# ---------------------------------------------------
+# Multipart Upload Functions
+# ---------------------------------------------------
+
+# ***************************************************
+# Choose a part size that fits within the part limit
+# ***************************************************
+def choose_part_size(file_size, part_size=default_part_size):
+    """Return a part size of at least part_size that needs no more than 10,000 parts."""
+    part_size = max(part_size, minimum_part_size)
+    return max(part_size, math.ceil(file_size / maximum_parts))
+
+# ***************************************************
+# Check whether a recorded upload still matches the file
+# ***************************************************
+def matches_recorded_upload(upload, key, file_size, file_mtime):
+    """Return True if a recorded multipart upload was started for this exact file content and key."""
+    return upload['key'] == key and upload['file_size'] == file_size and upload['file_mtime'] == file_mtime
+
+# ***************************************************
+# Upload one part of a file
+# ***************************************************
+def upload_part(s3_handshake, store, bucket_name, key, upload_id, filename, part_number, part_size):
+    """Upload a single part and record it in the mapping store."""
+    with open(filename, 'rb') as file:
+        file.seek((part_number - 1) * part_size)
+        body = file.read(part_size)
+    # S3 rejects the part if what it received doesn't match this digest
+    content_md5 = base64.b64encode(hashlib.md5(body).digest()).decode()
+    response = s3_handshake.upload_part(Bucket=bucket_name, Key=key, UploadId=upload_id,
+                                        PartNumber=part_number, Body=body, ContentMD5=content_md5)
+    store.add_multipart_part(upload_id, part_number, response['ETag'])
+    return part_number
+
+# ***************************************************
+# Upload a large file, resuming any recorded progress
+# ***************************************************
+def resumable_upload_file(s3_handshake, store, filename, bucket_name, key, part_size=default_part_size,
+                          concurrency=default_concurrency, metadata=None):
+    """Upload a file in parts, skipping parts recorded by an earlier interrupted run."""
+    file_size = os.path.getsize(filename)
+    file_mtime = os.path.getmtime(filename)
+
+    upload = store.get_multipart_upload(filename)
+    if upload and not matches_recorded_upload(upload, key, file_size, file_mtime):
+        print(f"{filename} changed since its interrupted upload. Starting over.")
+        abort_multipart_upload(s3_handshake, store, bucket_name, upload)
+        upload = None
+
+    if upload is None:
+        part_size = choose_part_size(file_size, part_size)
+        upload_id = s3_handshake.create_multipart_upload(Bucket=bucket_name, Key=key,
+                                                         Metadata=metadata or {})['UploadId']
+        store.start_multipart_upload(filename, key, upload_id, part_size, file_size, file_mtime, time.time())
+        completed_parts = {}
+    else:
+        upload_id = upload['upload_id']
+        part_size = upload['part_size']
+        completed_parts = store.get_multipart_parts(upload_id)
+        print(f"Resuming {filename}: {len(completed_parts)} parts already uploaded.")
+
+    part_count = max(1, math.ceil(file_size / part_size))
+    missing_parts = [number for number in range(1, part_count + 1) if number not in completed_parts]
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(
+                lambda number: upload_part(s3_handshake, store, bucket_name, key, upload_id, filename,
+                                           number, part_size),
+                missing_parts
+            ))
+    except botocore.exceptions.ClientError as e:
+        # The upload was aborted or expired on the S3 side, so the recorded parts are useless
+        if e.response['Error']['Code'] == 'NoSuchUpload':
+            store.forget_multipart_upload(upload_id)
+            print(f"Multipart upload for {filename} no longer exists. Starting over.")
+            return resumable_upload_file(s3_handshake, store, filename, bucket_name, key, part_size, concurrency,
+                                         metadata)
+        raise
+
+    completed_parts = store.get_multipart_parts(upload_id)
+    s3_handshake.complete_multipart_upload(
+        Bucket=bucket_name,
+        Key=key,
+        UploadId=upload_id,
+        MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': completed_parts[number]}
+                                   for number in sorted(completed_parts)]}
+    )
+    store.forget_multipart_upload(upload_id)
+
+# ***************************************************
+# Abort a recorded multipart upload
+# ***************************************************
+def abort_multipart_upload(s3_handshake, store, bucket_name, upload):
+    """Abort a multipart upload in S3 and forget it in the mapping store."""
+    try:
+        s3_handshake.abort_multipart_upload(Bucket=bucket_name, Key=upload['key'], UploadId=upload['upload_id'])
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchUpload':
+            raise
+    store.forget_multipart_upload(upload['upload_id'])
+
+# ***************************************************
+# Abort abandoned multipart uploads
+# ***************************************************
+def abort_abandoned_uploads(store, older_than_hours=24, s3_handshake=None):
+    """Abort multipart uploads in the bucket that were started more than older_than_hours ago."""
+    if s3_handshake is None:
+        s3_handshake = get_client('s3')
+    bucket_name = store.get_bucket_name()
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=older_than_hours)
+
+    aborted = 0
+    paginator = s3_handshake.get_paginator('list_multipart_uploads')
+    for page in paginator.paginate(Bucket=bucket_name):
+        for upload in page.get('Uploads', []):
+            if upload['Initiated'] >= cutoff:
+                continue
+            try:
+                s3_handshake.abort_multipart_upload(Bucket=bucket_name, Key=upload['Key'],
+                                                    UploadId=upload['UploadId'])
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] != 'NoSuchUpload':
+                    print(f"Error aborting upload of {upload['Key']}: {e.response['Error']['Message']}")
+                    continue
+            store.forget_multipart_upload(upload['UploadId'])
+            print(f"Aborted multipart upload of {upload['Key']} started {upload['Initiated']}.")
+            aborted += 1
+
+    print(f"Aborted {aborted} abandoned multipart uploads in '{bucket_name}'.")
+    return aborted
+
+# ---------------------------------------------------
+# Main Execution
+# ---------------------------------------------------
+
+if __name__ == '__main__':
+    from s3_tasks import upload_to_s3
+
+    parser = argparse.ArgumentParser(description='Abort abandoned multipart uploads in the upload bucket')
+    parser.add_argument('--older-than-hours', type=float, default=24,
+                        help='Only abort uploads started longer ago than this (default: 24)')
+    parser.add_argument('--mapping-file', default=upload_to_s3.db_file, help='Mapping store holding the bucket name')
+    args = parser.parse_args()
+
+    upload_to_s3.db_file = args.mapping_file
+    abort_abandoned_uploads(upload_to_s3.get_mapping_store(), older_than_hours=args.older_than_hours)
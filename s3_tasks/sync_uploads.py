@@ -0,0 +1,178 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from s3_tasks import upload_to_s3
+from s3_tasks.key_layout import delete_keys
+from Utilities.aws_clients import get_client
+
+
+# ---------------------------------------------------
+# Sync Planning Functions
+# ---------------------------------------------------
+
+# ***************************************************
+# Check whether a path is under one of the sync roots
+# ***************************************************
+def is_under_roots(path, roots):
+    """Return True if the path is one of the roots or inside one of them."""
+    return any(path == root or path.startswith(root.rstrip(os.sep) + os.sep) for root in roots)
+
+# ***************************************************
+# Compare the source tree with the manifest
+# ***************************************************
+def plan_sync(store, paths, max_workers=upload_to_s3.default_workers):
+    """Work out which sources are new, changed, touched, unchanged or missing without calling S3.
+
+    Sources that are listed but can't be read end up in 'errors' as (path, message), never in 'missing'.
+    """
+    roots = [os.path.abspath(path) for path in paths]
+    manifest = store.load_manifest()  # One read for the whole tree
+
+    stats = {}
+    errors = []
+    for path in upload_to_s3.expand_upload_paths(roots):
+        try:
+            stats[path] = os.stat(path)
+        except OSError as e:
+            print(f"Skipping {path}: {e}")
+            errors.append((path, str(e)))
+
+    # Matching size and mtime means unchanged; anything else is hashed to tell edits from touches
+    to_hash = [path for path, stat in stats.items()
+               if path not in manifest
+               or manifest[path]['size'] != stat.st_size
+               or manifest[path]['mtime_ns'] != stat.st_mtime_ns]
+
+    def hash_one(path):
+        try:
+            return upload_to_s3.hash_file(path), None
+        except OSError as e:
+            print(f"Skipping {path}: {e}")
+            return None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        hashed = dict(zip(to_hash, executor.map(hash_one, to_hash)))
+    digests = {path: sha256 for path, (sha256, error) in hashed.items() if error is None}
+    for path, (sha256, error) in hashed.items():
+        if error is not None:
+            errors.append((path, error))
+            del stats[path]
+            to_hash.remove(path)
+
+    plan = {'new': [], 'changed': [], 'touched': [], 'unchanged': len(stats) - len(to_hash), 'missing': [],
+            'errors': errors, 'stats': stats, 'digests': digests, 'manifest': manifest}
+    for path in to_hash:
+        if path not in manifest:
+            plan['new'].append(path)
+        elif manifest[path]['sha256'] == digests[path]:
+            plan['touched'].append(path)
+        else:
+            plan['changed'].append(path)
+    # A source that exists but couldn't be read is not missing; deleting its objects would lose data
+    unreadable = {path for path, error in errors}
+    plan['missing'] = sorted(path for path in manifest if path not in stats and path not in unreadable
+                             and is_under_roots(path, roots))
+    return plan
+
+# ---------------------------------------------------
+# Sync Execution Functions
+# ---------------------------------------------------
+
+# ***************************************************
+# Delete the objects of sources that no longer exist
+# ***************************************************
+def delete_missing_sources(store, missing, s3_handshake=None):
+    """Forget missing sources and delete objects that no other file maps to.
+
+    Returns (deleted keys, [(key, error message)] for the objects S3 failed to delete).
+    """
+    if s3_handshake is None:
+        s3_handshake = get_client('s3')
+
+    # Commit the mapping first so no upload can alias an orphaned key, then delete without holding the lock
+    orphaned_keys = []
+    with store.transaction():
+        bucket_name = store.get_bucket_name()
+        for path in missing:
+            for key in store.remove_filename(path):
+                if not store.has_key(key) and key not in orphaned_keys:
+                    orphaned_keys.append(key)
+                    store.remove_content_key(key)
+            store.remove_manifest_entry(path)
+
+    failed = delete_keys(s3_handshake, bucket_name, orphaned_keys)
+    failed_keys = {key for key, error in failed}
+    return [key for key in orphaned_keys if key not in failed_keys], failed
+
+# ***************************************************
+# Sync directories to the bucket
+# ***************************************************
+def sync_paths(store, paths, delete_missing=False, dry_run=False, max_workers=upload_to_s3.default_workers,
+               deduplicate_content=False):
+    """Upload new and changed sources and optionally delete objects whose source has disappeared."""
+    started = time.perf_counter()
+    plan = plan_sync(store, paths, max_workers=max_workers)
+    print(f"Planned sync in {time.perf_counter() - started:.2f}s: {len(plan['new'])} new, "
+          f"{len(plan['changed'])} changed, {len(plan['touched'])} touched, {plan['unchanged']} unchanged, "
+          f"{len(plan['missing'])} missing, {len(plan['errors'])} unreadable.")
+
+    if dry_run:
+        for label in ('new', 'changed', 'missing'):
+            for path in plan[label]:
+                print(f"{label.upper():8}{path}")
+        for path, error in plan['errors']:
+            print(f"ERROR   {path}: {error}")
+        return plan
+
+    stats, digests, manifest = plan['stats'], plan['digests'], plan['manifest']
+    uploads = plan['new'] + plan['changed']
+    results = upload_to_s3.upload_files_to_s3(uploads, max_workers=max_workers,
+                                              deduplicate_content=deduplicate_content,
+                                              known_digests=digests) if uploads else []
+
+    # Record what is now in the bucket so the next plan can skip it
+    with store.transaction():
+        for path in plan['touched']:
+            store.set_manifest_entry(path, stats[path].st_size, stats[path].st_mtime_ns, digests[path],
+                                     manifest[path]['key'])
+        for filename, key, status, error in results:
+            if status != 'failed':
+                store.set_manifest_entry(filename, stats[filename].st_size, stats[filename].st_mtime_ns,
+                                         digests[filename], key)
+
+    if plan['missing']:
+        if delete_missing:
+            deleted_keys, failed_deletes = delete_missing_sources(store, plan['missing'])
+            for key, error in failed_deletes:
+                print(f"NOT DELETED {key}: {error}")
+            print(f"Removed {len(plan['missing'])} missing sources and deleted {len(deleted_keys)} objects.")
+            if failed_deletes:
+                print(f"{len(failed_deletes)} objects could not be deleted. They are no longer mapped and can be "
+                      f"removed by hand.")
+        else:
+            for path in plan['missing']:
+                print(f"MISSING {path}")
+            print(f"{len(plan['missing'])} sources no longer exist. Use --delete to remove their objects.")
+    return plan
+
+# ---------------------------------------------------
+# Main Execution
+# ---------------------------------------------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Upload only new or changed files from directories to S3')
+    parser.add_argument('paths', nargs='+', help='Directories or files to sync')
+    parser.add_argument('--delete', action='store_true', help='Delete objects whose source file has disappeared')
+    parser.add_argument('--dry-run', action='store_true', help='Only print the sync plan')
+    parser.add_argument('--dedup', action='store_true', help='Skip uploading content already in the bucket')
+    parser.add_argument('--workers', type=int, default=upload_to_s3.default_workers,
+                        help='Number of parallel hashes and uploads')
+    parser.add_argument('--mapping-file', default=upload_to_s3.db_file, help='Mapping store holding the manifest')
+    args = parser.parse_args()
+
+    upload_to_s3.db_file = args.mapping_file
+    upload_to_s3.initialize_mapping_store()
+    sync_paths(upload_to_s3.get_mapping_store(), args.paths, delete_missing=args.delete, dry_run=args.dry_run,
+               max_workers=args.workers, deduplicate_content=args.dedup)
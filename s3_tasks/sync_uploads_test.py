@@ -0,0 +1,84 @@
+import os
+
+from moto import mock_aws
+
+from s3_tasks import upload_to_s3
+from s3_tasks.mapping_store import open_mapping_store
+from s3_tasks.sync_uploads import plan_sync, sync_paths
+from Utilities.aws_clients import get_client, reset_clients
+
+
+def write(path, content):
+    with open(path, 'wb') as file:
+        file.write(content)
+
+
+def record(store, path, key):
+    stat = os.stat(path)
+    store.set_manifest_entry(path, stat.st_size, stat.st_mtime_ns, upload_to_s3.hash_file(path), key)
+
+
+def test_plan_sorts_sources(tmp_path, monkeypatch):
+    store = open_mapping_store(str(tmp_path / 'mapping.sqlite'))
+    photos = tmp_path / 'photos'
+    photos.mkdir()
+    paths = {name: str(photos / f"{name}.jpg") for name in ('unchanged', 'touched', 'changed', 'new', 'unreadable')}
+    for name, path in paths.items():
+        write(path, name.encode())
+        if name != 'new':
+            record(store, path, f"{name}-key")
+    write(paths['changed'], b'edited')
+    os.utime(paths['touched'], ns=(0, 0))
+    os.utime(paths['unreadable'], ns=(0, 0))
+    store.set_manifest_entry(str(photos / 'deleted.jpg'), 1, 1, 'sha', 'deleted-key')
+    store.set_manifest_entry(str(tmp_path / 'elsewhere' / 'other.jpg'), 1, 1, 'sha', 'other-key')
+
+    hash_file = upload_to_s3.hash_file
+
+    def failing_hash(path):
+        if path == paths['unreadable']:
+            raise PermissionError('Permission denied')
+        return hash_file(path)
+    monkeypatch.setattr(upload_to_s3, 'hash_file', failing_hash)
+
+    plan = plan_sync(store, [str(photos)])
+    assert plan['new'] == [paths['new']]
+    assert plan['changed'] == [paths['changed']]
+    assert plan['touched'] == [paths['touched']]
+    assert plan['unchanged'] == 1
+    # Only sources under the synced roots can be missing, and unreadable ones never are
+    assert plan['missing'] == [str(photos / 'deleted.jpg')]
+    assert plan['errors'] == [(paths['unreadable'], 'Permission denied')]
+    store.close()
+
+
+@mock_aws
+def test_sync_uploads_changes_and_deletes_missing(tmp_path, monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setattr(upload_to_s3, 'db_file', str(tmp_path / 'mapping.sqlite'))
+    monkeypatch.setattr(upload_to_s3, 'mapping_store', None)
+    monkeypatch.setattr(upload_to_s3, 'id_allocator', None)
+    reset_clients()
+    store = upload_to_s3.get_mapping_store()
+
+    photos = tmp_path / 'photos'
+    photos.mkdir()
+    kept, removed = str(photos / 'kept.jpg'), str(photos / 'removed.jpg')
+    write(kept, b'kept')
+    write(removed, b'removed')
+    plan = sync_paths(store, [str(photos)])
+    assert sorted(plan['new']) == [kept, removed]
+
+    manifest = store.load_manifest()
+    s3_client = get_client('s3')
+    bucket_name = store.get_bucket_name()
+    assert s3_client.get_object(Bucket=bucket_name, Key=manifest[kept]['key'])['Body'].read() == b'kept'
+
+    os.remove(removed)
+    plan = sync_paths(store, [str(photos)], delete_missing=True)
+    assert plan['new'] == [] and plan['unchanged'] == 1 and plan['missing'] == [removed]
+    keys = [obj['Key'] for obj in s3_client.list_objects_v2(Bucket=bucket_name).get('Contents', [])]
+    assert keys == [manifest[kept]['key']]
+    assert removed not in store.load_manifest() and store.get_keys(removed) == []
+    store.close()
+    reset_clients()
@@ -0,0 +1,40 @@
+import os
+
+from moto import mock_aws
+
+from s3_tasks import upload_to_s3
+from Utilities.aws_clients import get_client, reset_clients
+
+
+def write(path, content):
+    with open(path, 'wb') as file:
+        file.write(content)
+
+
+@mock_aws
+def test_edited_duplicates_get_separate_keys(tmp_path, monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setattr(upload_to_s3, 'db_file', str(tmp_path / 'mapping.sqlite'))
+    monkeypatch.setattr(upload_to_s3, 'mapping_store', None)
+    monkeypatch.setattr(upload_to_s3, 'id_allocator', None)
+    reset_clients()
+
+    first, second = str(tmp_path / 'a.jpg'), str(tmp_path / 'b.jpg')
+    write(first, b'same content')
+    write(second, b'same content')
+    results = upload_to_s3.upload_files_to_s3([first, second], deduplicate_content=True)
+    assert {key for _, key, _, _ in results} == {results[0][1]}
+
+    # Both files now carry the same random ID; their next keys must still differ
+    write(first, b'A edited')
+    write(second, b'B edited')
+    results = upload_to_s3.upload_files_to_s3([first, second], deduplicate_content=True)
+    keys = {filename: key for filename, key, status, _ in results if status == 'uploaded'}
+    assert len(keys) == 2 and keys[first] != keys[second]
+
+    s3_client = get_client('s3')
+    bucket_name = upload_to_s3.get_mapping_store().get_bucket_name()
+    for filename, content in ((first, b'A edited'), (second, b'B edited')):
+        assert s3_client.get_object(Bucket=bucket_name, Key=keys[filename])['Body'].read() == content
+    upload_to_s3.get_mapping_store().close()
+    reset_clients()
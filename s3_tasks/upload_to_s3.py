@@ -1,108 +1,199 @@
-import boto3
-import random
 import re
-import json
 import os
 import uuid
 import botocore
 import argparse
+import base64
+import glob
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from s3_tasks.mapping_store import open_mapping_store, import_json_mapping
+from s3_tasks.id_allocator import IdAllocator, IdSpaceExhausted, default_id_width
+from s3_tasks.key_layout import apply_key_layout, get_prefix_depth, strip_key_prefix
+from s3_tasks.list_objects import print_s3_objects
+from s3_tasks.multipart_upload import (resumable_upload_file, matches_recorded_upload, default_threshold,
+                                       default_part_size, default_concurrency)
+from Utilities.aws_clients import get_client
+from Utilities.profiling import add_profile_arguments, profile_from_args
 
 
-alphanum = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
-db_file = 'filename_mapping.json'
+mapping_dir = os.path.dirname(os.path.abspath(__file__))
+default_db_file = os.path.join(mapping_dir, 'filename_mapping.sqlite')
+db_file = default_db_file
+legacy_db_file = os.path.join(mapping_dir, 'filename_mapping.json')
+default_workers = 8
+id_width = default_id_width
+bucket_cache_ttl = 3600  # Seconds a successful bucket check is trusted
+multipart_threshold = default_threshold
+multipart_part_size = default_part_size
+multipart_concurrency = default_concurrency
+deduplicate = False  # Hash files and alias repeats to the key already holding their content
+hash_chunk_size = 1024 * 1024
+
+mapping_store = None
+id_allocator = None
 
 # ---------------------------------------------------
 # Utility Functions
 # ---------------------------------------------------
 
 # ***************************************************
-# Initialize the JSON file if it does not exist
+# Open the mapping store once per process
 # ***************************************************
-def initialize_json():
-    """Initialize the JSON file with bucket_name and an empty used_ids list."""
-    if not os.path.exists(db_file):
-        print(f"{db_file} not found. Initializing it now.")
-        filename_mapping = {
-            'bucket_name': '',  # Initialize as an empty string
-            'used_ids': []  # Initialize as an empty list
-        }
-        save_filename_mapping(filename_mapping)
-        print(f"Initialized {db_file} with bucket_name and used_ids.")
-    else:
+def get_mapping_store():
+    """Return the mapping store for db_file, opening it on first use."""
+    global mapping_store
+    if mapping_store is None:
+        mapping_store = open_mapping_store(db_file)
+    return mapping_store
+
+# ***************************************************
+# Create the ID allocator once per process
+# ***************************************************
+def get_id_allocator():
+    """Return the ID allocator for the mapping store, creating it on first use."""
+    global id_allocator
+    if id_allocator is None:
+        id_allocator = IdAllocator(get_mapping_store(), width=id_width)
+    return id_allocator
+
+# ***************************************************
+# Initialize the mapping store if it does not exist
+# ***************************************************
+def initialize_mapping_store(legacy_file=None):
+    """Create the mapping store, importing a legacy JSON mapping into it the first time.
+
+    The repo's filename_mapping.json is only imported into the default store; pass legacy_file to import
+    a JSON mapping into another one.
+    """
+    if os.path.exists(db_file):
         print(f"{db_file} already exists. No need to initialize.")
+        return
+
+    print(f"{db_file} not found. Initializing it now.")
+    store = get_mapping_store()
+    if legacy_file is None and db_file == default_db_file:
+        legacy_file = legacy_db_file
+    if legacy_file and legacy_file != db_file and os.path.exists(legacy_file):
+        import_json_mapping(legacy_file, store)
+    else:
+        store.save_mapping({'bucket_name': '', 'used_ids': set()})
+    print(f"Initialized {db_file} with bucket_name and used_ids.")
 
 # ***************************************************
-# Load filename mapping from JSON
+# Load the full filename mapping
 # ***************************************************
 def load_filename_mapping():
-    """Loads the filename mapping data from the JSON file."""
-    with open(db_file, 'r') as file:
-        filename_mapping = json.load(file)
-        # Convert 'used_ids' to a set for efficient operations
-        filename_mapping['used_ids'] = set(filename_mapping.get('used_ids', []))
-    return filename_mapping
+    """Loads the filename mapping data from the mapping store."""
+    return get_mapping_store().load_mapping()
 
 # ***************************************************
-# Save filename mapping to JSON
+# Save the full filename mapping
 # ***************************************************
 def save_filename_mapping(mapping):
-    """Saves the filename mapping data to the JSON file."""
-    # Convert 'used_ids' back to a list for JSON serialization
-    mapping['used_ids'] = list(mapping['used_ids'])
-    with open(db_file, 'w') as file:
-        json.dump(mapping, file)
+    """Replaces the mapping store contents with the given filename mapping."""
+    get_mapping_store().save_mapping(mapping)
 
 # ---------------------------------------------------
 # S3 Bucket Management Functions
 # ---------------------------------------------------
 
+# ***************************************************
+# Check whether a bucket error means the bucket is gone
+# ***************************************************
+def is_no_such_bucket_error(error):
+    """Return True if the error, or the error it was raised from, is NoSuchBucket."""
+    while error is not None:
+        if isinstance(error, botocore.exceptions.ClientError):
+            return error.response['Error']['Code'] in ('NoSuchBucket', '404')
+        error = error.__cause__ or error.__context__
+    return False
+
+# ***************************************************
+# Validated-bucket cache
+# ***************************************************
+def is_bucket_cached(store, bucket_name):
+    """Return True if the bucket was validated within the last bucket_cache_ttl seconds."""
+    with store.transaction():
+        validated_name = store.get_setting('bucket_validated_name')
+        validated_at = float(store.get_setting('bucket_validated_at') or 0)
+    return validated_name == bucket_name and time.time() - validated_at < bucket_cache_ttl
+
+def cache_bucket(store, bucket_name):
+    """Remember that the bucket was just validated."""
+    with store.transaction():
+        store.set_setting('bucket_validated_name', bucket_name)
+        store.set_setting('bucket_validated_at', str(time.time()))
+
+def invalidate_bucket_cache(store):
+    """Forget the last bucket validation so the next check goes to S3."""
+    store.set_setting('bucket_validated_at', '0')
+
+# ***************************************************
+# Check a single bucket with head_bucket
+# ***************************************************
+def bucket_exists(s3_handshake, bucket_name):
+    """Check whether the bucket exists. Errors other than a missing bucket, such as 403, are raised."""
+    try:
+        s3_handshake.head_bucket(Bucket=bucket_name)
+        return True
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchBucket'):
+            return False
+        raise
+
 # ***************************************************
 # Check if the S3 bucket exists, otherwise create it
 # ***************************************************
 def check_or_create_bucket():
     """Check or create the S3 bucket."""
-    filename_mapping = load_filename_mapping()  # Load the filename mapping from JSON
-    s3_handshake = boto3.client('s3')  # Connect to S3
-    bucket_name = filename_mapping['bucket_name']  # Check if a bucket name is stored in the mapping
+    store = get_mapping_store()
+    bucket_name = store.get_bucket_name()  # Check if a bucket name is stored in the mapping
+
+    # Trust a recent validation instead of going to S3 on every upload
+    if bucket_name and is_bucket_cached(store, bucket_name):
+        return bucket_name
+
+    s3_handshake = get_client('s3')  # Connect to S3
 
     # If there's already a bucket name in the mapping, check if the bucket exists in S3
-    if bucket_name:
-        response = s3_handshake.list_buckets()
-        for bucket in response['Buckets']:
-            if bucket['Name'] == bucket_name:
-                print(f"Bucket '{bucket_name}' already exists.")
-                return bucket_name  # Reuse the existing bucket
+    if bucket_name and bucket_exists(s3_handshake, bucket_name):
+        print(f"Bucket '{bucket_name}' already exists.")
+        cache_bucket(store, bucket_name)
+        return bucket_name  # Reuse the existing bucket
+
+    # If no bucket exists in the mapping or the bucket is not found in S3, create a new one.
+    # S3 is called outside the store's write lock, so concurrent runs may both create one.
+    new_bucket_name = f"war-in-pocket-{uuid.uuid4()}"  # Create a new unique bucket name
+    s3_handshake.create_bucket(Bucket=new_bucket_name)  # Create the bucket in S3
 
-    # If no bucket exists in the mapping or the bucket is not found in S3, create a new one
-    bucket_name = f"war-in-pocket-{uuid.uuid4()}"  # Create a new unique bucket name
-    s3_handshake.create_bucket(Bucket=bucket_name)  # Create the bucket in S3
-    print(f"Bucket created: {bucket_name}")
+    # Store the new bucket name in the mapping, unless another run stored its own meanwhile
+    with store.transaction():
+        current_bucket_name = store.get_bucket_name()
+        if current_bucket_name == bucket_name:
+            store.set_bucket_name(new_bucket_name)
+            cache_bucket(store, new_bucket_name)
 
-    # Store the new bucket name in the mapping
-    filename_mapping['bucket_name'] = bucket_name
-    save_filename_mapping(filename_mapping)  # Save the updated mapping
+    if current_bucket_name != bucket_name:
+        print(f"Bucket '{current_bucket_name}' was created by another run.")
+        try:
+            s3_handshake.delete_bucket(Bucket=new_bucket_name)  # Still empty, nothing was uploaded to it
+        except botocore.exceptions.ClientError as e:
+            print(f"Could not delete the unused bucket '{new_bucket_name}': {e.response['Error']['Message']}")
+        return current_bucket_name
 
-    return bucket_name  # Return the bucket name
+    print(f"Bucket created: {new_bucket_name}")
+    return new_bucket_name  # Return the bucket name
 
 # ***************************************************
 # List S3 objects
 # ***************************************************
-def list_s3_objects():
-    """List objects in the S3 bucket."""
-    filename_mapping = load_filename_mapping()  # Ensure you're working with the latest mapping
-    try:
-        s3_handshake = boto3.client('s3')
-        response = s3_handshake.list_objects_v2(Bucket=filename_mapping['bucket_name'])
-        if 'Contents' in response:
-            print("Files in the bucket:")
-            for obj in response['Contents']:
-                print(obj['Key'])
-        else:
-            print("The bucket is empty or does not exist.")
-    except botocore.exceptions.ClientError as e:
-        print(f"Error listing files: {e.response['Error']['Message']}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+def list_s3_objects(prefix='', start_after='', max_keys=None, output_format='text'):
+    """Stream the objects in the S3 bucket, optionally under a single key prefix."""
+    bucket_name = get_mapping_store().get_bucket_name()
+    return print_s3_objects(bucket_name, prefix=prefix, start_after=start_after, max_keys=max_keys,
+                            output_format=output_format)
 
 # ---------------------------------------------------
 # Filename Management Functions
@@ -116,67 +207,247 @@ def get_file_extension(filename):
     match = re.search(r'\.[a-zA-Z0-9]+$', filename)
     return match.group() if match else ''
 
+# ***************************************************
+# Hash a file's content
+# ***************************************************
+def hash_file(filename):
+    """Return the SHA-256 hex digest of a file, reading it in fixed-size chunks."""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(hash_chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# ***************************************************
+# Allocate a random filename in the mapping store
+# ***************************************************
+def allocate_filename(store, filename, reserved_keys=None):
+    """Allocate a random filename with a suffix if needed, reserving its ID in the store.
+
+    reserved_keys holds the keys already handed out in the current batch, which are not in the store
+    until the batch is recorded; the new key is added to it.
+    """
+    if reserved_keys is None:
+        reserved_keys = set()
+    with store.transaction():
+        existing_keys = [strip_key_prefix(key) for key in store.get_keys(filename)]
+        suffix = 0
+        prefix_depth = get_prefix_depth(store)
+        if existing_keys:
+            random_id = existing_keys[0].rsplit('-', 1)[0]
+            existing_keys = set(existing_keys)
+            # Deduplicated aliases can point at another file's ID, so check the key index and the batch too
+            while True:
+                key = apply_key_layout(f'{random_id}-{suffix}{get_file_extension(filename)}', prefix_depth)
+                if strip_key_prefix(key) not in existing_keys and key not in reserved_keys \
+                        and not store.has_key(key):
+                    break
+                suffix += 1
+            store.reserve_id(random_id)
+        else:
+            random_id = get_id_allocator().allocate()
+            key = apply_key_layout(f'{random_id}-{suffix}{get_file_extension(filename)}', prefix_depth)
+
+    reserved_keys.add(key)
+    return key
+
 # ***************************************************
 # Generate a random filename
 # ***************************************************
 def generate_random_filename(filename):
     """Generate a random filename with a suffix if needed."""
-    filename_mapping = load_filename_mapping()  # Load the latest mapping
-    suffix = 0
-    if filename in filename_mapping:
-        random_id = filename_mapping[filename][0].rsplit('-', 1)[0]
-        while f'{random_id}-{suffix}{get_file_extension(filename)}' in filename_mapping[filename]:
-            suffix += 1
-    else:
-        random_id = ''.join(random.sample(alphanum, 2))
-        while random_id in filename_mapping['used_ids']:
-            random_id = ''.join(random.sample(alphanum, 2))
-    filename_mapping['used_ids'].add(random_id)
-    save_filename_mapping(filename_mapping)  # Save the updated mapping
+    return allocate_filename(get_mapping_store(), filename)
 
-    new_filename = f'{random_id}-{suffix}{get_file_extension(filename)}'
-    return new_filename
+# ***************************************************
+# Pick the key for an upload
+# ***************************************************
+def allocate_upload_key(store, filename, reserved_keys=None):
+    """Reuse the key of an interrupted multipart upload of the same file, otherwise allocate a new one."""
+    upload = store.get_multipart_upload(filename)
+    if upload and os.path.exists(filename) and matches_recorded_upload(
+            upload, upload['key'], os.path.getsize(filename), os.path.getmtime(filename)):
+        if reserved_keys is not None:
+            reserved_keys.add(upload['key'])
+        return upload['key']
+    return allocate_filename(store, filename, reserved_keys)
 
 # ---------------------------------------------------
 # File Upload Functions
 # ---------------------------------------------------
 
 # ***************************************************
-# Upload a file to S3
+# Expand paths, directories and globs into a file list
 # ***************************************************
-def upload_file_to_s3(filename):
-    """Upload a file to S3 and update the filename mapping."""
-    filename_mapping = load_filename_mapping()  # Load the mapping once at the start
-    s3_handshake = boto3.client('s3')
+def expand_upload_paths(paths):
+    """Expand files, directories and glob patterns into an ordered list of unique files."""
+    filenames = []
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            matches = []
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                matches.extend(os.path.join(root, name) for name in sorted(files))
+        elif glob.has_magic(path):
+            matches = sorted(match for match in glob.glob(path, recursive=True) if os.path.isfile(match))
+        else:
+            matches = [path]
 
-    # Generate a new filename before attempting the upload
-    new_filename = generate_random_filename(filename)
+        if not matches:
+            print(f"No files matched '{path}'.")
+        for match in matches:
+            if match not in seen:
+                seen.add(match)
+                filenames.append(match)
+    return filenames
 
-    try:
-        # Ensure the bucket exists before uploading
-        check_or_create_bucket()
+# ***************************************************
+# Upload a single file with an optional checksum
+# ***************************************************
+def put_file(s3_handshake, store, filename, bucket_name, key, sha256=None):
+    """Upload one file, letting S3 verify the content against its SHA-256 when one is given."""
+    metadata = {'sha256': sha256} if sha256 else None
+    if os.path.getsize(filename) >= multipart_threshold:
+        resumable_upload_file(s3_handshake, store, filename, bucket_name, key, part_size=multipart_part_size,
+                              concurrency=multipart_concurrency, metadata=metadata)
+    elif sha256:
+        # S3 rejects the upload if the received bytes don't hash to the stored checksum
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        with open(filename, 'rb') as file:
+            s3_handshake.put_object(Bucket=bucket_name, Key=key, Body=file, ChecksumSHA256=checksum,
+                                    Metadata=metadata)
+    else:
+        s3_handshake.upload_file(filename, bucket_name, key)
 
-        # Upload the file to S3 with the generated filename
-        s3_handshake.upload_file(
-            filename,
-            filename_mapping['bucket_name'],
-            new_filename
-        )
+# ***************************************************
+# Upload many files to S3 over a thread pool
+# ***************************************************
+def upload_files_to_s3(filenames, max_workers=default_workers, deduplicate_content=None, known_digests=None):
+    """Upload files to S3 over a bounded thread pool and commit the mapping once per batch."""
+    # Each result is (filename, key, status, error) with status 'uploaded', 'deduplicated' or 'failed'
 
-        # Update filename_mapping only after a successful upload
-        if filename not in filename_mapping:
-            filename_mapping[filename] = []
-        filename_mapping[filename].append(new_filename)
-        save_filename_mapping(filename_mapping)  # Save the updated mapping
+    filenames = list(filenames)
+    results = []
+    if not filenames:
+        print("No files to upload.")
+        return results
+    if deduplicate_content is None:
+        deduplicate_content = deduplicate
 
-        print(f"File {filename} uploaded successfully as {new_filename}.")
+    # Ensure the bucket exists once for the whole batch
+    store = get_mapping_store()
+    bucket_name = check_or_create_bucket()
+    started = time.perf_counter()
 
-    except botocore.exceptions.ClientError as e:
-        print(f"Upload failed: {e.response['Error']['Message']}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+    # Hash in parallel before allocating, so repeated content never uses up an ID
+    digests = dict(known_digests or {})
+    if deduplicate_content:
+        def hash_one(filename):
+            try:
+                return filename, hash_file(filename), None
+            except OSError as e:
+                return filename, None, str(e)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            unhashed = [filename for filename in filenames if filename not in digests]
+            for filename, sha256, error in executor.map(hash_one, unhashed):
+                if error is None:
+                    digests[filename] = sha256
+                else:
+                    results.append((filename, None, 'failed', error))
+
+    # Allocate every name up front in one transaction; workers only record multipart progress
+    allocations = []
+    aliases = []  # (filename, sha256) whose content is already stored or uploaded earlier in the batch
+    batch_keys = {}
+    reserved_keys = set()  # Keys allocated in this batch, only added to the store after the uploads
+    with store.transaction():
+        for filename in filenames:
+            if deduplicate_content and filename not in digests:
+                continue
+            sha256 = digests.get(filename) if deduplicate_content else None
+            if sha256 and (sha256 in batch_keys or store.get_content_key(sha256)):
+                aliases.append((filename, sha256))
+                continue
+            try:
+                key = allocate_upload_key(store, filename, reserved_keys)
+            except IdSpaceExhausted as e:
+                # Files that already have an ID still get a key; the rest are reported as failed
+                results.append((filename, None, 'failed', str(e)))
+                continue
+            if sha256:
+                batch_keys[sha256] = key
+            allocations.append((filename, key))
 
-    list_s3_objects()  # No need to save mapping again
+    # One client shared by all workers, with enough pooled connections for each of them and their parts
+    pool_size = max(max_workers * multipart_concurrency, 10)
+    s3_handshake = get_client('s3', min_pool_connections=pool_size)
+
+    def upload_one(allocation):
+        filename, new_filename = allocation
+        try:
+            put_file(s3_handshake, store, filename, bucket_name, new_filename, digests.get(filename))
+            return filename, new_filename, 'uploaded', None
+        except Exception as e:
+            if is_no_such_bucket_error(e):
+                invalidate_bucket_cache(store)
+            if isinstance(e, botocore.exceptions.ClientError):
+                return filename, new_filename, 'failed', e.response['Error']['Message']
+            return filename, new_filename, 'failed', str(e)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results.extend(executor.map(upload_one, allocations))
+
+    # Record successful uploads and aliases, and commit the mapping once
+    with store.transaction():
+        for filename, new_filename, status, error in results:
+            if status == 'uploaded':
+                store.add_key(filename, new_filename)
+                if deduplicate_content:
+                    store.add_content(digests[filename], new_filename, os.path.getsize(filename))
+        for filename, sha256 in aliases:
+            existing_key = store.get_content_key(sha256)
+            if existing_key:
+                if existing_key not in store.get_keys(filename):
+                    store.add_key(filename, existing_key)
+                results.append((filename, existing_key, 'deduplicated', None))
+            else:
+                results.append((filename, None, 'failed', 'Upload of identical content failed'))
+    elapsed = time.perf_counter() - started
+
+    report_upload_results(results, elapsed)
+    return results
+
+# ***************************************************
+# Report per-file results for a batch
+# ***************************************************
+def report_upload_results(results, elapsed):
+    """Print per-file success or failure and the batch throughput."""
+    succeeded = 0
+    for filename, new_filename, status, error in results:
+        if status == 'uploaded':
+            succeeded += 1
+            print(f"OK     {filename} -> {new_filename}")
+        elif status == 'deduplicated':
+            succeeded += 1
+            print(f"DEDUP  {filename} -> {new_filename}")
+        else:
+            print(f"FAILED {filename}: {error}")
+
+    rate = len(results) / elapsed if elapsed > 0 else float(len(results))
+    print(f"Uploaded {succeeded}/{len(results)} files in {elapsed:.2f}s ({rate:.1f} files/s).")
+
+# ***************************************************
+# Upload a file to S3
+# ***************************************************
+def upload_file_to_s3(filename, list_after_upload=False):
+    """Upload a file to S3 and update the filename mapping."""
+    results = upload_files_to_s3([filename], max_workers=1)
+
+    # Listing costs as much as the bucket is large, so it only runs on request
+    if list_after_upload:
+        list_s3_objects()
+    return results
 
 # ---------------------------------------------------
 # Main Execution
@@ -184,11 +455,46 @@ def upload_file_to_s3(filename):
 
 if __name__ == '__main__':
     # Argument parsing and execution for when the script is run directly
-    parser = argparse.ArgumentParser(description='Upload a file to S3')
-    parser.add_argument('filename', help='Your file\'s path')
+    parser = argparse.ArgumentParser(description='Upload files to S3')
+    parser.add_argument('paths', nargs='+', help='File paths, directories or glob patterns to upload')
+    parser.add_argument('--workers', type=int, default=default_workers,
+                        help=f'Number of parallel uploads (default: {default_workers})')
+    parser.add_argument('--id-width', type=int, default=default_id_width,
+                        help=f'Number of characters in newly allocated IDs (default: {default_id_width})')
+    parser.add_argument('--bucket-cache-ttl', type=float, default=bucket_cache_ttl,
+                        help=f'Seconds to trust a successful bucket check (default: {bucket_cache_ttl})')
+    parser.add_argument('--multipart-threshold', type=int, default=multipart_threshold,
+                        help='Files of at least this many bytes use resumable multipart uploads')
+    parser.add_argument('--part-size', type=int, default=multipart_part_size,
+                        help='Multipart part size in bytes (minimum 5 MiB)')
+    parser.add_argument('--part-concurrency', type=int, default=multipart_concurrency,
+                        help='Parallel part uploads per file')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Skip uploading content that is already in the bucket and verify checksums')
+    parser.add_argument('--list', action='store_true', help='List the bucket after uploading')
+    parser.add_argument('--mapping-file',
+                        help='Mapping store to use; a .json path keeps the legacy JSON format')
+    parser.add_argument('--import-mapping', metavar='JSON',
+                        help='Legacy JSON mapping to import when the mapping store is created')
+    add_profile_arguments(parser)
     args = parser.parse_args()
-    filename = args.filename
 
-    # Initialize the JSON file and start the upload process
-    initialize_json()
-    upload_file_to_s3(filename)
+    if args.mapping_file:
+        db_file = args.mapping_file
+    id_width = args.id_width
+    bucket_cache_ttl = args.bucket_cache_ttl
+    multipart_threshold = args.multipart_threshold
+    multipart_part_size = args.part_size
+    multipart_concurrency = args.part_concurrency
+    deduplicate = args.dedup
+
+    # Initialize the mapping store and start the upload process
+    with profile_from_args(args, 'upload_to_s3'):
+        initialize_mapping_store(args.import_mapping)
+        filenames = expand_upload_paths(args.paths)
+        if len(filenames) == 1:
+            upload_file_to_s3(filenames[0], list_after_upload=args.list)
+        else:
+            upload_files_to_s3(filenames, max_workers=args.workers)
+            if args.list:
+                list_s3_objects()